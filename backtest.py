@@ -0,0 +1,136 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+# Backtest tín hiệu cắt lên MACD/MA200 trên toàn bộ ma trận giá (mã × ngày) cùng lúc, dùng cho dashboard (c1.py).
+# Lưới tham số được chia cho một process pool.
+
+# Nhãn của dòng tổng hợp mọi mã trong kết quả
+MARKET_LABEL = "Toàn thị trường"
+
+# Kết quả backtest của một bộ tham số
+@dataclass
+class BacktestResult:
+    """Thống kê lệnh theo ngành và đường vốn của một bộ tham số.
+
+    `summary` có index là ngành (dòng cuối là MARKET_LABEL) và các cột Số lệnh, Tỷ lệ thắng (%), LN TB (%) tính trên
+    các lệnh đã đóng. `equity` (nhóm × ngày, theo thứ tự `equity_labels`) là đường vốn khi mỗi ngày chia đều vốn cho
+    các vị thế đang mở của nhóm (đứng ngoài thị trường khi không có vị thế).
+    """
+    params: dict
+    summary: pd.DataFrame
+    equity_labels: np.ndarray
+    equity: np.ndarray
+
+# Hàm tính cờ cắt lên/cắt xuống của một quy tắc
+def crossover_signals(close, rule, fast=12, slow=26, signal=9, ma_window=200):
+    """(cắt lên, cắt xuống) dạng ma trận bool mã × ngày, tính một lượt cho mọi mã.
+
+    rule 'MACD': MACD(fast, slow) cắt đường Signal(signal); rule 'MA': giá cắt MA(ma_window). Cùng công thức với
+    compute_technicals của c1.py (ewm adjust=False, rolling đủ cửa sổ).
+    """
+    df_close = pd.DataFrame(close.T, dtype=np.float64)
+    if rule == 'MACD':
+        line = df_close.ewm(span=fast, adjust=False).mean() - df_close.ewm(span=slow, adjust=False).mean()
+        reference = line.ewm(span=signal, adjust=False).mean()
+    else:
+        line, reference = df_close, df_close.rolling(window=ma_window).mean()
+    previous_line, previous_reference = line.shift(1), reference.shift(1)
+    up = (line > reference) & (previous_line <= previous_reference)
+    down = (line < reference) & (previous_line >= previous_reference)
+    return up.to_numpy().T, down.to_numpy().T
+
+# Hàm backtest một bộ tín hiệu với nhiều thời gian nắm giữ
+def backtest_signals(close, groups, labels, up, down, holdings, exit_on_cross=False):
+    """Danh sách (thời gian nắm giữ, summary, equity) cho từng giá trị trong `holdings`.
+
+    Mua tại giá đóng cửa ngày có tín hiệu cắt lên, bán sau `holding` phiên (hoặc sớm hơn ở phiên cắt xuống đầu tiên
+    nếu `exit_on_cross`). Giá bằng 0 coi như không có dữ liệu; giá bán là giá dương gần nhất, lệnh chưa đến ngày bán
+    không tính vào thống kê.
+    `groups` là chỉ số ngành của từng mã (-1 nếu không có ngành), `labels` là tên các ngành.
+    """
+    n_codes, n_dates = close.shape
+    traded = close > 0
+    prices = pd.DataFrame(np.where(traded, close, np.nan).T, dtype=np.float64).ffill().to_numpy().T
+    codes, entry_days = np.nonzero(up & traded)
+    # Phiên cắt xuống đầu tiên sau mỗi ngày (n_dates nếu không còn)
+    next_down = np.where(down, np.arange(n_dates), n_dates)
+    next_down = np.minimum.accumulate(next_down[:, ::-1], axis=1)[:, ::-1]
+    next_down = np.concatenate([next_down[:, 1:], np.full((n_codes, 1), n_dates)], axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_returns = np.nan_to_num(prices[:, 1:] / prices[:, :-1] - 1)
+    one_hot = np.zeros((len(labels) + 1, n_codes))
+    one_hot[groups[groups >= 0], np.flatnonzero(groups >= 0)] = 1
+    one_hot[-1] = 1  # dòng cuối: mọi mã
+    group_labels = np.append(np.asarray(labels, dtype=object), MARKET_LABEL)
+
+    results = []
+    for holding in holdings:
+        exit_days = entry_days + holding
+        if exit_on_cross:
+            exit_days = np.minimum(exit_days, next_down[codes, entry_days])
+        closed = exit_days < n_dates
+        returns = prices[codes[closed], exit_days[closed]] / prices[codes[closed], entry_days[closed]] - 1
+        trades = pd.DataFrame({'group': groups[codes[closed]], 'return': returns * 100})
+        trades = pd.concat([trades[trades['group'] >= 0], trades.assign(group=len(labels))])
+        summary = trades.groupby('group')['return'].agg(
+            **{'Số lệnh': 'size', 'Tỷ lệ thắng (%)': lambda r: (r > 0).mean() * 100, 'LN TB (%)': 'mean'})
+        summary.index = pd.Index(group_labels[summary.index], name='Ngành')
+
+        # Vị thế mở từ ngày mua đến trước ngày bán; các lệnh chồng nhau trên cùng mã tính là một vị thế
+        delta = np.zeros((n_codes, n_dates + 1), dtype=np.int32)
+        np.add.at(delta, (codes, entry_days), 1)
+        np.add.at(delta, (codes, np.minimum(exit_days, n_dates)), -1)
+        held = (np.cumsum(delta[:, :n_dates - 1], axis=1) > 0).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            group_returns = np.nan_to_num((one_hot @ (held * daily_returns)) / (one_hot @ held))
+        equity = np.concatenate([np.ones((len(group_labels), 1)), np.cumprod(1 + group_returns, axis=1)], axis=1)
+        results.append((holding, summary, equity))
+    return results
+
+# Hàm tạo lưới tham số
+def parameter_grid(rule, fast_spans=(12,), slow_spans=(26,), signal_spans=(9,), ma_windows=(200,)):
+    """Các bộ tham số tín hiệu của quy tắc `rule` (bỏ các bộ MACD có EMA nhanh không nhỏ hơn EMA chậm)."""
+    if rule == 'MACD':
+        return [dict(rule=rule, fast=fast, slow=slow, signal=signal)
+                for fast, slow, signal in itertools.product(fast_spans, slow_spans, signal_spans) if fast < slow]
+    return [dict(rule=rule, ma_window=window) for window in ma_windows]
+
+# Dữ liệu dùng chung của tiến trình con (gửi một lần khi khởi tạo pool thay vì theo từng tác vụ)
+WORKER_DATA = {}
+
+# Hàm khởi tạo tiến trình con
+def init_worker(close, groups, labels):
+    WORKER_DATA.update(close=close, groups=groups, labels=labels)
+
+# Hàm chạy một bộ tham số tín hiệu (trong tiến trình con)
+def run_signal_params(signal_params, holdings, exit_on_cross):
+    close, groups, labels = WORKER_DATA['close'], WORKER_DATA['groups'], WORKER_DATA['labels']
+    up, down = crossover_signals(close, **signal_params)
+    return [
+        BacktestResult(params=dict(signal_params, holding=holding, exit_on_cross=exit_on_cross),
+                       summary=summary, equity_labels=np.append(np.asarray(labels, dtype=object), MARKET_LABEL),
+                       equity=equity)
+        for holding, summary, equity in backtest_signals(close, groups, labels, up, down, holdings, exit_on_cross)
+    ]
+
+# Hàm chạy backtest trên cả lưới tham số
+def run_backtest_grid(close, groups, labels, grid, holdings, exit_on_cross=False, workers=None):
+    """Backtest mọi bộ tham số tín hiệu trong `grid` × mọi thời gian nắm giữ; trả về danh sách BacktestResult.
+
+    Mỗi bộ tham số tín hiệu là một tác vụ của process pool (các thời gian nắm giữ dùng chung tín hiệu đã tính).
+    `workers=1` (hoặc lưới chỉ có một bộ) thì chạy tuần tự trong tiến trình hiện tại.
+    """
+    jobs = [(params, tuple(holdings), exit_on_cross) for params in grid]
+    if workers == 1 or len(jobs) <= 1:
+        init_worker(close, groups, labels)
+        batches = [run_signal_params(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(jobs)),
+                                 initializer=init_worker, initargs=(close, groups, labels)) as pool:
+            batches = list(pool.map(run_signal_params, *zip(*jobs)))
+    return [result for batch in batches for result in batch]
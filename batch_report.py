@@ -0,0 +1,98 @@
+import argparse
+import ntpath
+import os
+import time
+from datetime import date
+import pandas as pd
+import c1
+from pdf_export import charts_to_pdf
+
+# Báo cáo PDF chạy nền (ví dụ cron job hằng ngày): tạo các biểu đồ Tổng quan, Chi tiết (mọi nhóm giao dịch),
+# Market và VNINDEX cho một khoảng ngày mà không cần phiên Streamlit, render ảnh song song rồi ghép thành một PDF.
+#
+#   python batch_report.py --start 2024-01-01 --end 2024-03-31 --output bao_cao.pdf
+
+GROUP_OPTIONS = ("Cá nhân", "Nước ngoài", "Tổ chức", "Tự doanh")
+CHART_OPTIONS = ("Khớp", "Thỏa thuận")
+PAGES = ("overview", "detail", "market", "vnindex")
+
+# Hàm đọc tham số dòng lệnh
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Xuất báo cáo PDF các biểu đồ của dashboard cho một khoảng ngày.")
+    parser.add_argument("--start", type=date.fromisoformat, help="Ngày bắt đầu (YYYY-MM-DD), mặc định ngày đầu của dữ liệu")
+    parser.add_argument("--end", type=date.fromisoformat, help="Ngày kết thúc (YYYY-MM-DD), mặc định ngày cuối của dữ liệu")
+    parser.add_argument("--output", default="report.pdf", help="File PDF đầu ra")
+    parser.add_argument("--pages", nargs="+", choices=PAGES, default=list(PAGES), help="Các trang đưa vào báo cáo")
+    parser.add_argument("--groups", nargs="+", choices=GROUP_OPTIONS, default=list(GROUP_OPTIONS),
+                        help="Nhóm giao dịch của trang Chi tiết")
+    parser.add_argument("--channels", nargs="+", choices=CHART_OPTIONS, default=list(CHART_OPTIONS),
+                        help="Loại giao dịch của trang Chi tiết")
+    parser.add_argument("--workers", type=int, default=None, help="Số tiến trình render ảnh (mặc định: số CPU)")
+    parser.add_argument("--large-universe", action="store_true",
+                        help="Bubble chart Market vẽ mọi mã, các biểu đồ nhiều điểm dùng WebGL")
+    parser.add_argument("--data-dir", help="Thư mục chứa các file CSV (thay cho đường dẫn mặc định trong c1.py)")
+    return parser.parse_args(argv)
+
+# Hàm đổi thư mục dữ liệu
+def use_data_dir(data_dir):
+    """Trỏ các đường dẫn dữ liệu và cache của c1 vào `data_dir`, giữ nguyên tên file."""
+    for name in ('DATA_PATH', 'MARKETCAP_PATH', 'VOLUME_PATH', 'PRICE_PATH', 'SECTOR_PATH', 'VNINDEX_PATH'):
+        setattr(c1, name, os.path.join(data_dir, ntpath.basename(getattr(c1, name))))
+    c1.CACHE_DIR = os.path.join(data_dir, 'cache')
+
+# Hàm tạo toàn bộ biểu đồ của báo cáo
+def build_report_charts(start_date, end_date, pages=PAGES, groups=GROUP_OPTIONS, channels=CHART_OPTIONS,
+                        large_universe=False):
+    """Trả về dict tên → Figure theo thứ tự trang; ngày None nghĩa là ngày đầu/cuối của từng bộ dữ liệu."""
+    charts = {}
+    if 'overview' in pages or 'detail' in pages:
+        cube = c1.load_flow_cube()
+        flow_start = start_date or pd.Timestamp(cube.dates[0]).date()
+        flow_end = end_date or pd.Timestamp(cube.dates[-1]).date()
+        flow_totals = cube.range_totals(flow_start, flow_end)
+        if flow_totals.empty:
+            print("Không có dữ liệu giao dịch theo ngành trong khoảng thời gian đã chọn.")
+        else:
+            if 'overview' in pages:
+                charts.update(c1.overview_figures(flow_totals))
+            if 'detail' in pages:
+                for i, group_option in enumerate(groups):
+                    for j, chart_option in enumerate(channels):
+                        figures = c1.detail_figures(cube, flow_totals, flow_start, flow_end, group_option, chart_option,
+                                                    large_universe)
+                        charts.update({f"{name}_{i}_{j}": fig for name, fig in figures.items()})
+    if 'market' in pages:
+        mm = c1.load_and_prepare_data(c1.VOLUME_PATH, c1.PRICE_PATH, c1.SECTOR_PATH, c1.MARKETCAP_PATH)
+        market_charts = c1.market_figures(mm, start_date or mm.dates.min().date(), end_date or mm.dates.max().date(),
+                                          large_universe=large_universe)
+        if market_charts is None:
+            print("Không có dữ liệu Market trong khoảng thời gian đã chọn.")
+        else:
+            charts.update({f"market_{name}": fig for name, fig in market_charts.items()})
+    if 'vnindex' in pages:
+        flows = c1.load_investor_flows(c1.VNINDEX_PATH)
+        first, last = flows.date_rows(start_date or pd.Timestamp(flows.dates[0]).date(), end_date or pd.Timestamp(flows.dates[-1]).date())
+        if first >= last:
+            print("Không có dữ liệu VNINDEX trong khoảng thời gian đã chọn.")
+        else:
+            charts.update(c1.vnindex_figures(flows, flows.dates[first], flows.dates[last - 1]))
+    return charts
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.data_dir:
+        use_data_dir(args.data_dir)
+    started = time.perf_counter()
+    charts = build_report_charts(args.start, args.end, args.pages, args.groups, args.channels,
+                                 args.large_universe)
+    if not charts:
+        raise SystemExit("Không có biểu đồ nào để xuất.")
+    built = time.perf_counter()
+    pdf_output = charts_to_pdf(charts, workers=args.workers)
+    with open(args.output, 'wb') as f:
+        f.write(pdf_output)
+    print(f"Đã ghi {len(charts)} biểu đồ vào {args.output} "
+          f"(tạo biểu đồ {built - started:.1f}s, render và ghép PDF {time.perf_counter() - built:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import c1
+from batch_report import use_data_dir
+from pdf_export import charts_to_pdf
+
+# Bộ đo hiệu năng của c1.py trên dữ liệu tổng hợp: sinh các file CSV cùng định dạng với dữ liệu thật
+# theo số mã × số năm, đo riêng từng bước xử lý và ghi kết quả ra JSON để so sánh giữa các lần chạy.
+#
+#   python benchmark.py --codes 500 2000 5000 --years 1 5 20 --output benchmark.json
+
+INDUSTRIES = ('Ngân hàng', 'Bất động sản', 'Tài chính', 'Công nghiệp', 'Hàng tiêu dùng', 'Nguyên vật liệu',
+              'Dầu khí', 'Công nghệ Thông tin', 'Dịch vụ tiêu dùng', 'Y tế', 'Tiện ích', 'Viễn thông')
+FLOW_INDUSTRIES = ('Bán lẻ ', 'Bảo hiểm ', 'Bất động sản ', 'Công nghệ Thông tin ', 'Du lịch và Giải trí ', 'Dầu khí ',
+                   'Dịch vụ tài chính ', 'Hàng & Dịch vụ Công nghiệp ', 'Hàng cá nhân & Gia dụng ', 'Hóa chất ',
+                   'Ngân hàng ', 'Thực phẩm và đồ uống ', 'Truyền thông ', 'Tài nguyên Cơ bản ', 'Viễn thông ',
+                   'Xây dựng và Vật liệu ', 'Y tế ', 'Ô tô và phụ tùng ', 'Điện')
+
+# Hàm ghi một file CSV dạng wide (Name, Code, các cột ngày dd-mm-YYYY)
+def write_wide_csv(path, names, codes, dates, values, float_format):
+    df = pd.DataFrame(values, columns=dates.strftime('%d-%m-%Y'))
+    df.insert(0, 'Code', codes)
+    df.insert(0, 'Name', names)
+    df.to_csv(path, index=False, float_format=float_format)
+
+# Hàm sinh bộ dữ liệu tổng hợp
+def generate_dataset(data_dir, n_codes, n_years, seed=0):
+    """Sinh các file đầu vào của c1.py vào `data_dir`: giá/khối lượng/vốn hóa dạng wide, phân loại ngành,
+    combined_data.csv và thống kê VNINDEX, với `n_codes` mã trong `n_years` năm ngày làm việc."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end='2024-12-31', periods=int(n_years * 252))
+    n_dates = len(dates)
+    codes = np.array([f"M{i:04d}" for i in range(n_codes)])
+    names = np.array([f"Công ty {code}" for code in codes])
+
+    # Giá theo bước ngẫu nhiên log-chuẩn; mỗi mã niêm yết từ một ngày ngẫu nhiên (trước đó là ô trống)
+    returns = rng.normal(0, 0.02, size=(n_codes, n_dates))
+    close = np.round(np.exp(np.log(rng.uniform(5, 150, size=(n_codes, 1))) + returns.cumsum(axis=1)), 2)
+    listed = np.arange(n_dates) >= rng.integers(0, n_dates // 2 + 1, size=(n_codes, 1))
+    close = np.where(listed, close, np.nan)
+    volume = np.where(listed, np.round(rng.lognormal(11, 1.5, size=(n_codes, n_dates))), np.nan)
+    shares = rng.uniform(1e7, 5e9, size=(n_codes, 1))
+    marketcap = np.round(close * shares / 1e9, 2)
+
+    write_wide_csv(os.path.join(data_dir, 'Vietnam_Price_cleaned.csv'), names, codes, dates, close, '%.2f')
+    write_wide_csv(os.path.join(data_dir, 'Vietnam_volume_cleaned.csv'), names, codes, dates, volume, '%.0f')
+    write_wide_csv(os.path.join(data_dir, 'Vietnam_Marketcap_cleaned.csv'), names, codes, dates, marketcap, '%.2f')
+
+    industry = np.array(INDUSTRIES)[rng.integers(0, len(INDUSTRIES), size=n_codes)]
+    pd.DataFrame({
+        'STT': np.arange(1, n_codes + 1), 'Mã': codes, 'Tên công ty': names, 'Sàn': 'HOSE',
+        'Ngành ICB - cấp 1': industry, 'Ngành ICB - cấp 2': industry, 'Ngành ICB - cấp 3': industry, 'Ngành ICB - cấp 4': industry
+    }).to_csv(os.path.join(data_dir, 'Phan_loai_nganh.csv'), index=False)
+
+    # Dòng tiền ròng theo ngành × ngày (VND), cột Tổng GT Ròng = Khớp + Thỏa thuận
+    grid = pd.MultiIndex.from_product([FLOW_INDUSTRIES, dates.strftime('%Y-%m-%d')], names=['Ngành', 'Date'])
+    combined = pd.DataFrame(index=grid).reset_index()
+    for column in c1.FLOW_COLUMNS:
+        combined[column] = np.round(rng.normal(0, 5e10, size=len(combined)), -3)
+    for investor in c1.INVESTOR_TYPES:
+        combined[f'{investor} Tổng GT Ròng'] = combined[f'{investor} Khớp Ròng'] + combined[f'{investor} Thỏa thuận Ròng']
+    combined.to_csv(os.path.join(data_dir, 'combined_data.csv'), index=False)
+
+    write_vnindex_csv(os.path.join(data_dir, 'Thong_ke_gia_Phan_loai_NDT__VNINDEX.csv'), dates, rng)
+    return n_dates
+
+# Hàm sinh file thống kê VNINDEX (hai dòng tiêu đề, dòng Tổng/Trung bình, ngày giảm dần)
+def write_vnindex_csv(path, dates, rng):
+    """Cùng bố cục với file thật: nhóm tổng, nhóm "(khớp lệnh + thỏa thuận)" và nhóm "(Ròng)" theo kênh cho từng
+    loại nhà đầu tư; KL và GT mua/bán sinh theo kênh, các cột tổng và ròng suy ra từ đó."""
+    units = (('KL', '(CP)'), ('GT', '(nghìn VND)'))
+    channels = ('khớp lệnh', 'thỏa thuận')
+    trades = {}  # (nhà đầu tư, mua/bán, kênh, KL/GT) → giá trị theo ngày
+    for investor in c1.VNINDEX_INVESTORS:
+        for side in ('mua', 'bán'):
+            for channel in channels:
+                volume = rng.integers(0, 10**8, len(dates))
+                trades[investor, side, channel, 'KL'] = volume
+                trades[investor, side, channel, 'GT'] = np.round(volume * rng.uniform(10, 60, len(dates)), 3)
+    total = lambda investor, side, unit: sum(trades[investor, side, channel, unit] for channel in channels)
+    columns = []  # (nhóm, chỉ tiêu, giá trị theo ngày)
+    for investor in c1.VNINDEX_INVESTORS:
+        columns += [(investor, f'Tổng {unit} {side} {suffix}', total(investor, side, unit))
+                    for side in ('mua', 'bán') for unit, suffix in units]
+        columns += [(investor, f'Tổng {unit} ròng {suffix}', total(investor, 'mua', unit) - total(investor, 'bán', unit))
+                    for unit, suffix in units]
+    for investor in c1.VNINDEX_INVESTORS:
+        columns += [(f'{investor} (khớp lệnh + thỏa thuận)', f'{unit} {side} {channel} {suffix}', trades[investor, side, channel, unit])
+                    for channel in channels for side in ('mua', 'bán') for unit, suffix in units]
+    for investor in c1.VNINDEX_INVESTORS:
+        columns += [(f'{investor} (Ròng)', f'{unit} ròng {channel} {suffix}',
+                     trades[investor, 'mua', channel, unit] - trades[investor, 'bán', channel, unit])
+                    for channel in channels for unit, suffix in units]
+
+    # Tên nhóm chỉ ghi ở cột đầu của nhóm
+    groups = ['Ngày'] + [group if i == 0 or columns[i - 1][0] != group else '' for i, (group, _, _) in enumerate(columns)]
+    values = pd.DataFrame({i: column for i, (_, _, column) in enumerate(columns)})
+    rows = [[date] + list(row) for date, row in zip(dates[::-1].strftime('%d-%m-%Y'), values.to_numpy(dtype=object)[::-1])]
+    rows = [['Tổng'] + [values[i].sum() for i in values], ['Trung bình'] + list(values.mean())] + rows
+    pd.DataFrame([groups, [''] + [field for _, field, _ in columns]] + rows).to_csv(path, index=False, header=False)
+
+# Hàm đo thời gian một bước
+def timed(stages, name, func, repeat=1):
+    """Chạy `func` `repeat` lần, lưu thời gian (giây) vào stages[name] và trả về kết quả lần chạy cuối."""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        runs.append(time.perf_counter() - started)
+    stages[name] = {'seconds': float(np.median(runs)), 'runs': runs}
+    return result
+
+# Hàm đo các bước xử lý trên một bộ dữ liệu
+def run_benchmark(data_dir, repeat=3, pdf=False, seed=0):
+    """Trỏ c1 vào `data_dir` (cache riêng) và đo từng bước; trả về dict tên bước → thời gian."""
+    use_data_dir(data_dir)
+    paths = (c1.VOLUME_PATH, c1.PRICE_PATH, c1.SECTOR_PATH, c1.MARKETCAP_PATH)
+    stages = {}
+
+    # Tải dữ liệu: lần đầu đọc CSV và ghi cache, các lần sau đọc cache .npy (bỏ qua cache của Streamlit)
+    mm = timed(stages, 'load_and_prepare_data (CSV)', lambda: c1.load_and_prepare_data.__wrapped__(*paths))
+    timed(stages, 'load_and_prepare_data (cache .npy)', lambda: c1.load_and_prepare_data.__wrapped__(*paths), repeat)
+    timed(stages, 'compute_technicals', lambda: c1.compute_technicals(mm.close), repeat)
+    df = timed(stages, 'load_data', lambda: c1.load_overview_tables.__wrapped__(c1.DATA_PATH)[0], repeat)
+    cube = timed(stages, 'build_flow_cube', lambda: c1.build_flow_cube(df), repeat)
+    cube.version = c1.array_sha1(cube.cumsum)
+    timed(stages, 'load_investor_flows (CSV)', lambda: c1.read_investor_flows(c1.VNINDEX_PATH), repeat)
+    flows = c1.load_investor_flows.__wrapped__(c1.VNINDEX_PATH)
+
+    # Các khoảng ngày ngẫu nhiên (cố định theo seed) cho các bước lọc/tổng hợp
+    rng = np.random.default_rng(seed)
+    bounds = np.sort(rng.integers(0, len(cube.dates), size=(20, 2)), axis=1)
+    ranges = [(pd.Timestamp(cube.dates[a]).date(), pd.Timestamp(cube.dates[b]).date()) for a, b in bounds]
+    timed(stages, 'filter_data_by_date', lambda: [c1.filter_data_by_date(df, *r) for r in ranges], repeat)
+    totals = timed(stages, 'FlowCube.range_totals', lambda: [cube.range_totals(*r) for r in ranges], repeat)
+    timed(stages, 'prepare_khop_data', lambda: [c1.prepare_khop_data(t) for t in totals], repeat)
+    timed(stages, 'prepare_thoathuan_data', lambda: [c1.prepare_thoathuan_data(t) for t in totals], repeat)
+    timed(stages, 'prepare_flow_chart_data', lambda: [c1.prepare_flow_chart_data(t) for t in totals], repeat)
+    timed(stages, 'prepare_time_series_data',
+          lambda: [c1.prepare_time_series_data(cube, c1.FLOW_COLUMNS[0], *r) for r in ranges], repeat)
+    overview = timed(stages, 'overview_figures', lambda: c1.overview_figures(totals[0]), repeat)
+    timed(stages, 'vnindex_figures', lambda: c1.vnindex_figures(flows, *ranges[0]), repeat)
+
+    # Từng biểu đồ Market trên toàn bộ lịch sử (xóa cache % thay đổi để mỗi lần đo đều tính lại)
+    start_date, end_date = mm.dates[0].date(), mm.dates[-1].date()
+    market = {}
+    for key, _, _, _ in c1.MARKET_CHARTS:
+        def build(key=key):
+            c1.latest_day_changes.clear()
+            return c1.market_figures(mm, start_date, end_date, {key})
+        market.update(timed(stages, f'market_figures[{key}]', build, repeat))
+
+    if pdf:
+        charts = dict(overview, **market)
+        try:
+            timed(stages, 'charts_to_pdf', lambda: charts_to_pdf(charts))
+        except Exception as error:  # kaleido cần trình duyệt Chrome để render ảnh
+            stages['charts_to_pdf'] = {'error': f"{type(error).__name__}: {error}".splitlines()[0]}
+
+    memory = c1.memory_report({'Tổng quan': df, 'Market': mm}).set_index('Dữ liệu')['Sau (MB)']
+    return stages, {label: float(mb) for label, mb in memory.items()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Đo hiệu năng c1.py trên dữ liệu tổng hợp.")
+    parser.add_argument("--codes", type=int, nargs="+", default=[500], help="Số mã (có thể nhiều giá trị)")
+    parser.add_argument("--years", type=float, nargs="+", default=[1], help="Số năm dữ liệu (có thể nhiều giá trị)")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần lặp mỗi bước (lấy trung vị)")
+    parser.add_argument("--pdf", action="store_true", help="Đo cả bước xuất PDF (cần kaleido và Chrome)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json", help="File JSON kết quả")
+    args = parser.parse_args(argv)
+
+    results = {
+        'environment': {
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'compact_dtypes': c1.COMPACT_DTYPES
+        },
+        'runs': []
+    }
+    for n_codes in args.codes:
+        for n_years in args.years:
+            with tempfile.TemporaryDirectory() as data_dir:
+                started = time.perf_counter()
+                n_dates = generate_dataset(data_dir, n_codes, n_years, args.seed)
+                generated = time.perf_counter() - started
+                stages, memory = run_benchmark(data_dir, args.repeat, args.pdf, args.seed)
+            results['runs'].append({'codes': n_codes, 'years': n_years, 'dates': n_dates,
+                                    'generate_seconds': generated, 'memory_mb': memory, 'stages': stages})
+            print(f"{n_codes} mã × {n_years} năm: " + ", ".join(
+                f"{name} {stage['seconds']:.3f}s" for name, stage in stages.items() if 'seconds' in stage))
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -11,12 +11,32 @@ import plotly.io as pio
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import inch
-import tempfile
 import os
-from fpdf import FPDF
+import json
+import hashlib
+import csv
+import threading
+import logging
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import dataclasses
+from dataclasses import dataclass
+# pdf_export, wide_csv và backtest cũng được nạp trong các tiến trình con của process pool (kể cả kiểu spawn trên
+# Windows), nên chúng không import Streamlit hay c1 để tiến trình con khởi động nhanh
+from pdf_export import charts_to_pdf
+from wide_csv import read_wide_matrix
+from backtest import MARKET_LABEL, parameter_grid, run_backtest_grid
 
 # Constants
 CHART_HEIGHT = 600
+EMA_FAST, EMA_SLOW, EMA_SIGNAL = 12, 26, 9
+MA_WINDOW = 200
+INVESTOR_TYPES = ('Cá nhân', 'Nước ngoài', 'Tổ chức trong nước', 'Tự doanh')
+TRADE_CHANNELS = ('Khớp', 'Thỏa thuận')
+FLOW_COLUMNS = [f'{investor} {channel} Ròng' for investor in INVESTOR_TYPES for channel in TRADE_CHANNELS]
 COLOR_MAP = {
     'Cá nhân Khớp Ròng': '#1f77b4',
     'Nước ngoài Khớp Ròng': '#ff7f0e',
@@ -34,112 +54,1674 @@ MARKETCAP_PATH = r'C:\MyProject\Vietnam_Marketcap_cleaned.csv'
 VOLUME_PATH = r"C:\MyProject\Vietnam_volume_cleaned.csv"
 PRICE_PATH = r"C:\MyProject\Vietnam_Price_cleaned.csv"
 SECTOR_PATH = r"C:\MyProject\Phan_loai_nganh.csv"
+VNINDEX_PATH = r"C:\MyProject\Thong_ke_gia_Phan_loai_NDT__VNINDEX.csv"
+# Thư mục cache dạng cột (.npy) để khởi động lại không phải đọc lại CSV
+CACHE_DIR = r"C:\MyProject\cache"
+# Tăng khi thay đổi cách xử lý dữ liệu để vô hiệu hóa cache cũ
+CACHE_VERSION = 9
+# Phát hiện dòng tiền ròng bất thường theo ngành × nhà đầu tư × kênh: span của trung bình/phương sai trượt (EWM),
+# số ngày tối thiểu trước khi xét và ngưỡng |z-score|
+ANOMALY_SPAN = 60
+ANOMALY_MIN_DAYS = 20
+ANOMALY_Z = 3.0
+# Chế độ thu gọn bộ nhớ: nhãn ngành dạng Categorical, ma trận Market dạng float32 khi đủ độ chính xác.
+# Dòng tiền (VND, tới hàng trăm tỷ) vẫn giữ float64 vì float32 làm mất phần hàng chục nghìn đồng.
+COMPACT_DTYPES = True
+# Số chữ số thập phân cần giữ đúng của từng ma trận Market khi chuyển sang float32
+MATRIX_DECIMALS = {'close': 2, 'volume': 0, 'marketcap': 2, 'trade_value': 2}
+MARKET_CACHE_ARRAYS = ('codes', 'names', 'icb', 'dates', 'close', 'volume', 'marketcap', 'trade_value')
+# Các cột phân ngành ICB trong file ngành, từ cấp 1 đến cấp 4
+ICB_LEVELS = ('Ngành ICB - cấp 1', 'Ngành ICB - cấp 2', 'Ngành ICB - cấp 3', 'Ngành ICB - cấp 4')
+# File CSV dạng wide của trang Market → ma trận tương ứng
+WIDE_SOURCES = {'price': 'close', 'volume': 'volume', 'marketcap': 'marketcap'}
+# Số phiên bản của mỗi bộ dữ liệu giữ trong st.cache_resource: chỉ bản hiện tại, file nguồn đổi thì bản cũ bị loại
+# ngay khi tải bản mới (không giữ hai bản đầy đủ trong RAM suốt vòng đời tiến trình)
+DATASET_CACHE_ENTRIES = 1
+# Số tiến trình parse các file wide khi dựng lại dữ liệu Market (None: số CPU; 1: đọc tuần tự)
+LOAD_WORKERS = None
+# Các mảng nhóm × ngày của IndustryRollup (các trường còn lại mô tả nhóm, không phụ thuộc ngày)
+ROLLUP_SERIES = ('trade_value', 'marketcap', 'macd_count', 'ma200_count')
+# Các cột của bảng tổng toàn thị trường theo ngày (MarketMatrices.daily)
+DAILY_COLUMNS = ('TradeValue', 'MarketCap', 'TradeCount', 'CapCount')
+TECHNICALS_ARRAYS = ('ema12', 'ema26', 'macd', 'signal', 'ma200', 'macd_cross', 'ma200_cross')
+# Số điểm tối đa mỗi chuỗi thời gian gửi tới trình duyệt; vượt quá thì gộp theo tuần/tháng hoặc giảm điểm (LTTB)
+MAX_CHART_POINTS = 500
+# Số nhóm/mã nhiều nhất vẽ riêng trong các biểu đồ drill-down ICB (phần còn lại gộp vào "Khác")
+ICB_TOP_ITEMS = 10
+# Số dòng mỗi trang có thể chọn trong bảng kết quả của bộ lọc cổ phiếu
+SCREENER_PAGE_SIZES = (25, 50, 100)
+# Số mã đứng đầu mỗi ngày lưu trong chỉ mục xếp hạng và số khung hình tối đa khi chạy qua các ngày
+RANK_TOP_K = 50
+RANK_ANIMATION_FRAMES = 120
+# Chỉ số xếp hạng: (tên hiển thị, ma trận của MarketMatrices, nhãn trục giá trị)
+RANK_METRICS = {
+    'trade': ("GTGD", 'trade_value', "Giá trị giao dịch (tỷ đồng)"),
+    'marketcap': ("vốn hóa", 'marketcap', "Vốn hóa (tỷ đồng)")
+}
+# Nhãn tùy chọn vẽ bằng WebGL (nhiều điểm: bubble chart mọi mã, chuỗi thời gian dài)
+WEBGL_LABEL = "Chế độ nhiều mã (WebGL)"
+# Các lựa chọn tham số của trang backtest tín hiệu
+BACKTEST_EMA_SPANS = (5, 8, 12, 16, 20, 26, 35, 50)
+BACKTEST_SIGNAL_SPANS = (5, 7, 9, 12)
+BACKTEST_MA_WINDOWS = (20, 50, 100, 150, 200)
+BACKTEST_HOLDINGS = (1, 5, 10, 20, 60, 120)
+RESOLUTION_LABELS = {'D': 'ngày', 'W': 'tuần', 'M': 'tháng'}
+# Giới hạn cache biểu đồ dùng chung cho mọi phiên (số mục và dung lượng dữ liệu trace ước tính)
+FIGURE_CACHE_MAX_ENTRIES = 256
+FIGURE_CACHE_MAX_BYTES = 64 * 2**20
+STATE_ARRAYS = ('ema12', 'ema12_weight', 'ema26', 'ema26_weight', 'signal', 'signal_weight', 'ma_sum', 'window',
+                'last_missing', 'last_change', 'n_dates', 'prev_close', 'prev_ma200', 'prev_macd', 'prev_signal')
 # Đường dẫn file CSV từ GitHub (định dạng raw)
 #VOLUME_PATH = 'https://raw.githubusercontent.com/ThuyTien121/GPM1-ASSIGNMENT3/main/Vietnam_volume_cleaned.csv'
 #PRICE_PATH = 'https://raw.githubusercontent.com/ThuyTien121/GPM1-ASSIGNMENT3/main/Vietnam_Price_cleaned.csv'
 #SECTOR_PATH = 'https://raw.githubusercontent.com/ThuyTien121/GPM1-ASSIGNMENT3/main/Phan_loai_nganh.csv'
 #MARKETCAP_PATH = 'https://raw.githubusercontent.com/ThuyTien121/GPM1-ASSIGNMENT3/main/Vietnam_Marketcap_cleaned.csv'
+#VNINDEX_PATH = 'https://raw.githubusercontent.com/ThuyTien121/GPM1-ASSIGNMENT3/main/Thong_ke_gia_Phan_loai_NDT__VNINDEX.csv'
+# Các loại nhà đầu tư trong thống kê VNINDEX
+VNINDEX_INVESTORS = ('Cá nhân trong nước', 'Cá nhân nước ngoài', 'Tổ chức trong nước', 'Tổ chức nước ngoài')
+
+
+# Hàm lấy dấu vân tay của file nguồn (kích thước, mtime, hash)
+def file_fingerprint(path, previous=None):
+    """Trả về kích thước, mtime và SHA-1 của file; dùng lại hash cũ nếu kích thước và mtime không đổi."""
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime_ns:
+        fingerprint['sha1'] = previous['sha1']
+        return fingerprint
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    fingerprint['sha1'] = sha1.hexdigest()
+    return fingerprint
+
+# Hàm lấy chữ ký nhanh của các file nguồn
+def source_signature(*paths):
+    """(kích thước, mtime) của từng file, dùng làm tham số của các hàm tải dữ liệu có cache để dữ liệu được tải lại
+    khi file nguồn được ghi thêm; None với nguồn không phải file trên đĩa."""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+# Hàm đếm số cột trong dòng tiêu đề của file CSV
+def csv_header_fields(path):
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return len(next(csv.reader(f)))
+
+# Hàm lấy các dòng được nối thêm vào cuối file CSV
+def appended_rows(path, previous):
+    """Dòng tiêu đề cùng các dòng được nối thêm vào cuối file so với lần đọc trước (dấu vân tay `previous`),
+    dạng bytes CSV; None nếu phần nội dung cũ đã bị sửa (phần đầu file không còn khớp hash cũ)."""
+    if not previous or 'sha1' not in previous:
+        return None
+    with open(path, 'rb') as f:
+        head = f.read(previous['size'])
+        tail = f.read()
+    if len(head) < previous['size'] or not head.endswith(b'\n') or hashlib.sha1(head).hexdigest() != previous['sha1']:
+        return None
+    return head[:head.index(b'\n') + 1] + tail
+
+# Hàm lấy các cột được nối thêm vào cuối mỗi dòng của CSV dạng wide
+def appended_columns(path, previous):
+    """(tên các cột mới, giá trị float64 theo từng dòng dữ liệu của file) nếu so với lần đọc trước file chỉ được
+    thêm cột vào cuối mỗi dòng; None nếu không phải vậy.
+
+    Bỏ các trường mới khỏi cuối từng dòng phải cho lại đúng nội dung file cũ (so hash), nhờ đó chỉ cần
+    phân tích các trường mới mà vẫn chắc chắn các cột cũ không bị sửa.
+    """
+    if not previous or 'fields' not in previous:
+        return None
+    with open(path, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    if not lines:
+        return None
+    header = next(csv.reader([lines[0].decode('utf-8-sig')]))
+    n_new = len(header) - previous['fields']
+    if n_new <= 0:
+        return None
+    sha1 = hashlib.sha1()
+    new_fields = []
+    for line in lines:
+        body = line.rstrip(b'\r\n')
+        parts = body.rsplit(b',', n_new)
+        if len(parts) != n_new + 1:
+            return None
+        sha1.update(parts[0] + line[len(body):])
+        new_fields.append(b','.join(parts[1:]))
+    if sha1.hexdigest() != previous['sha1']:
+        return None
+    values = pd.read_csv(BytesIO(b'\n'.join(new_fields[1:])), header=None, names=range(n_new),
+                         skip_blank_lines=False, dtype=np.float64)
+    return header[-n_new:], values.to_numpy()
+
+# Hàm khóa ghi dữ liệu dùng chung
+def freeze_arrays(data):
+    """Đánh dấu chỉ đọc mọi mảng NumPy trong `data` (mảng, dataclass, dict, list/tuple, attrs của DataFrame);
+    trả về `data`. Bộ dữ liệu trong st.cache_resource dùng chung cho mọi phiên nên ghi nhầm sẽ báo lỗi ngay."""
+    if isinstance(data, np.ndarray):
+        data.flags.writeable = False
+    elif isinstance(data, pd.DataFrame):
+        freeze_arrays(data.attrs)
+    elif dataclasses.is_dataclass(data):
+        for field in dataclasses.fields(data):
+            freeze_arrays(getattr(data, field.name))
+    elif isinstance(data, dict):
+        for value in data.values():
+            freeze_arrays(value)
+    elif isinstance(data, (list, tuple)):
+        for value in data:
+            freeze_arrays(value)
+    return data
+
+# Hàm lấy đường dẫn file trong cache
+def cache_file(name, filename):
+    """Đường dẫn một file trong thư mục cache `name`."""
+    return os.path.join(CACHE_DIR, name, filename)
+
+# Hàm kiểm tra cache trên đĩa còn khớp với các file nguồn
+def check_disk_cache(name, sources):
+    """Trả về (cache còn dùng được, dấu vân tay hiện tại của các file nguồn).
+
+    Cache chỉ bị coi là cũ khi kích thước hoặc nội dung (hash) của một file nguồn thay đổi;
+    file chỉ đổi mtime sẽ được cập nhật lại manifest mà không phải dựng lại dữ liệu.
+    """
+    if not all(os.path.isfile(path) for path in sources.values()):
+        return False, None  # Nguồn từ URL: không cache
+    manifest = read_cache_manifest(name)
+    cached = manifest.get('sources', {})
+    fingerprints = {key: file_fingerprint(path, cached.get(key)) for key, path in sources.items()}
+    fresh = bool(manifest) and all(
+        cached.get(key, {}).get('size') == fp['size'] and cached.get(key, {}).get('sha1') == fp['sha1']
+        for key, fp in fingerprints.items()
+    )
+    if fresh:  # giữ các thông tin phụ đã lưu kèm dấu vân tay (ví dụ số cột của file)
+        fingerprints = {key: dict(cached[key], **fp) for key, fp in fingerprints.items()}
+    if fresh and cached != fingerprints:
+        try:
+            write_cache_manifest(name, fingerprints)
+        except OSError:
+            pass
+    return fresh, fingerprints
+
+# Hàm lấy phiên bản cache
+def cache_version():
+    """CACHE_VERSION kèm chế độ COMPACT_DTYPES: đổi chế độ cũng làm cache cũ hết hạn."""
+    return f"{CACHE_VERSION}-{'compact' if COMPACT_DTYPES else 'float64'}"
+
+# Hàm đọc manifest của cache
+def read_cache_manifest(name):
+    """Đọc manifest của cache `name`; trả về {} nếu chưa có hoặc khác CACHE_VERSION."""
+    try:
+        with open(os.path.join(CACHE_DIR, name, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if manifest.get('version') == cache_version() else {}
+
+def write_cache_manifest(name, fingerprints):
+    """Ghi manifest sau cùng để cache dở dang không bao giờ được coi là hợp lệ."""
+    manifest_path = os.path.join(CACHE_DIR, name, 'manifest.json')
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': cache_version(), 'sources': fingerprints}, f)
+    os.replace(tmp_path, manifest_path)
+
+# Hàm ghi các bảng vào cache trên đĩa
+def save_disk_cache(name, tables, fingerprints):
+    """Ghi các mảng NumPy ra .npy; lỗi ghi cache không làm hỏng việc tải dữ liệu."""
+    if fingerprints is None:
+        return
+    try:
+        os.makedirs(os.path.join(CACHE_DIR, name), exist_ok=True)
+        for table, data in tables.items():
+            path = cache_file(name, f"{table}.npy")
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, data, allow_pickle=False)
+            os.replace(path + '.tmp', path)
+        write_cache_manifest(name, fingerprints)
+    except (OSError, ValueError):
+        pass
+
+# Chỉ báo kỹ thuật dạng ma trận mã × ngày
+@dataclass
+class Technicals:
+    """EMA12/26, MACD, Signal, MA200 và cờ cắt lên cho mọi mã, cùng chỉ mục với MarketMatrices."""
+    ema12: np.ndarray
+    ema26: np.ndarray
+    macd: np.ndarray
+    signal: np.ndarray
+    ma200: np.ndarray
+    macd_cross: np.ndarray
+    ma200_cross: np.ndarray
+
+    def astype(self, dtype):
+        """Bản sao với các ma trận giá trị ở kiểu `dtype` (cờ cắt lên giữ nguyên kiểu bool)."""
+        return Technicals(*(
+            values if values.dtype == bool else values.astype(dtype, copy=False)
+            for values in (getattr(self, name) for name in TECHNICALS_ARRAYS)
+        ))
+
+# Hàm tính tổng tích lũy và vị trí thay đổi của ma trận giá
+def rolling_prefix(close):
+    """(tổng tích lũy theo ngày với NaN tính là 0, vị trí NaN gần nhất (-1 nếu chưa có), vị trí gần nhất giá khác
+    phiên trước) của ma trận giá float64 mã × ngày; dùng chung cho rolling_mean và IndicatorState."""
+    missing = np.isnan(close)
+    positions = np.arange(close.shape[1])
+    changed = np.concatenate([np.ones((len(close), 1), dtype=bool), close[:, 1:] != close[:, :-1]], axis=1)
+    return (np.cumsum(np.where(missing, 0., close), axis=1),
+            np.maximum.accumulate(np.where(missing, positions, -1), axis=1),
+            np.maximum.accumulate(np.where(changed, positions, 0), axis=1))
+
+# Hàm tính trung bình trượt theo tổng tích lũy
+def rolling_mean(close, window):
+    """MA `window` phiên của ma trận giá float64 mã × ngày, như pandas rolling(window).mean(): NaN nếu cửa sổ
+    chưa đủ hoặc có NaN, cửa sổ toàn giá trị bằng nhau trả đúng giá đó.
+
+    Tính bằng hiệu hai tổng tích lũy, cùng phép toán với IndicatorState.update nên cập nhật từng ngày cho kết
+    quả giống hệt từng bit (khác pandas, vốn cộng dồn có bù sai số, ở cỡ 1e-12 tương đối).
+    """
+    sums, last_missing, last_change = rolling_prefix(close)
+    n_dates = close.shape[1]
+    previous = np.concatenate([np.zeros((len(close), window)), sums[:, :-window]], axis=1)[:, :n_dates]
+    positions = np.arange(n_dates)
+    mean = np.where(positions - last_change >= window - 1, close, (sums - previous) / window)
+    return np.where(positions - last_missing >= window, mean, np.nan)
+
+# Hàm tính MACD và MA200 cho toàn bộ mã trong một lượt
+def compute_technicals(close):
+    """Tính chỉ báo trên ma trận giá (mã × ngày): mỗi phép ewm/rolling chạy một lần trên cả bảng ngày × mã.
+
+    Luôn tính bằng float64 (kể cả khi giá lưu float32) để trạng thái IndicatorState không mất độ chính xác.
+    """
+    df_close = pd.DataFrame(close.T, dtype=np.float64)
+    ema12 = df_close.ewm(span=EMA_FAST, adjust=False).mean()
+    ema26 = df_close.ewm(span=EMA_SLOW, adjust=False).mean()
+    macd = ema12 - ema26
+    signal = macd.ewm(span=EMA_SIGNAL, adjust=False).mean()
+    macd_cross = (macd > signal) & (macd.shift(1) <= signal.shift(1))
+    ma200 = pd.DataFrame(rolling_mean(np.asarray(close, dtype=np.float64), MA_WINDOW).T)
+    ma200_cross = (df_close > ma200) & (df_close.shift(1) <= ma200.shift(1))
+    return Technicals(*(np.ascontiguousarray(df.to_numpy().T) for df in (ema12, ema26, macd, signal, ma200, macd_cross, ma200_cross)))
+
+# Hàm chuẩn hóa khoảng ngày lọc
+def date_bounds(start_date, end_date):
+    """Trả về (đầu ngày start_date, cuối ngày end_date) dạng Timestamp."""
+    start_date = pd.to_datetime(start_date).replace(hour=0, minute=0, second=0, microsecond=0)
+    end_date = pd.to_datetime(end_date).replace(hour=23, minute=59, second=59, microsecond=999999)
+    return start_date, end_date
+
+# Hàm gán số thứ tự kỳ ngày/tuần/tháng cho dãy ngày
+def period_ids(dates):
+    """Với mỗi độ phân giải trong RESOLUTION_LABELS: mã kỳ (số nguyên) của từng ngày; tính một lần khi tải dữ liệu."""
+    dates = pd.DatetimeIndex(dates)
+    return {'D': np.arange(len(dates)), 'W': dates.to_period('W').asi8, 'M': dates.to_period('M').asi8}
+
+# Hàm tìm vị trí bắt đầu của từng kỳ
+def period_starts(ids):
+    """Vị trí điểm đầu của mỗi kỳ trong dãy mã kỳ tăng dần (dùng cho np.add.reduceat)."""
+    return np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+
+# Hàm chọn độ phân giải cho biểu đồ theo thời gian
+def choose_resolution(periods):
+    """Độ phân giải mịn nhất (ngày, tuần rồi tháng) có không quá MAX_CHART_POINTS kỳ; `periods` là mã kỳ
+    của các điểm cần vẽ theo từng độ phân giải."""
+    for freq in ('D', 'W'):
+        if len(period_starts(periods[freq])) <= MAX_CHART_POINTS:
+            return freq
+    return 'M'
+
+# Hàm giảm số điểm của đường bằng thuật toán LTTB
+def lttb_indices(values, n_out=MAX_CHART_POINTS):
+    """Chỉ số các điểm giữ lại theo Largest-Triangle-Three-Buckets: luôn giữ điểm đầu, điểm cuối và trong mỗi
+    nhóm chọn điểm tạo tam giác lớn nhất với điểm đã chọn trước và trung bình nhóm sau (giữ được đỉnh/đáy)."""
+    n = len(values)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=np.float64)
+    edges = np.append(np.linspace(1, n - 1, n_out - 1).astype(np.int64), n)
+    selected = [0]
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], edges[i + 2]
+        avg_x, avg_y = x[next_lo:next_hi].mean(), values[next_lo:next_hi].mean()
+        a = selected[-1]
+        area = np.abs((x[a] - avg_x) * (values[lo:hi] - values[a]) - (x[a] - x[lo:hi]) * (avg_y - values[a]))
+        selected.append(lo + int(np.argmax(area)))
+    selected.append(n - 1)
+    return np.array(selected)
+
+# Hàm cấu hình trục ngày theo độ phân giải
+def date_axis(freq):
+    """Thuộc tính trục x dạng ngày; theo ngày thì ẩn cuối tuần để các cột không bị ngắt quãng."""
+    return dict(type='date', rangebreaks=[dict(bounds=['sat', 'mon'])] if freq == 'D' else [])
+
+# Chỉ mục ngày → vị trí dòng của DataFrame đã sắp xếp theo Date
+@dataclass(eq=False)  # so sánh theo định danh: pandas so sánh attrs khi ghép DataFrame
+class DateIndex:
+    """Các ngày phân biệt (tăng dần) và vị trí dòng đầu của từng ngày; offsets có thêm phần tử cuối là số dòng."""
+    dates: np.ndarray
+    offsets: np.ndarray
+
+    @classmethod
+    def build(cls, dates):
+        """Dựng chỉ mục từ cột Date đã sắp xếp tăng dần."""
+        values = np.asarray(dates, dtype='datetime64[ns]')
+        unique_dates, first_rows = np.unique(values, return_index=True)
+        return cls(dates=unique_dates, offsets=np.append(first_rows, len(values)))
+
+    def row_range(self, start_date, end_date):
+        """Khoảng dòng (slice) chứa các ngày trong [start_date, end_date], tìm bằng tìm kiếm nhị phân."""
+        start_date, end_date = date_bounds(start_date, end_date)
+        first = np.searchsorted(self.dates, start_date.to_datetime64(), 'left')
+        last = np.searchsorted(self.dates, end_date.to_datetime64(), 'right')
+        return slice(int(self.offsets[first]), int(self.offsets[last]))
+
+# Hàm sắp xếp DataFrame theo ngày và gắn chỉ mục ngày
+def attach_date_index(df):
+    """Sắp xếp df theo Date (giữ thứ tự gốc khi trùng ngày) và lưu DateIndex vào df.attrs['date_index']."""
+    df = df.sort_values('Date', kind='stable').reset_index(drop=True)
+    df.attrs['date_index'] = DateIndex.build(df['Date'])
+    return df
 
+# Hàm tính hệ số alpha của EMA
+def ewm_alpha(span):
+    """Hệ số alpha tính giống pandas ewm(span=...)."""
+    return 1. / (1. + (span - 1) / 2.)
+
+# Hàm cập nhật EMA thêm một ngày cho mọi mã
+def ema_step(weighted, old_wt, values, span):
+    """Một bước của pandas ewm(adjust=False).mean(): NaN giữ nguyên EMA cũ nhưng làm giảm trọng số của nó."""
+    alpha = ewm_alpha(span)
+    started = ~np.isnan(weighted)
+    valid = ~np.isnan(values)
+    old_wt = np.where(started, old_wt * (1. - alpha), old_wt)
+    updated = (old_wt * weighted + alpha * values) / (old_wt + alpha)
+    weighted = np.where(started & valid & (weighted != values), updated, np.where(~started & valid, values, weighted))
+    return weighted, np.where(started & valid, 1., old_wt)
+
+# Trạng thái chỉ báo của từng mã để cập nhật khi có thêm ngày giao dịch
+@dataclass
+class IndicatorState:
+    """Giá trị cuối của EMA12/EMA26/Signal (kèm trọng số như pandas ewm), tổng tích lũy giá kèm vòng đệm
+    MA_WINDOW tổng tích lũy gần nhất cho MA200 (xem rolling_mean), vị trí NaN/đổi giá gần nhất và giá trị phiên
+    trước để xét cắt lên. Mỗi ngày mới chỉ tốn O(số mã) và cho kết quả giống hệt compute_technicals."""
+    ema12: np.ndarray
+    ema12_weight: np.ndarray
+    ema26: np.ndarray
+    ema26_weight: np.ndarray
+    signal: np.ndarray
+    signal_weight: np.ndarray
+    ma_sum: np.ndarray
+    window: np.ndarray
+    last_missing: np.ndarray
+    last_change: np.ndarray
+    n_dates: int
+    prev_close: np.ndarray
+    prev_ma200: np.ndarray
+    prev_macd: np.ndarray
+    prev_signal: np.ndarray
+
+    @classmethod
+    def from_technicals(cls, close, technicals):
+        """Dựng trạng thái tại ngày cuối từ ma trận giá và chỉ báo đã tính đầy đủ."""
+        close = np.asarray(close, dtype=np.float64)
+        n_codes, n_dates = close.shape
+        valid = ~np.isnan(close)
+        started = valid.any(axis=1)
+        trailing_nan = np.where(started, np.argmax(valid[:, ::-1], axis=1), 0)
+        weights = {}
+        for span in (EMA_FAST, EMA_SLOW):
+            weight = np.ones(n_codes)
+            for k in range(1, trailing_nan.max() + 1):
+                weight = np.where(trailing_nan >= k, weight * (1. - ewm_alpha(span)), weight)
+            weights[span] = weight
+        sums, last_missing, last_change = rolling_prefix(close)
+        window = np.zeros((n_codes, MA_WINDOW))
+        last = np.arange(max(n_dates - MA_WINDOW, 0), n_dates)
+        window[:, last % MA_WINDOW] = sums[:, last]
+        return cls(
+            ema12=technicals.ema12[:, -1].copy(), ema12_weight=weights[EMA_FAST],
+            ema26=technicals.ema26[:, -1].copy(), ema26_weight=weights[EMA_SLOW],
+            signal=technicals.signal[:, -1].copy(), signal_weight=np.ones(n_codes),
+            ma_sum=sums[:, -1].copy(), window=window,
+            last_missing=last_missing[:, -1].copy(), last_change=last_change[:, -1].copy(), n_dates=n_dates,
+            prev_close=close[:, -1].copy(), prev_ma200=technicals.ma200[:, -1].copy(),
+            prev_macd=technicals.macd[:, -1].copy(), prev_signal=technicals.signal[:, -1].copy()
+        )
 
-# Thiết lập trang
-st.set_page_config(page_title="Dashboard Giao dịch và Thị trường", layout="wide")
+    def update(self, close):
+        """Thêm một ngày (vector giá đóng cửa theo mã), trả về cột chỉ báo của ngày đó theo thứ tự của Technicals."""
+        close = np.asarray(close, dtype=np.float64)  # giá float32 sẽ kéo cả phép tính EMA về float32
+        self.ema12, self.ema12_weight = ema_step(self.ema12, self.ema12_weight, close, EMA_FAST)
+        self.ema26, self.ema26_weight = ema_step(self.ema26, self.ema26_weight, close, EMA_SLOW)
+        macd = self.ema12 - self.ema26
+        self.signal, self.signal_weight = ema_step(self.signal, self.signal_weight, macd, EMA_SIGNAL)
+        # Cùng phép toán với rolling_mean: tổng MA_WINDOW phiên = tổng tích lũy hiện tại − tổng tích lũy MA_WINDOW
+        # phiên trước (ô vòng đệm sắp bị ghi đè)
+        day = self.n_dates
+        self.ma_sum = self.ma_sum + np.where(np.isnan(close), 0., close)
+        previous = self.window[:, day % MA_WINDOW].copy()
+        self.window[:, day % MA_WINDOW] = self.ma_sum
+        self.last_missing = np.where(np.isnan(close), day, self.last_missing)
+        self.last_change = np.where(close != self.prev_close, day, self.last_change)
+        self.n_dates += 1
+        ma200 = np.where(day - self.last_change >= MA_WINDOW - 1, close, (self.ma_sum - previous) / MA_WINDOW)
+        ma200 = np.where(day - self.last_missing >= MA_WINDOW, ma200, np.nan)
+        macd_cross = (macd > self.signal) & (self.prev_macd <= self.prev_signal)
+        ma200_cross = (close > ma200) & (self.prev_close <= self.prev_ma200)
+        self.prev_close, self.prev_ma200, self.prev_macd, self.prev_signal = close, ma200, macd, self.signal
+        return self.ema12, self.ema26, macd, self.signal, ma200, macd_cross, ma200_cross
+
+# Hàm băm mảng NumPy
+def array_sha1(values):
+    """SHA-1 của nội dung mảng, dùng để kiểm tra lịch sử giá đã lưu có bị sửa không."""
+    return hashlib.sha1(np.ascontiguousarray(values).tobytes()).hexdigest()
+
+# Hàm tải chỉ báo kỹ thuật, chỉ tính thêm các ngày mới
+def load_technicals(mm):
+    """Trả về Technicals cho mm, dùng lại chỉ báo và IndicatorState đã lưu trong cache.
+
+    Nếu mã không đổi và lịch sử giá đã lưu là phần đầu không đổi của ma trận giá hiện tại thì chỉ
+    cập nhật trạng thái qua các cột ngày mới; ngược lại tính lại toàn bộ bằng compute_technicals.
+    """
+    codes_sha1 = hashlib.sha1('\n'.join(map(str, mm.codes)).encode('utf-8')).hexdigest()
+    cached = read_cache_manifest('technicals').get('sources', {})
+    n_cached = cached.get('n_dates', 0)
+    technicals = state = None
+    if (cached.get('codes') == codes_sha1 and 0 < n_cached <= len(mm.dates)
+            and cached.get('dates') == array_sha1(mm.dates[:n_cached].to_numpy())
+            and cached.get('close') == array_sha1(mm.close[:, :n_cached])):
+        try:
+            technicals = Technicals(*(np.load(cache_file('technicals', f"{name}.npy")) for name in TECHNICALS_ARRAYS))
+            state = IndicatorState(**{name: np.load(cache_file('technicals', f"state_{name}.npy")) for name in STATE_ARRAYS})
+            state.n_dates = int(state.n_dates)
+        except (OSError, ValueError):
+            technicals = None
+    if technicals is None:
+        technicals = compute_technicals(mm.close)
+        state = IndicatorState.from_technicals(mm.close, technicals)
+    elif n_cached < len(mm.dates):
+        new_columns = [state.update(mm.close[:, j]) for j in range(n_cached, len(mm.dates))]
+        technicals = Technicals(*(
+            np.concatenate([old, np.column_stack(new)], axis=1)
+            for old, new in zip((getattr(technicals, name) for name in TECHNICALS_ARRAYS), zip(*new_columns))
+        ))
+    else:
+        return technicals
+    if COMPACT_DTYPES:
+        technicals = technicals.astype(np.float32)  # chỉ dùng để so sánh cắt lên, không hiển thị giá trị
+    arrays = {name: getattr(technicals, name) for name in TECHNICALS_ARRAYS}
+    arrays.update({f"state_{name}": np.asarray(getattr(state, name)) for name in STATE_ARRAYS})
+    save_disk_cache('technicals', arrays, {
+        'codes': codes_sha1, 'n_dates': len(mm.dates),
+        'dates': array_sha1(mm.dates.to_numpy()), 'close': array_sha1(mm.close)
+    })
+    return technicals
+
+# Dữ liệu Market dạng ma trận mã × ngày
+@dataclass
+class MarketMatrices:
+    """Giá, khối lượng, vốn hóa và GTGD dạng ma trận (mã × ngày) dùng chung chỉ mục mã và ngày.
+
+    Ô không có dữ liệu là NaN; `icb` là danh sách nhãn ngành theo mã của các cấp ICB có trong file ngành (cấp 1
+    trước), `industries` là cấp 1 (None nếu file ngành không có cột ICB cấp 1). `rollups` là IndustryRollup
+    của từng cấp trong `icb`, `daily` là bảng tổng toàn thị trường theo ngày (xem build_daily_totals),
+    `rankings` là chỉ mục Top-K theo ngày (xem RankingIndex).
+    `version` đổi khi dữ liệu nguồn đổi, dùng làm khóa cho các cache tính trên ma trận.
+    Ở chế độ COMPACT_DTYPES ma trận là float32 nếu đủ độ chính xác và `industries` là pd.Categorical;
+    tên công ty chỉ lưu một lần theo mã (`names`), không lặp trong các bảng tính toán.
+    `source_rows` cho từng file wide (WIDE_SOURCES) là chỉ số mã của mỗi dòng dữ liệu trong file (-1 với dòng trùng
+    mã bị bỏ qua), dùng để nối các cột ngày mới mà không phải đọc lại cột Code.
+    """
+    codes: np.ndarray
+    names: np.ndarray
+    industries: object
+    dates: pd.DatetimeIndex
+    close: np.ndarray
+    volume: np.ndarray
+    marketcap: np.ndarray
+    trade_value: np.ndarray
+    technicals: Technicals = None
+    version: str = ''
+    periods: dict = None
+    source_rows: dict = None
+    icb: list = None
+    rollups: list = None
+    daily: pd.DataFrame = None
+    rankings: 'RankingIndex' = None
+
+    def date_slice(self, start_date, end_date):
+        """Khoảng cột (slice) ứng với các ngày trong [start_date, end_date]."""
+        start_date, end_date = date_bounds(start_date, end_date)
+        return slice(self.dates.searchsorted(start_date, 'left'), self.dates.searchsorted(end_date, 'right'))
+
+    def industry_labels(self):
+        """Ngành của từng mã dạng mảng chuỗi (object), dùng cho các bảng nhỏ đưa vào biểu đồ."""
+        return np.asarray(self.industries, dtype=object)
+
+# Hàm chuyển nhãn lặp lại sang dạng Categorical
+def compact_labels(values):
+    """Ở chế độ COMPACT_DTYPES trả về pd.Categorical: mỗi dòng chỉ giữ mã số nguyên, chuỗi lưu một lần."""
+    return pd.Categorical(values) if COMPACT_DTYPES else values
+
+# Hàm chuyển ma trận sang float32 khi không mất độ chính xác hiển thị
+def compact_matrix(values, decimals):
+    """Trả về bản float32 nếu mọi ô sai lệch dưới nửa đơn vị của chữ số thập phân thứ `decimals`, ngược lại giữ nguyên."""
+    if not COMPACT_DTYPES or values.dtype == np.float32:
+        return values
+    compact = values.astype(np.float32)
+    with np.errstate(invalid='ignore'):
+        error = np.nanmax(np.abs(compact - values), initial=0.)
+    return compact if error < 0.5 * 10. ** -decimals else values
+
+# Hàm cộng dồn ma trận theo ngành
+def industry_totals(values, industries):
+    """Tổng (cộng bằng float64) theo ngành của ma trận mã × ngày; ô là NaN nếu ngành không có dữ liệu ngày đó."""
+    totals = pd.DataFrame(values, dtype=np.float64).groupby(industries, observed=True).sum(min_count=1)
+    totals.index = totals.index.astype(object)
+    return totals
+
+# Tổng theo nhóm ngành của một cấp ICB
+@dataclass
+class IndustryRollup:
+    """Tổng theo nhóm ngành × ngày của một cấp ICB, tính sẵn một lần khi tải dữ liệu Market.
+
+    Mỗi nhóm là một nút của cây ICB (đường dẫn từ cấp 1 đến cấp này) nên cùng tên ngành nằm dưới hai nhóm cha
+    khác nhau là hai nhóm riêng. `parents` là chỉ số nhóm cha ở cấp trên (-1 ở cấp 1), `members` là chỉ số nhóm
+    của từng mã (-1 nếu mã không có ngành ở cấp này). trade_value/marketcap là tổng float64 như industry_totals
+    (NaN nếu nhóm không có dữ liệu ngày đó); macd_count/ma200_count là số mã có tín hiệu cắt lên trong ngày.
+    """
+    labels: np.ndarray
+    parents: np.ndarray
+    members: np.ndarray
+    trade_value: np.ndarray
+    marketcap: np.ndarray
+    macd_count: np.ndarray
+    ma200_count: np.ndarray
+
+    def children(self, parent):
+        """Chỉ số các nhóm con trực tiếp của nhóm `parent` ở cấp trên (-1: các nhóm cấp 1)."""
+        return np.flatnonzero(self.parents == parent)
+
+    def extend(self, other):
+        """Các nhóm của `self` với tổng theo các ngày của `self` rồi các ngày của `other` (cùng các nhóm)."""
+        return dataclasses.replace(self, **{
+            name: np.concatenate([getattr(self, name), getattr(other, name)], axis=1) for name in ROLLUP_SERIES
+        })
+
+# Hàm tính sẵn tổng theo từng cấp ICB
+def build_icb_rollups(mm, previous=None):
+    """IndustryRollup cho từng cấp trong mm.icb (cần mm.technicals để đếm tín hiệu).
+
+    `previous` là rollups đã tính cho các ngày đầu của mm (lưu cùng cache .npy, cùng mã và ngành): chỉ cộng các
+    ngày sau đó rồi nối vào (xem IndustryRollup.extend), nên nối thêm một ngày chỉ tốn một cột của mỗi ma trận.
+    """
+    n_done = previous[0].trade_value.shape[1] if previous else 0
+    if previous is not None and (len(previous) != len(mm.icb or []) or n_done > len(mm.dates)):
+        previous, n_done = None, 0
+    if previous is not None and n_done == len(mm.dates):
+        return previous
+    new_dates = slice(n_done, None)
+    rollups = []
+    parent_members = np.zeros(len(mm.codes), dtype=np.int64)
+    for labels in mm.icb or []:
+        labels = pd.Categorical(labels)
+        valid = (np.asarray(labels.codes) >= 0) & (parent_members >= 0)
+        keys = parent_members * len(labels.categories) + labels.codes
+        _, first, inverse = np.unique(keys[valid], return_index=True, return_inverse=True)
+        members = np.full(len(mm.codes), -1, dtype=np.int64)
+        members[valid] = inverse
+        groups = pd.Categorical.from_codes(members, categories=np.arange(len(first)))
+        representatives = np.flatnonzero(valid)[first]
+        rollup = IndustryRollup(
+            labels=np.asarray(labels, dtype=object)[representatives],
+            parents=parent_members[representatives] if rollups else np.full(len(first), -1, dtype=np.int64),
+            members=members,
+            trade_value=industry_totals(mm.trade_value[:, new_dates], groups).to_numpy(),
+            marketcap=industry_totals(mm.marketcap[:, new_dates], groups).to_numpy(),
+            macd_count=industry_totals(mm.technicals.macd_cross[:, new_dates], groups).to_numpy().astype(np.int32),
+            ma200_count=industry_totals(mm.technicals.ma200_cross[:, new_dates], groups).to_numpy().astype(np.int32)
+        )
+        rollups.append(previous[len(rollups)].extend(rollup) if previous else rollup)
+        parent_members = members
+    return rollups
+
+# Hàm tính sẵn tổng toàn thị trường theo ngày
+def build_daily_totals(mm, previous=None):
+    """Bảng ngày × chuỗi (cùng thứ tự mm.dates): tổng GTGD và vốn hóa toàn thị trường (cộng float64, bỏ qua NaN
+    như np.nansum) và số mã có dữ liệu mỗi ngày. Biểu đồ theo thời gian chỉ cần cắt bảng này theo khoảng ngày
+    thay vì cộng lại cả ma trận mã × ngày; tổng theo ngành nằm trong mm.rollups.
+
+    `previous` là bảng đã tính cho các ngày đầu của mm (lưu cùng cache .npy): chỉ cộng các ngày sau đó."""
+    n_done = len(previous) if previous is not None and len(previous) <= len(mm.dates) else 0
+    if previous is not None and n_done == len(mm.dates):
+        return previous
+    trade_value, marketcap = mm.trade_value[:, n_done:], mm.marketcap[:, n_done:]
+    daily = pd.DataFrame({
+        'TradeValue': np.nansum(trade_value, axis=0, dtype=np.float64),
+        'MarketCap': np.nansum(marketcap, axis=0, dtype=np.float64),
+        'TradeCount': (~np.isnan(trade_value)).sum(axis=0),
+        'CapCount': (~np.isnan(marketcap)).sum(axis=0)
+    }, index=mm.dates[n_done:])
+    return pd.concat([previous, daily]) if n_done else daily
+
+# Chỉ mục xếp hạng theo ngày
+@dataclass
+class RankingIndex:
+    """Top RANK_TOP_K mã theo GTGD và theo vốn hóa của từng ngày, trên toàn thị trường và trong từng ngành cấp 1;
+    tính khi dựng dữ liệu Market (lưu cùng cache .npy, chỉ tính thêm cho các ngày mới được nối vào) để tra Top-N
+    của một ngày bất kỳ trong O(K).
+
+    Mỗi hàng là chỉ số mã xếp giảm dần theo giá trị ngày đó, cùng giá trị thì mã đứng trước trong mm.codes xếp
+    trước (như nlargest); -1 khi ngày đó có ít hơn K mã có dữ liệu. trade/marketcap: ngày × K;
+    industry_trade/industry_marketcap: ngành (thứ tự mm.rollups[0].labels) × ngày × K, None nếu không có ngành.
+    """
+    trade: np.ndarray
+    marketcap: np.ndarray
+    industry_trade: np.ndarray = None
+    industry_marketcap: np.ndarray = None
+
+    def top(self, metric, col, n, industry=None):
+        """Chỉ số của tối đa n (≤ RANK_TOP_K) mã đứng đầu ngày `col` theo `metric` ('trade' hoặc 'marketcap'),
+        trong ngành cấp 1 thứ `industry` nếu có."""
+        ranked = getattr(self, metric)[col] if industry is None else getattr(self, f"industry_{metric}")[industry, col]
+        ranked = ranked[:n]
+        return ranked[ranked >= 0]
+
+    def extend(self, other):
+        """Chỉ mục gồm các ngày của `self` rồi các ngày của `other` (cùng danh sách mã và ngành)."""
+        return RankingIndex(*(
+            None if old is None else np.concatenate([old, new], axis=old.ndim - 2)
+            for old, new in ((getattr(self, field.name), getattr(other, field.name)) for field in dataclasses.fields(self))
+        ))
+
+# Hàm xếp hạng Top-K theo từng cột của ma trận
+def top_k_codes(values, k, groups=None, n_groups=0):
+    """(top-k chỉ số dòng của mỗi cột ma trận mã × ngày dạng ngày × k, top-k trong từng nhóm dạng nhóm × ngày × k
+    hoặc None nếu không có `groups`); ô -1 nếu thiếu. `groups` là nhóm của từng mã (-1 nếu không có).
+
+    Một lần argsort ổn định theo giá trị cho cả ma trận; top-k trong nhóm lấy từ cùng thứ tự đó sau một lần
+    sắp xếp ổn định theo nhóm (hạng trong nhóm = vị trí trừ vị trí đầu của nhóm).
+    """
+    n_dates, n_codes = values.shape[1], values.shape[0]
+    keys = np.ascontiguousarray(values.T)  # ngày × mã: sắp xếp theo trục liên tục
+    missing = np.isnan(keys)
+    order = np.argsort(np.where(missing, np.inf, -keys), axis=1, kind='stable')
+    valid = ~np.take_along_axis(missing, order, axis=1)
+    top = np.where(valid[:, :k], order[:, :k], -1).astype(np.int32)
+    top = np.pad(top, ((0, 0), (0, k - top.shape[1])), constant_values=-1)
+    if groups is None:
+        return top, None
+    sorted_groups = groups.astype(np.int16 if n_groups < 2**15 else np.int64)[order]
+    by_group = np.argsort(sorted_groups, axis=1, kind='stable')  # số nguyên 16 bit: radix sort
+    sorted_groups = np.take_along_axis(sorted_groups, by_group, axis=1)
+    order = np.take_along_axis(order, by_group, axis=1)
+    valid = np.take_along_axis(valid, by_group, axis=1)
+    positions = np.arange(n_codes)
+    starts = np.where(np.c_[np.ones((n_dates, 1), dtype=bool), sorted_groups[:, 1:] != sorted_groups[:, :-1]], positions, 0)
+    ranks = positions - np.maximum.accumulate(starts, axis=1)
+    rows, cols = np.nonzero(valid & (sorted_groups >= 0) & (ranks < k))
+    group_top = np.full((n_groups, n_dates, k), -1, dtype=np.int32)
+    group_top[sorted_groups[rows, cols], rows, ranks[rows, cols]] = order[rows, cols]
+    return top, group_top
+
+# Hàm dựng chỉ mục xếp hạng theo ngày
+def build_ranking_index(trade_value, marketcap, industries):
+    """RankingIndex của các ma trận GTGD/vốn hóa (mã × ngày); `industries` là ngành cấp 1 theo mã hoặc None.
+
+    Ngành đánh số theo thứ tự nhãn tăng dần, trùng với thứ tự mm.rollups[0].labels.
+    """
+    members, n_groups = None, 0
+    if industries is not None:
+        industries = pd.Categorical(industries)
+        members, n_groups = np.asarray(industries.codes), len(industries.categories)
+    trade, industry_trade = top_k_codes(trade_value, RANK_TOP_K, members, n_groups)
+    marketcap, industry_marketcap = top_k_codes(marketcap, RANK_TOP_K, members, n_groups)
+    return RankingIndex(trade=trade, marketcap=marketcap, industry_trade=industry_trade, industry_marketcap=industry_marketcap)
+
+# Hàm lấy top mã có tín hiệu theo GTGD
+def top_signal_codes(mm, col, flags, n):
+    """Chỉ số của tối đa n mã có cờ `flags` (vector theo mã) tại ngày `col`, xếp giảm dần theo GTGD ngày đó như
+    nlargest. Tra trong mm.rankings; chỉ khi top RANK_TOP_K không đủ n mã có tín hiệu mới xếp hạng mọi mã."""
+    ranked = mm.rankings.top('trade', col, RANK_TOP_K)
+    hits = ranked[flags[ranked]][:n]
+    if len(hits) < n and len(ranked) == RANK_TOP_K:
+        values = mm.trade_value[:, col]
+        candidates = np.flatnonzero(flags & ~np.isnan(values))
+        hits = candidates[np.argsort(-values[candidates], kind='stable')][:n]
+    return hits
+
+# Hàm lấy giá trị của ngày có dữ liệu liền trước
+def previous_valid(values, col):
+    """Giá trị khác NaN gần nhất trước cột `col` của từng dòng ma trận (NaN nếu không có)."""
+    history = ~np.isnan(values[:, :col])
+    found = history.any(axis=1)
+    if col == 0 or not found.any():
+        return np.full(len(values), np.nan)
+    last = col - 1 - np.argmax(history[:, ::-1], axis=1)
+    return np.where(found, values[np.arange(len(values)), last], np.nan)
+
+# Hàm tính % thay đổi so với ngày giao dịch liền trước
+def pct_change_from(latest, previous):
+    """% thay đổi theo từng phần tử; bằng 0 khi không có giá trị trước hoặc giá trị trước bằng 0."""
+    latest, previous = np.asarray(latest, dtype=np.float64), np.asarray(previous, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_change = (latest - previous) / previous * 100
+    return np.where(np.isnan(previous) | (previous == 0), 0., pct_change)
+
+# Hàm tính GTGD ngày mới nhất và % thay đổi theo mã và theo ngành
+@st.cache_data(max_entries=32)
+def latest_day_changes(_mm, data_version, start_date, end_date):
+    """GTGD ngày giao dịch mới nhất trong khoảng và % thay đổi so với ngày giao dịch liền trước (trong khoảng).
+
+    Tính một lần cho mọi mã và mọi ngành bằng phép toán trên ma trận, cache theo khoảng ngày và
+    phiên bản dữ liệu; dùng chung cho biểu đồ 2, 3, 4 và các biểu đồ xếp hạng khác.
+    Trả về (ngày mới nhất, bảng theo mã, bảng theo ngành hoặc None nếu không có thông tin ngành).
+    """
+    date_range = _mm.date_slice(start_date, end_date)
+    trade_value = _mm.trade_value[:, date_range]
+    latest_col = np.flatnonzero(_mm.daily['TradeCount'].to_numpy()[date_range] > 0)[-1]
+    latest_mask = ~np.isnan(trade_value[:, latest_col])
+    code_changes = pd.DataFrame({
+        'Code': _mm.codes,
+        'Industry': _mm.industry_labels(),
+        'TradeValue': trade_value[:, latest_col],
+        'pct_change': pct_change_from(trade_value[:, latest_col], previous_valid(trade_value, latest_col))
+    })[latest_mask].reset_index(drop=True)
+    industry_changes = None
+    if _mm.industries is not None:
+        # Tổng theo ngành cấp 1 đã tính sẵn cho mọi ngày, chỉ cần cắt theo khoảng ngày
+        rollup = _mm.rollups[0]
+        values = rollup.trade_value[:, date_range]
+        industry_changes = pd.DataFrame({
+            'Industry': rollup.labels,
+            'TradeValue': values[:, latest_col],
+            'pct_change': pct_change_from(values[:, latest_col], previous_valid(values, latest_col))
+        }).dropna(subset=['TradeValue']).reset_index(drop=True)
+    return _mm.dates[date_range][latest_col], code_changes, industry_changes
+
+# Hàm đưa ma trận về chỉ mục mã × ngày chung
+def align_matrix(codes_index, dates_index, codes, dates, values):
+    """Đặt `values` vào ma trận theo chỉ mục chung, các ô thiếu là NaN."""
+    aligned = np.full((len(codes_index), len(dates_index)), np.nan, dtype=values.dtype)
+    aligned[np.ix_(codes_index.get_indexer(codes), dates_index.get_indexer(dates))] = values
+    return aligned
 
 # Hàm tải dữ liệu từ file thứ nhất (Market)
-@st.cache_data
-def load_and_prepare_data(volume_path, price_path, sector_path, marketcap_path):
-    """Đọc CSV dạng wide → long, merge, tính TradeValue, trả về df_trade và df_marketcap."""
-    def read_volume_wide(file_path):
-        chunk_list = []
-        for chunk in pd.read_csv(file_path, iterator=True, chunksize=50000):
-            chunk = chunk.melt(id_vars=['Name', 'Code'], var_name='Date', value_name='Volume')
-            chunk['Date'] = pd.to_datetime(chunk['Date'], format='%d-%m-%Y', errors='coerce')
-            chunk_list.append(chunk)
-        return pd.concat(chunk_list, ignore_index=True) if chunk_list else pd.DataFrame(columns=['Name', 'Code', 'Date', 'Volume'])
-    
-    def read_price_wide(file_path):
-        chunk_list = []
-        for chunk in pd.read_csv(file_path, iterator=True, chunksize=50000):
-            chunk = chunk.melt(id_vars=['Name', 'Code'], var_name='Date', value_name='Close')
-            chunk['Date'] = pd.to_datetime(chunk['Date'], format='%d-%m-%Y', errors='coerce')
-            chunk_list.append(chunk)
-        return pd.concat(chunk_list, ignore_index=True) if chunk_list else pd.DataFrame(columns=['Name', 'Code', 'Date', 'Close'])
-    
-    def read_marketcap_wide(file_path):
-        chunk_list = []
-        for chunk in pd.read_csv(file_path, iterator=True, chunksize=50000):
-            chunk = chunk.melt(id_vars=['Name', 'Code'], var_name='Date', value_name='MarketCap')
-            chunk['Date'] = pd.to_datetime(chunk['Date'], format='%d-%m-%Y', errors='coerce')
-            chunk_list.append(chunk)
-        return pd.concat(chunk_list, ignore_index=True) if chunk_list else pd.DataFrame(columns=['Name', 'Code', 'Date', 'MarketCap'])
-    
-    df_volume = read_volume_wide(volume_path)
-    df_price = read_price_wide(price_path)
-    df_marketcap = read_marketcap_wide(marketcap_path)
-    df_sector = pd.read_csv(sector_path)
+@st.cache_resource(max_entries=DATASET_CACHE_ENTRIES)
+def load_and_prepare_data(volume_path, price_path, sector_path, marketcap_path, source_signature=None):
+    """Trả về MarketMatrices chỉ đọc, dùng chung cho mọi phiên; đọc từ cache .npy nếu các file nguồn không đổi.
+
+    Nếu các file wide chỉ được thêm cột ngày mới vào cuối thì chỉ đọc các cột đó và nối vào cache (xem
+    append_market_dates); chỉ báo kỹ thuật, tổng theo ngành và tổng theo ngày cũng chỉ tính tiếp cho các ngày mới
+    (xem load_technicals, build_icb_rollups, build_daily_totals).
+    `source_signature` (xem source_signature()) chỉ dùng làm khóa cache của Streamlit.
+    """
+    sources = {'volume': volume_path, 'price': price_path, 'sector': sector_path, 'marketcap': marketcap_path}
+    previous = read_cache_manifest('market').get('sources', {})
+    fresh, fingerprints = check_disk_cache('market', sources)
+    mm = None
+    if fresh or (previous and fingerprints is not None):
+        try:
+            mm = read_market_cache()
+        except (OSError, ValueError):
+            pass  # Cache hỏng: dựng lại từ CSV
+    cached = fresh and mm is not None
+    if mm is not None and not fresh:
+        with perf_span('append_market_dates'):
+            mm = append_market_dates(mm, sources, previous, fingerprints)
+    if mm is None:
+        with perf_span('build_market_matrices'):
+            mm = build_market_matrices(volume_path, price_path, sector_path, marketcap_path)
+        if fingerprints is not None:
+            for key in WIDE_SOURCES:
+                fingerprints[key]['fields'] = csv_header_fields(sources[key])
+    with perf_span('load_technicals'):
+        mm.technicals = load_technicals(mm)
+    with perf_span('build_icb_rollups'):
+        mm.rollups = build_icb_rollups(mm, mm.rollups)
+    with perf_span('build_daily_totals'):
+        mm.daily = build_daily_totals(mm, mm.daily)
+    if mm.rankings is None:  # cache thiếu chỉ mục xếp hạng
+        with perf_span('build_ranking_index'):
+            mm.rankings = build_ranking_index(mm.trade_value, mm.marketcap, mm.industries)
+    if not cached:  # ghi sau cùng để cache có cả các bảng tổng vừa tính cho các ngày mới
+        save_market_cache(mm, fingerprints)
+    mm.periods = period_ids(mm.dates)
+    if fingerprints is not None:
+        content = json.dumps({key: fp['sha1'] for key, fp in fingerprints.items()}, sort_keys=True)
+        mm.version = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    else:
+        mm.version = array_sha1(mm.trade_value)
+    return freeze_arrays(mm)
+
+# Hàm đọc dữ liệu Market từ cache .npy
+def read_market_cache():
+    arrays = {name: np.load(cache_file('market', f"{name}.npy")) for name in MARKET_CACHE_ARRAYS}
+    icb = [compact_labels(np.where(labels == '', np.nan, labels.astype(object))) for labels in arrays['icb']]
+    source_rows = None
+    if all(os.path.isfile(cache_file('market', f"rows_{key}.npy")) for key in WIDE_SOURCES):
+        source_rows = {key: np.load(cache_file('market', f"rows_{key}.npy")) for key in WIDE_SOURCES}
+    rankings = None
+    if os.path.isfile(cache_file('market', "rank_trade.npy")):
+        rankings = RankingIndex(**{
+            field.name: np.load(cache_file('market', f"rank_{field.name}.npy"))
+            for field in dataclasses.fields(RankingIndex) if os.path.isfile(cache_file('market', f"rank_{field.name}.npy"))
+        })
+    rollups = None
+    if all(os.path.isfile(cache_file('market', f"rollup{level}_labels.npy")) for level in range(len(icb))):
+        rollups = [IndustryRollup(**{
+            field.name: np.load(cache_file('market', f"rollup{level}_{field.name}.npy"))
+            for field in dataclasses.fields(IndustryRollup)
+        }) for level in range(len(icb))]
+        for rollup in rollups:
+            rollup.labels = rollup.labels.astype(object)
+    daily = None
+    if all(os.path.isfile(cache_file('market', f"daily_{column}.npy")) for column in DAILY_COLUMNS):
+        daily = pd.DataFrame({column: np.load(cache_file('market', f"daily_{column}.npy")) for column in DAILY_COLUMNS},
+                             index=pd.DatetimeIndex(arrays['dates']))
+    return MarketMatrices(
+        codes=arrays['codes'].astype(object), names=arrays['names'].astype(object), industries=icb[0] if icb else None,
+        icb=icb, dates=pd.DatetimeIndex(arrays['dates']), close=arrays['close'], volume=arrays['volume'],
+        marketcap=arrays['marketcap'], trade_value=arrays['trade_value'], source_rows=source_rows, rankings=rankings,
+        rollups=rollups, daily=daily
+    )
+
+# Hàm ghi dữ liệu Market vào cache .npy
+def save_market_cache(mm, fingerprints):
+    tables = {
+        'codes': mm.codes.astype(str), 'names': mm.names.astype(str),
+        'icb': np.array([pd.Series(np.asarray(labels, dtype=object)).fillna('').to_numpy(dtype=str) for labels in mm.icb]
+                        ).reshape(len(mm.icb), len(mm.codes)),
+        'dates': mm.dates.to_numpy(), 'close': mm.close, 'volume': mm.volume,
+        'marketcap': mm.marketcap, 'trade_value': mm.trade_value
+    }
+    tables.update({f"rows_{key}": rows for key, rows in (mm.source_rows or {}).items()})
+    if mm.rankings is not None:
+        tables.update({f"rank_{field.name}": getattr(mm.rankings, field.name)
+                       for field in dataclasses.fields(mm.rankings) if getattr(mm.rankings, field.name) is not None})
+    for level, rollup in enumerate(mm.rollups or []):
+        tables.update({f"rollup{level}_{field.name}": getattr(rollup, field.name) for field in dataclasses.fields(rollup)})
+        tables[f"rollup{level}_labels"] = rollup.labels.astype(str)
+    if mm.daily is not None:
+        tables.update({f"daily_{column}": mm.daily[column].to_numpy() for column in DAILY_COLUMNS})
+    save_disk_cache('market', tables, fingerprints)
+
+def build_market_matrices(volume_path, price_path, sector_path, marketcap_path):
+    """Đọc CSV dạng wide thành ma trận mã × ngày, tính TradeValue bằng một phép nhân từng phần tử.
+
+    Khi có nhiều hơn một CPU (LOAD_WORKERS), bốn file được đọc đồng thời (mỗi file một luồng) và các khối dòng của
+    ba file wide dùng chung một process pool (xem wide_csv.read_wide_matrix); kết quả giống hệt khi đọc tuần tự.
+    """
+    workers = LOAD_WORKERS or os.cpu_count() or 1
+    with (ProcessPoolExecutor(workers) if workers > 1 else nullcontext()) as pool, \
+            ThreadPoolExecutor(4 if workers > 1 else 1) as threads:
+        wide = {key: threads.submit(read_wide_matrix, path, pool, workers)
+                for key, path in (('price', price_path), ('volume', volume_path), ('marketcap', marketcap_path))}
+        df_sector = threads.submit(pd.read_csv, sector_path).result()
+        price_names, price_codes, price_dates, close, price_rows = wide['price'].result()
+        volume_names, volume_codes, volume_dates, volume, volume_rows = wide['volume'].result()
+        cap_names, cap_codes, cap_dates, marketcap, cap_rows = wide['marketcap'].result()
     if 'Mã' in df_sector.columns:
         df_sector.rename(columns={'Mã': 'Code'}, inplace=True)
-    
-    df_trade = pd.merge(df_price, df_volume, on=['Date', 'Code'], how='inner')
-    df_trade = pd.merge(df_trade, df_sector, on='Code', how='left')
-    df_trade['TradeValue'] = df_trade['Close'] * df_trade['Volume'] / 1e9
-    df_trade.dropna(subset=['TradeValue'], inplace=True)
-    if 'Ngành ICB - cấp 1' in df_trade.columns:
-        df_trade.rename(columns={'Ngành ICB - cấp 1': 'Industry'}, inplace=True)
-    
-    df_marketcap = pd.merge(df_marketcap, df_sector, on='Code', how='left')
-    df_marketcap.dropna(subset=['MarketCap'], inplace=True)
-    if 'Ngành ICB - cấp 1' in df_marketcap.columns:
-        df_marketcap.rename(columns={'Ngành ICB - cấp 1': 'Industry'}, inplace=True)
-    
-    return df_trade, df_marketcap, df_price
+
+    codes = pd.Index(price_codes).union(pd.Index(volume_codes)).union(pd.Index(cap_codes))
+    dates = pd.DatetimeIndex(price_dates).union(volume_dates).union(cap_dates)
+    names = pd.concat([
+        pd.Series(price_names, index=price_codes),
+        pd.Series(volume_names, index=volume_codes),
+        pd.Series(cap_names, index=cap_codes)
+    ])
+    names = names[~names.index.duplicated()].reindex(codes)
+
+    # Các cấp ICB liên tiếp từ cấp 1 có trong file ngành
+    sector = df_sector.drop_duplicates(subset='Code').set_index('Code')
+    icb = []
+    for column in ICB_LEVELS:
+        if column not in sector.columns:
+            break
+        icb.append(compact_labels(sector[column].reindex(codes).to_numpy(dtype=object)))
+
+    matrices = {
+        'close': align_matrix(codes, dates, price_codes, price_dates, close),
+        'volume': align_matrix(codes, dates, volume_codes, volume_dates, volume),
+        'marketcap': align_matrix(codes, dates, cap_codes, cap_dates, marketcap)
+    }
+    matrices['trade_value'] = matrices['close'] * matrices['volume'] / 1e9
+    source_rows = {}
+    for key, file_codes in (('price', price_rows), ('volume', volume_rows), ('marketcap', cap_rows)):
+        rows = codes.get_indexer(file_codes)
+        rows[pd.Index(file_codes).duplicated()] = -1
+        source_rows[key] = rows
+    matrices = {name: compact_matrix(values, MATRIX_DECIMALS[name]) for name, values in matrices.items()}
+    return MarketMatrices(
+        codes=codes.to_numpy(dtype=object), names=names.to_numpy(dtype=object), industries=icb[0] if icb else None,
+        icb=icb, dates=dates, source_rows=source_rows, **matrices,
+        rankings=build_ranking_index(matrices['trade_value'], matrices['marketcap'], icb[0] if icb else None)
+    )
+
+# Hàm nối các ngày giao dịch mới vào dữ liệu Market
+def append_market_dates(mm, sources, previous, fingerprints):
+    """MarketMatrices gồm thêm các cột ngày mới được nối vào cuối các file giá/khối lượng/vốn hóa, chỉ đọc các cột đó.
+
+    `rollups` và `daily` vẫn là tổng của các ngày cũ, load_and_prepare_data cộng tiếp các ngày mới (rollups cần chỉ
+    báo kỹ thuật của các ngày đó).
+    Trả về None (cần dựng lại từ đầu) nếu file ngành đổi, nội dung cũ của một file bị sửa hoặc có ngày mới không
+    nằm sau ngày cuối đã có. `fingerprints` được ghi thêm số cột của các file wide đã đọc.
+    """
+    if mm.source_rows is None or fingerprints['sector']['sha1'] != previous.get('sector', {}).get('sha1'):
+        return None
+    blocks = {}
+    for key, name in WIDE_SOURCES.items():
+        if fingerprints[key]['sha1'] == previous.get(key, {}).get('sha1'):
+            fingerprints[key] = dict(previous[key], **fingerprints[key])  # giữ số cột đã lưu cho lần nối sau
+            continue
+        appended = appended_columns(sources[key], previous.get(key))
+        if appended is None or len(appended[1]) != len(mm.source_rows[key]):
+            return None
+        columns, values = appended
+        dates = pd.to_datetime(pd.Index(columns), format='%d-%m-%Y', errors='coerce')
+        keep = ~(dates.isna() | dates.duplicated())  # như read_wide_matrix: bỏ cột không phải ngày và cột trùng tên
+        blocks[name] = (dates[keep], values[:, keep], mm.source_rows[key])
+        fingerprints[key]['fields'] = previous[key]['fields'] + len(columns)
+    if not blocks:
+        return None
+    new_dates = pd.DatetimeIndex(sorted(set().union(*(dates for dates, _, _ in blocks.values()))))
+    if len(new_dates) and new_dates[0] <= mm.dates[-1]:
+        return None
+
+    matrices = {}
+    for name in WIDE_SOURCES.values():
+        block = np.full((len(mm.codes), len(new_dates)), np.nan)
+        if name in blocks:
+            dates, values, rows = blocks[name]
+            valid = rows >= 0
+            block[np.ix_(rows[valid], new_dates.get_indexer(dates))] = values[valid]
+        matrices[name] = block
+    matrices['trade_value'] = matrices['close'] * matrices['volume'] / 1e9
+    for name, block in matrices.items():
+        old = getattr(mm, name)
+        if old.dtype != block.dtype:  # ma trận đã thu gọn về float32
+            block = compact_matrix(block, MATRIX_DECIMALS[name])
+            if block.dtype != old.dtype:
+                return None  # ngày mới không thu gọn được: dựng lại để cả ma trận dùng chung một kiểu
+        matrices[name] = block
+    rankings = None
+    if mm.rankings is not None:  # xếp hạng theo ngày độc lập nhau: chỉ xếp hạng các ngày mới
+        rankings = mm.rankings.extend(build_ranking_index(matrices['trade_value'], matrices['marketcap'], mm.industries))
+    return MarketMatrices(
+        codes=mm.codes, names=mm.names, industries=mm.industries, icb=mm.icb, dates=mm.dates.append(new_dates),
+        source_rows=mm.source_rows, rankings=rankings, rollups=mm.rollups, daily=mm.daily,
+        **{name: np.concatenate([getattr(mm, name), block], axis=1) for name, block in matrices.items()}
+    )
 
 # Hàm tải dữ liệu từ file thứ hai (Tổng quan và Chi tiết)
-@st.cache_data
-def load_data():
-    """Đọc và chuẩn bị dữ liệu từ tệp CSV."""
-    df = pd.read_csv(DATA_PATH)
+def load_data(source_signature=None):
+    """Đọc và chuẩn bị dữ liệu từ tệp CSV, sắp xếp theo ngày kèm chỉ mục ngày để lọc nhanh.
+
+    `source_signature` (xem source_signature()) chỉ dùng làm khóa cache của Streamlit.
+    """
+    return load_overview_tables(DATA_PATH, source_signature)[0]
+
+# Hàm đọc CSV dữ liệu Tổng quan
+def read_overview_csv(source):
+    """Đọc file (hoặc bytes CSV) combined_data, chuyển cột Date sang datetime; chưa sắp xếp."""
+    df = pd.read_csv(source)
     df['Date'] = pd.to_datetime(df['Date'])
+    df['Ngành'] = compact_labels(df['Ngành'])
     return df
 
-# Hàm tạo PDF từ biểu đồ
-def export_charts_to_pdf(charts):
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        image_paths = []
-        for name, fig in charts.items():
-            # Cập nhật theme và màu sắc của biểu đồ
-            fig.update_layout(template="plotly_white", font=dict(size=12, color="black"))
-            img_path = os.path.join(tmpdirname, f"{name}.png")
-            fig.write_image(img_path, format="png", width=1100, height=600, scale=2)
-            image_paths.append(img_path)
-        
-        pdf = FPDF(orientation="L", unit="mm", format="A4")
-        for img_path in image_paths:
-            pdf.add_page()
-            img_width = 277
-            img_height = img_width * (600 / 1100)
-            if img_height > 190:
-                img_height = 190
-                img_width = img_height * (1100 / 600)
-            pdf.image(img_path, x=(297 - img_width) / 2, y=(210 - img_height) / 2, w=img_width, h=img_height)
-        
-        return pdf.output(dest="S").encode("latin1")
+# Hàm tải dữ liệu Tổng quan và cube dòng tiền
+@st.cache_resource(max_entries=DATASET_CACHE_ENTRIES)
+def load_overview_tables(data_path, source_signature=None):
+    """(df đã sắp xếp theo ngày, FlowCube) chỉ đọc, dùng chung cho mọi phiên và cho cả load_data lẫn
+    load_flow_cube; đọc từ cache .npy nếu file không đổi.
+
+    Nếu file chỉ được nối thêm dòng vào cuối thì chỉ đọc các dòng đó rồi nối vào df và tính tiếp cube từ
+    ngày đầu tiên có dòng mới (xem append_overview_rows).
+    """
+    previous = read_cache_manifest('overview').get('sources', {})
+    fresh, fingerprints = check_disk_cache('overview', {'data': data_path})
+    tables = None
+    try:
+        if fresh:
+            tables = read_overview_cache()
+        elif previous and fingerprints is not None:
+            csv_bytes = appended_rows(data_path, previous.get('data'))
+            if csv_bytes is not None:
+                with perf_span('append_overview_rows'):
+                    tables = append_overview_rows(*read_overview_cache(), csv_bytes)
+                if tables is not None:
+                    save_overview_cache(*tables, fingerprints)
+    except (OSError, ValueError, KeyError):
+        tables = None  # Cache hỏng: dựng lại từ CSV
+    if tables is None:
+        df = attach_date_index(read_overview_csv(data_path))
+        tables = df, build_flow_cube(df)
+        save_overview_cache(*tables, fingerprints)
+    tables[1].version = array_sha1(tables[1].cumsum)
+    return freeze_arrays(tables)
+
+# Hàm đọc dữ liệu Tổng quan từ cache .npy
+def read_overview_cache():
+    names = np.load(cache_file('overview', 'columns.npy'))
+    df = pd.DataFrame({str(name): np.load(cache_file('overview', f"col_{i}.npy")) for i, name in enumerate(names)})
+    df['Ngành'] = compact_labels(np.where(df['Ngành'] == '', np.nan, df['Ngành'].astype(object)))
+    cube = FlowCube(
+        industries=np.load(cache_file('overview', 'cube_industries.npy')).astype(object),
+        dates=np.load(cache_file('overview', 'cube_dates.npy')),
+        cumsum=np.load(cache_file('overview', 'cube_cumsum.npy')),
+        row_counts=np.load(cache_file('overview', 'cube_row_counts.npy')),
+        anomalies=FlowAnomalies(**{
+            field.name: np.load(cache_file('overview', f"anomaly_{field.name}.npy")) for field in dataclasses.fields(FlowAnomalies)
+        })
+    )
+    cube.periods = period_ids(cube.dates)
+    return attach_date_index(df), cube
+
+# Hàm ghi dữ liệu Tổng quan vào cache .npy
+def save_overview_cache(df, cube, fingerprints):
+    tables = {'columns': np.array(df.columns, dtype=str)}
+    for i, name in enumerate(df.columns):
+        values = df[name]
+        if name == 'Ngành':
+            values = values.astype(object).fillna('').to_numpy(dtype=str)
+        tables[f"col_{i}"] = np.asarray(values)
+    tables.update({
+        'cube_industries': cube.industries.astype(str), 'cube_dates': cube.dates,
+        'cube_cumsum': cube.cumsum, 'cube_row_counts': cube.row_counts
+    })
+    tables.update({f"anomaly_{field.name}": getattr(cube.anomalies, field.name) for field in dataclasses.fields(FlowAnomalies)})
+    save_disk_cache('overview', tables, fingerprints)
+
+# Hàm nối các dòng mới vào dữ liệu Tổng quan
+def append_overview_rows(df, cube, csv_bytes):
+    """(df, cube) sau khi thêm các dòng trong `csv_bytes` (có dòng tiêu đề); None nếu khác cột với dữ liệu cũ."""
+    new = read_overview_csv(BytesIO(csv_bytes))
+    if list(new.columns) != list(df.columns):
+        return None
+    if new.empty:
+        return df, cube
+    combined = pd.concat([df, new], ignore_index=True)
+    combined['Ngành'] = compact_labels(combined['Ngành'].astype(object))
+    combined = attach_date_index(combined)
+    return combined, extend_flow_cube(cube, combined, new['Date'].min())
+
+# Tổng tích lũy dòng tiền ròng ngành × nhà đầu tư × kênh theo ngày
+@dataclass
+class FlowCube:
+    """Tổng tích lũy (prefix sum) của các cột FLOW_COLUMNS theo ngày × ngành × nhà đầu tư × kênh.
+
+    cumsum[k] là tổng của k ngày đầu (cumsum[0] = 0), nên tổng trên mọi khoảng ngày là
+    cumsum[cuối] − cumsum[đầu], tốn O(số ngành × số nhà đầu tư) bất kể khoảng dài bao nhiêu ngày.
+    `anomalies` là trạng thái và các ngày bất thường của bộ phát hiện dòng tiền (xem FlowAnomalies).
+    """
+    industries: np.ndarray
+    dates: np.ndarray
+    cumsum: np.ndarray
+    row_counts: np.ndarray
+    version: str = ''
+    periods: dict = None
+    anomalies: 'FlowAnomalies' = None
+
+    def date_rows(self, start_date, end_date):
+        """Chỉ số (đầu, cuối) trong cumsum ứng với khoảng [start_date, end_date]."""
+        start_date, end_date = date_bounds(start_date, end_date)
+        return (np.searchsorted(self.dates, start_date.to_datetime64(), 'left'),
+                np.searchsorted(self.dates, end_date.to_datetime64(), 'right'))
+
+    def range_totals(self, start_date, end_date):
+        """Tổng FLOW_COLUMNS theo ngành trong khoảng ngày (chỉ các ngành có dữ liệu), giống groupby('Ngành').sum()."""
+        first, last = self.date_rows(start_date, end_date)
+        totals = pd.DataFrame(
+            (self.cumsum[last] - self.cumsum[first]).reshape(len(self.industries), -1),
+            index=pd.Index(self.industries, name='Ngành'),
+            columns=FLOW_COLUMNS
+        )
+        return totals[self.row_counts[last] - self.row_counts[first] > 0]
+
+    def daily_totals(self, column, start_date, end_date):
+        """Tổng toàn thị trường theo ngày của một cột dòng tiền trong khoảng ngày.
+
+        Bảng có thêm các cột 'Kỳ D'/'Kỳ W'/'Kỳ M' là mã kỳ ngày/tuần/tháng (xem period_ids) của từng ngày.
+        """
+        first, last = self.date_rows(start_date, end_date)
+        investor, channel = divmod(FLOW_COLUMNS.index(column), len(TRADE_CHANNELS))
+        cumulative = self.cumsum[first:last + 1, :, investor, channel].sum(axis=1)
+        daily = pd.DataFrame({'Date': self.dates[first:last], column: np.diff(cumulative)})
+        for freq, ids in self.periods.items():
+            daily[f'Kỳ {freq}'] = ids[first:last]
+        return daily
+
+# Hàm gom dòng tiền theo ngày × ngành
+def daily_flows(df, industries):
+    """(các ngày, tổng FLOW_COLUMNS theo ngày × ngành × nhà đầu tư × kênh, số dòng theo ngày × ngành)."""
+    dates = np.unique(df['Date'].to_numpy())
+    grid = pd.MultiIndex.from_product([dates, industries])
+    grouped = df.groupby(['Date', 'Ngành'], observed=True)
+    daily = grouped[FLOW_COLUMNS].sum().reindex(grid, fill_value=0).to_numpy()
+    daily = daily.reshape(len(dates), len(industries), len(INVESTOR_TYPES), len(TRADE_CHANNELS))
+    counts = grouped.size().reindex(grid, fill_value=0).to_numpy().reshape(len(dates), len(industries))
+    return dates, daily, counts
+
+# Hàm dựng cube dòng tiền từ dữ liệu Tổng quan
+def build_flow_cube(df):
+    """Gom df theo (Date, Ngành) một lần rồi cộng dồn theo ngày."""
+    industries = np.sort(np.asarray(df['Ngành'].dropna().unique(), dtype=object))
+    dates, daily, counts = daily_flows(df, industries)
+    return FlowCube(
+        industries=industries,
+        dates=dates,
+        cumsum=np.concatenate([np.zeros((1,) + daily.shape[1:]), daily.cumsum(axis=0)]),
+        row_counts=np.concatenate([np.zeros((1, len(industries)), dtype=np.int64), counts.cumsum(axis=0)]),
+        periods=period_ids(dates),
+        anomalies=FlowAnomalies.empty(daily.shape[1:]).extend(daily, counts, 0)
+    )
+
+# Hàm tính tiếp cube dòng tiền khi có thêm dòng mới
+def extend_flow_cube(cube, df, first_date):
+    """Cube của df (đã gồm các dòng mới, ngày sớm nhất là `first_date`): giữ nguyên tổng tích lũy của các ngày
+    trước `first_date`, chỉ gom lại các dòng từ ngày đó. Có ngành mới thì dựng lại toàn bộ.
+
+    Bộ phát hiện dòng tiền bất thường chỉ chạy tiếp qua các ngày mới nếu các dòng mới đều sau ngày cuối cũ;
+    dòng mới rơi vào ngày đã có thì trạng thái của ngày đó không còn đúng nên chạy lại từ đầu trên cube mới.
+    """
+    if not np.isin(np.asarray(df['Ngành'].dropna().unique(), dtype=object), cube.industries).all():
+        return build_flow_cube(df)
+    first_date = np.datetime64(first_date, 'ns')
+    kept = np.searchsorted(cube.dates, first_date)
+    dates, daily, counts = daily_flows(df.iloc[np.searchsorted(df['Date'].to_numpy(), first_date):], cube.industries)
+    dates = np.concatenate([cube.dates[:kept], dates])
+    cumsum = np.concatenate([cube.cumsum[:kept], np.cumsum(np.concatenate([cube.cumsum[kept:kept + 1], daily]), axis=0)])
+    row_counts = np.concatenate([cube.row_counts[:kept], np.cumsum(np.concatenate([cube.row_counts[kept:kept + 1], counts]), axis=0)])
+    if cube.anomalies is not None and kept == len(cube.dates):
+        anomalies = cube.anomalies.extend(daily, counts, kept)
+    else:
+        anomalies = FlowAnomalies.empty(daily.shape[1:]).extend(np.diff(cumsum, axis=0), np.diff(row_counts, axis=0), 0)
+    return FlowCube(
+        industries=cube.industries,
+        dates=dates,
+        cumsum=cumsum,
+        row_counts=row_counts,
+        periods=period_ids(dates),
+        anomalies=anomalies
+    )
+
+# Trạng thái bộ phát hiện dòng tiền ròng bất thường
+@dataclass
+class FlowAnomalies:
+    """Trung bình và phương sai trượt (EWM, span ANOMALY_SPAN) của dòng tiền ròng theo ngày cho từng ô
+    ngành × nhà đầu tư × kênh của FlowCube, cùng các ngày đã bị đánh dấu bất thường.
+
+    Một ngày bất thường nếu ô đó đã có ít nhất ANOMALY_MIN_DAYS ngày dữ liệu và |giá trị − trung bình| ≥
+    ANOMALY_Z × độ lệch chuẩn, với trung bình/phương sai tính đến hết ngày trước. Ngày ngành không có dòng
+    dữ liệu nào thì bỏ qua (không tính là dòng tiền 0). Mỗi ngày mới chỉ tốn O(số ô), không quét lại lịch sử.
+    Các mảng event_* có một phần tử cho mỗi lần đánh dấu: chỉ số ngày trong cube.dates, chỉ số phẳng của ô,
+    giá trị, trung bình và độ lệch chuẩn trước ngày đó.
+    """
+    mean: np.ndarray
+    var: np.ndarray
+    count: np.ndarray
+    event_day: np.ndarray
+    event_cell: np.ndarray
+    event_value: np.ndarray
+    event_mean: np.ndarray
+    event_std: np.ndarray
+
+    @classmethod
+    def empty(cls, shape):
+        """Trạng thái chưa có ngày nào cho các ô có dạng `shape` (ngành × nhà đầu tư × kênh)."""
+        events = dict(event_day=np.zeros(0, dtype=np.int64), event_cell=np.zeros(0, dtype=np.int64),
+                      event_value=np.zeros(0), event_mean=np.zeros(0), event_std=np.zeros(0))
+        return cls(mean=np.zeros(shape), var=np.zeros(shape), count=np.zeros(shape, dtype=np.int64), **events)
+
+    def extend(self, daily, counts, first_day):
+        """Trạng thái sau khi chạy qua các ngày `daily` (ngày × ngành × nhà đầu tư × kênh, `counts` là số dòng
+        theo ngày × ngành); ngày đầu tiên có chỉ số `first_day` trong cube.dates."""
+        alpha = ewm_alpha(ANOMALY_SPAN)
+        mean, var, count = self.mean.copy(), self.var.copy(), self.count.copy()
+        present = np.broadcast_to((counts > 0)[:, :, None, None], daily.shape)
+        events = []
+        for day, (values, seen) in enumerate(zip(daily, present)):
+            std = np.sqrt(var)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                flagged = seen & (count >= ANOMALY_MIN_DAYS) & (std > 0) & (np.abs(values - mean) >= ANOMALY_Z * std)
+            cells = np.flatnonzero(flagged)
+            if len(cells):
+                events.append((np.full(len(cells), first_day + day), cells, values.ravel()[cells],
+                               mean.ravel()[cells], std.ravel()[cells]))
+            diff = np.where(seen, values - mean, 0.)
+            mean = np.where(seen & (count == 0), values, mean + alpha * diff)
+            var = np.where(seen & (count > 0), (1. - alpha) * (var + alpha * diff ** 2), var)
+            count = count + seen
+        old = (self.event_day, self.event_cell, self.event_value, self.event_mean, self.event_std)
+        event_day, event_cell, event_value, event_mean, event_std = (
+            np.concatenate([previous] + [event[i] for event in events]) for i, previous in enumerate(old))
+        return FlowAnomalies(mean=mean, var=var, count=count, event_day=event_day, event_cell=event_cell,
+                             event_value=event_value, event_mean=event_mean, event_std=event_std)
+
+    def table(self, cube, start_date, end_date, min_z=ANOMALY_Z):
+        """Các ngày bất thường trong khoảng ngày có |z-score| ≥ min_z, mới nhất trước (cùng ngày: |z| giảm dần)."""
+        first, last = cube.date_rows(start_date, end_date)
+        z = (self.event_value - self.event_mean) / self.event_std
+        rows = np.flatnonzero((self.event_day >= first) & (self.event_day < last) & (np.abs(z) >= min_z))
+        rows = rows[np.lexsort((-np.abs(z[rows]), -self.event_day[rows]))]
+        industry, investor, channel = np.unravel_index(self.event_cell[rows], self.mean.shape)
+        events = pd.DataFrame({
+            'Ngày': cube.dates[self.event_day[rows]],
+            'Ngành': cube.industries[industry],
+            'Nhà đầu tư': np.asarray(INVESTOR_TYPES, dtype=object)[investor],
+            'Kênh': np.asarray(TRADE_CHANNELS, dtype=object)[channel],
+            'Ròng': self.event_value[rows],
+            'Trung bình': self.event_mean[rows],
+            'Z-score': z[rows]
+        })
+        return events
+
+def load_flow_cube(source_signature=None):
+    """Cube dòng tiền của dữ liệu Tổng quan, dựng một lần cho mọi khoảng ngày (cùng cache với load_data)."""
+    return load_overview_tables(DATA_PATH, source_signature)[1]
+
+# Thống kê mua/bán VNINDEX theo loại nhà đầu tư, dạng cột
+@dataclass
+class InvestorFlows:
+    """Các cột của file thống kê VNINDEX theo ngày tăng dần: cột KL (cổ phiếu) kiểu int64, cột GT (nghìn VND)
+    kiểu float64. Tên cột là "<nhóm> - <chỉ tiêu>", ví dụ "Cá nhân trong nước - Tổng GT ròng (nghìn VND)".
+
+    cumsum[tên][k] là tổng của k ngày đầu (cumsum[tên][0] = 0), nên tổng trên mọi khoảng ngày tốn O(1).
+    """
+    dates: np.ndarray
+    columns: dict
+    cumsum: dict = None
+    version: str = ''
+
+    def date_rows(self, start_date, end_date):
+        """Chỉ số (đầu, cuối) trong cumsum ứng với khoảng [start_date, end_date]."""
+        start_date, end_date = date_bounds(start_date, end_date)
+        return (np.searchsorted(self.dates, start_date.to_datetime64(), 'left'),
+                np.searchsorted(self.dates, end_date.to_datetime64(), 'right'))
+
+    def range_totals(self, names, start_date, end_date):
+        """Tổng của các cột `names` trong khoảng ngày, dạng Series theo tên cột."""
+        first, last = self.date_rows(start_date, end_date)
+        return pd.Series({name: self.cumsum[name][last] - self.cumsum[name][first] for name in names})
+
+    def running_totals(self, names, start_date, end_date):
+        """Tổng lũy kế từ đầu khoảng đến từng ngày của các cột `names` (cột 'Date' cùng các cột tên)."""
+        first, last = self.date_rows(start_date, end_date)
+        running = pd.DataFrame({'Date': self.dates[first:last]})
+        for name in names:
+            running[name] = self.cumsum[name][first + 1:last + 1] - self.cumsum[name][first]
+        return running
+
+# Hàm đọc file thống kê VNINDEX theo loại nhà đầu tư
+def read_investor_flows(file_path):
+    """Đọc CSV hai dòng tiêu đề: dòng 1 là nhóm (chỉ ghi ở cột đầu của nhóm, điền tiếp sang các cột sau),
+    dòng 2 là chỉ tiêu. Bỏ các dòng không phải ngày (dòng "Tổng", "Trung bình"), sắp xếp ngày tăng dần."""
+    with open(file_path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        groups, fields = next(reader), next(reader)
+    names, group = [], ''
+    for top, field in zip(groups[1:], fields[1:]):
+        group = top or group
+        names.append(f"{group} - {field}")
+    df = pd.read_csv(file_path, header=None, skiprows=2, names=['Ngày'] + names)
+    dates = pd.to_datetime(df['Ngày'], format='%d-%m-%Y', errors='coerce')
+    df = df[dates.notna()].assign(Ngày=dates[dates.notna()])
+    df = df.sort_values('Ngày', kind='stable').drop_duplicates(subset='Ngày')
+    return InvestorFlows(
+        dates=df['Ngày'].to_numpy(dtype='datetime64[ns]'),
+        columns={name: df[name].to_numpy(dtype=np.int64 if '(CP)' in name else np.float64) for name in names}
+    )
+
+# Hàm tải thống kê VNINDEX
+@st.cache_resource(max_entries=DATASET_CACHE_ENTRIES)
+def load_investor_flows(vnindex_path, source_signature=None):
+    """Trả về InvestorFlows chỉ đọc kèm tổng tích lũy, dùng chung cho mọi phiên; đọc từ cache .npy nếu file
+    nguồn không đổi.
+
+    File có ngày mới ở đầu và dòng Tổng/Trung bình thay đổi theo mỗi ngày nên luôn đọc lại toàn bộ (file nhỏ).
+    """
+    fresh, fingerprints = check_disk_cache('vnindex', {'vnindex': vnindex_path})
+    flows = None
+    if fresh:
+        try:
+            names = np.load(cache_file('vnindex', 'names.npy'))
+            flows = InvestorFlows(
+                dates=np.load(cache_file('vnindex', 'dates.npy')),
+                columns={str(name): np.load(cache_file('vnindex', f"col_{i}.npy")) for i, name in enumerate(names)}
+            )
+        except (OSError, ValueError):
+            pass  # Cache hỏng: dựng lại từ CSV
+    if flows is None:
+        flows = read_investor_flows(vnindex_path)
+        tables = {'dates': flows.dates, 'names': np.array(list(flows.columns), dtype=str)}
+        tables.update({f"col_{i}": values for i, values in enumerate(flows.columns.values())})
+        save_disk_cache('vnindex', tables, fingerprints)
+    flows.cumsum = {name: np.concatenate([np.zeros(1, dtype=values.dtype), values.cumsum()])
+                    for name, values in flows.columns.items()}
+    flows.version = fingerprints['vnindex']['sha1'] if fingerprints else array_sha1(np.column_stack(list(flows.cumsum.values())))
+    return freeze_arrays(flows)
+
+# Hàm đo bộ nhớ của một cột hoặc ma trận
+def column_memory(values):
+    """(byte hiện tại, byte nếu không thu gọn): nhãn tính như chuỗi object, số thực tính như float64."""
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        series = pd.Series(values)
+        return series.memory_usage(deep=True, index=False), series.astype(object).memory_usage(deep=True, index=False)
+    values = np.asarray(values)
+    if values.dtype == object:
+        # copy=True: mảng dùng chung đã bị khóa ghi (freeze_arrays) mà pandas cần bộ đệm ghi được để đo chuỗi
+        size = pd.Series(values.ravel(), copy=True).memory_usage(deep=True, index=False)
+        return size, size
+    return values.nbytes, values.size * 8 if values.dtype.kind == 'f' else values.nbytes
+
+# Hàm báo cáo bộ nhớ của các bộ dữ liệu đã tải
+def memory_report(datasets):
+    """Bảng dung lượng (MB) của từng bộ dữ liệu (DataFrame, MarketMatrices hoặc InvestorFlows) trước và sau khi thu gọn kiểu."""
+    rows = []
+    for label, data in datasets.items():
+        if isinstance(data, MarketMatrices):
+            columns = [data.codes, data.names, data.close, data.volume, data.marketcap, data.trade_value] + list(data.icb or [])
+            if data.technicals is not None:
+                columns += [getattr(data.technicals, name) for name in TECHNICALS_ARRAYS]
+            for rollup in data.rollups or []:
+                columns += [rollup.labels, rollup.trade_value, rollup.marketcap, rollup.macd_count, rollup.ma200_count]
+            if data.daily is not None:
+                columns += [data.daily[column] for column in data.daily.columns]
+            if data.rankings is not None:
+                columns += [getattr(data.rankings, field.name) for field in dataclasses.fields(data.rankings)]
+        elif isinstance(data, InvestorFlows):
+            columns = [data.dates] + list(data.columns.values())
+        else:
+            columns = [data[column] for column in data.columns]
+        current, uncompact = np.sum([column_memory(values) for values in columns if values is not None], axis=0)
+        rows.append({'Dữ liệu': label, 'Trước (MB)': uncompact / 2**20, 'Sau (MB)': current / 2**20})
+    return pd.DataFrame(rows)
+
+# Hàm ước tính dung lượng của một Figure
+def figure_nbytes(fig):
+    """Dung lượng ước tính (bytes) của dữ liệu các trace, kể cả trace trong các khung hình, mà không tuần tự hóa
+    JSON: mảng NumPy tính theo nbytes, chuỗi theo độ dài, các giá trị khác 8 bytes mỗi phần tử."""
+    def size(value):
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, dict):
+            return sum(size(item) for item in value.values())
+        if isinstance(value, (list, tuple)):
+            return sum(size(item) for item in value)
+        return len(value) if isinstance(value, str) else 8
+    traces = list(fig.data) + [trace for frame in fig.frames or () for trace in frame.data]
+    return sum(size(trace.to_plotly_json()) for trace in traces)
+
+# Cache biểu đồ LRU theo (mã biểu đồ, tham số, phiên bản dữ liệu)
+class FigureCache:
+    """Cache các Figure đã tạo, giới hạn theo số mục và tổng dung lượng ước tính (figure_nbytes); loại mục dùng lâu
+    nhất trước.
+
+    Dùng chung giữa các phiên (xem figure_cache) nên mọi thao tác đều giữ khóa. Figure trả về là đối tượng
+    dùng chung: nơi cần sửa biểu đồ (ví dụ xuất PDF) phải sao chép trước khi sửa.
+    """
+    MISSING = object()
+
+    def __init__(self, max_entries=FIGURE_CACHE_MAX_ENTRIES, max_bytes=FIGURE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Figure (hoặc None nếu biểu đồ không vẽ được) của `key`, hay FigureCache.MISSING nếu chưa có."""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return self.MISSING
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, fig):
+        size = 0 if fig is None else figure_nbytes(fig)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (fig, size)
+            self.nbytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.nbytes > self.max_bytes):
+                self.nbytes -= self.entries.popitem(last=False)[1][1]
+
+    def stats(self):
+        """Số lần trúng/trượt, số mục và dung lượng (MB) hiện tại."""
+        with self.lock:
+            return {'Trúng': self.hits, 'Trượt': self.misses, 'Số mục': len(self.entries), 'MB': self.nbytes / 2**20}
+
+@st.cache_resource
+def figure_cache():
+    """FigureCache dùng chung cho mọi phiên của tiến trình Streamlit."""
+    return FigureCache()
+
+# Hàm lấy các biểu đồ từ cache, chỉ tạo những biểu đồ còn thiếu
+def cached_figures(chart_ids, params, build):
+    """Trả về dict mã → Figure theo thứ tự `chart_ids`, khóa cache là (mã biểu đồ,) + params.
+
+    `params` gồm khoảng ngày, các tùy chọn và phiên bản dữ liệu. `build(missing)` chỉ được gọi với các mã
+    chưa có trong cache và trả về dict mã → Figure (mã vắng mặt là biểu đồ không vẽ được), hoặc None nếu
+    không có dữ liệu (khi đó hàm cũng trả về None).
+    """
+    cache = figure_cache()
+    charts = {chart_id: cache.get((chart_id,) + params) for chart_id in chart_ids}
+    missing = [chart_id for chart_id, fig in charts.items() if fig is FigureCache.MISSING]
+    if missing:
+        built = build(missing)
+        if built is None:
+            return None
+        for chart_id in missing:
+            charts[chart_id] = built.get(chart_id)
+            cache.put((chart_id,) + params, charts[chart_id])
+    return {chart_id: fig for chart_id, fig in charts.items() if fig is not None}
+
+# Tải trước dữ liệu của các trang khác trong luồng nền
+class DataWarmup:
+    """Làm nóng cache (st.cache_resource) của các bộ dữ liệu mà trang hiện tại chưa cần, trong một luồng nền.
+
+    Dùng chung cho mọi phiên (xem data_warmup); mỗi bộ dữ liệu có chữ ký nguồn (source_signature) của lần làm
+    nóng gần nhất và một Event báo đã tải xong, nên khi file nguồn đổi bộ dữ liệu được làm nóng lại. Lỗi trong
+    luồng nền được ghi log và giữ lại để trang đang chờ dữ liệu đó báo cho người dùng (xem wait) trước khi tự tải lại.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = {}
+        self.errors = {}
+
+    def start(self, loaders):
+        """Tải tuần tự trong một luồng nền các bộ dữ liệu (tên → (chữ ký nguồn, hàm tải)) chưa được làm nóng với
+        chữ ký nguồn hiện tại."""
+        with self.lock:
+            pending = {}
+            for name, (signature, load) in loaders.items():
+                if name not in self.loaded or self.loaded[name][0] != signature:
+                    self.loaded[name] = (signature, threading.Event())
+                    self.errors.pop(name, None)
+                    pending[name] = (load, self.loaded[name][1])
+        if pending:
+            threading.Thread(target=self.run, args=(pending,), name='data-warmup', daemon=True).start()
+
+    def run(self, loaders):
+        for name, (load, event) in loaders.items():
+            try:
+                load()
+            except Exception as exc:
+                logging.getLogger(__name__).exception("Tải trước bộ dữ liệu '%s' thất bại", name)
+                self.errors[name] = exc
+            finally:
+                event.set()
+
+    def pending(self, name):
+        """True nếu bộ dữ liệu `name` đang được tải trong luồng nền."""
+        entry = self.loaded.get(name)
+        return entry is not None and not entry[1].is_set()
+
+    def wait(self, name):
+        """Chờ luồng nền tải xong `name`; trả về lỗi của lần tải đó (None nếu thành công)."""
+        self.loaded[name][1].wait()
+        return self.errors.get(name)
+
+@st.cache_resource
+def data_warmup():
+    """DataWarmup dùng chung cho mọi phiên của tiến trình Streamlit."""
+    return DataWarmup()
+
+# Hàm tải dữ liệu theo trang
+def dataset_loaders():
+    """Tên bộ dữ liệu → (chữ ký nguồn hiện tại, hàm tải có cache): 'overview' cho trang Tổng quan/Chi tiết,
+    'market' cho trang Market, 'vnindex' cho trang VNINDEX."""
+    overview = source_signature(DATA_PATH)
+    market = source_signature(VOLUME_PATH, PRICE_PATH, SECTOR_PATH, MARKETCAP_PATH)
+    vnindex = source_signature(VNINDEX_PATH)
+    return {
+        'overview': (overview, lambda: load_flow_cube(overview)),
+        'market': (market, lambda: load_and_prepare_data(VOLUME_PATH, PRICE_PATH, SECTOR_PATH, MARKETCAP_PATH, market)),
+        'vnindex': (vnindex, lambda: load_investor_flows(VNINDEX_PATH, vnindex))
+    }
+
+# Đo thời gian và bộ nhớ theo từng bước của một lần chạy lại (rerun)
+class PerfTrace:
+    """Ghi các span (tên, thời điểm bắt đầu, thời lượng, độ sâu) của một lần chạy lại để hiển thị và xuất Chrome trace.
+
+    Với `memory=True` mỗi span ghi thêm bộ nhớ tăng thêm và đỉnh bộ nhớ (MB, so với lúc bắt đầu span) theo
+    tracemalloc; tracemalloc đếm cấp phát của cả tiến trình nên các luồng khác (ví dụ luồng tải trước) cũng được tính.
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.origin = time.perf_counter_ns()
+        self.events = []
+        self.stack = []
+
+    @contextmanager
+    def span(self, name, **args):
+        frame = {'peak': 0}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:  # giữ lại đỉnh của span cha trước khi đặt lại đỉnh cho span con
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+        self.stack.append(frame)
+        started = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            ended = time.perf_counter_ns()
+            self.stack.pop()
+            event = {'name': name, 'ts': (started - self.origin) / 1e3, 'dur': (ended - started) / 1e3,
+                     'depth': len(self.stack), 'args': args}
+            if self.memory:
+                after, peak = tracemalloc.get_traced_memory()
+                peak = max(frame['peak'], peak)
+                if self.stack:
+                    self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+                event['args'] = dict(args, mem_delta_mb=(after - current) / 2**20, mem_peak_mb=(peak - current) / 2**20)
+            self.events.append(event)
+
+    def summary(self):
+        """Bảng các span theo thứ tự bắt đầu, tên thụt lề theo độ sâu."""
+        rows = []
+        for event in sorted(self.events, key=lambda event: (event['ts'], event['depth'])):
+            row = {'Bước': '\u2003' * event['depth'] + event['name'], 'ms': event['dur'] / 1e3}
+            if self.memory:
+                row.update({'+MB': event['args']['mem_delta_mb'], 'Đỉnh MB': event['args']['mem_peak_mb']})
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def chrome_trace(self):
+        """JSON theo định dạng Trace Event (mở bằng chrome://tracing hoặc Perfetto)."""
+        events = [{'name': event['name'], 'cat': 'c1', 'ph': 'X', 'ts': event['ts'], 'dur': event['dur'],
+                   'pid': os.getpid(), 'tid': 0, 'args': event['args']} for event in self.events]
+        return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, ensure_ascii=False, default=str).encode('utf-8')
+
+# Trace của lần chạy lại hiện tại, riêng cho từng luồng (mỗi phiên Streamlit chạy trong một luồng riêng)
+TRACE_STATE = threading.local()
+
+# Hàm đo một bước xử lý
+def perf_span(name, **args):
+    """Context manager ghi một span vào trace đang bật của luồng hiện tại; khi không đo thì không làm gì."""
+    trace = getattr(TRACE_STATE, 'trace', None)
+    if trace is None:
+        return nullcontext()
+    return trace.span(name, **args)
+
+# Hàm gọi một hàm trong một span
+def perf_call(name, func, *args, **kwargs):
+    """func(*args, **kwargs) đo trong perf_span(name); dùng ở nơi gọi các hàm tạo biểu đồ thay vì bọc thân hàm."""
+    with perf_span(name):
+        return func(*args, **kwargs)
+
+# Hàm bật/tắt trace cho lần chạy lại hiện tại
+@contextmanager
+def perf_trace(enabled, memory=False):
+    """Bật PerfTrace cho luồng hiện tại trong khối with (trả về trace, hoặc None nếu không đo)."""
+    if not enabled:
+        yield None
+        return
+    started_tracemalloc = memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    TRACE_STATE.trace = PerfTrace(memory)
+    try:
+        yield TRACE_STATE.trace
+    finally:
+        TRACE_STATE.trace = None
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+# Hàm hiển thị bảng hiệu năng
+def show_perf_panel(trace):
+    """Bảng thời gian/bộ nhớ theo bước của lần chạy lại vừa xong và nút tải Chrome trace."""
+    if not trace.events:
+        return
+    columns = {'ms': st.column_config.NumberColumn(format="%.1f")}
+    if trace.memory:
+        columns.update({'+MB': st.column_config.NumberColumn(format="%.2f"),
+                        'Đỉnh MB': st.column_config.NumberColumn(format="%.2f")})
+    st.dataframe(trace.summary(), hide_index=True, column_config=columns)
+    st.download_button(
+        label="Tải trace (JSON)",
+        data=trace.chrome_trace(),
+        file_name=f"trace_{datetime.now():%Y%m%d_%H%M%S}.json",
+        mime="application/json",
+        on_click="ignore"
+    )
 
 # Hàm lọc dữ liệu
 def filter_data_by_date(df, start_date, end_date):
-    """Lọc dữ liệu theo khoảng thời gian."""
-    start_date = pd.to_datetime(start_date).replace(hour=0, minute=0, second=0, microsecond=0)
-    end_date = pd.to_datetime(end_date).replace(hour=23, minute=59, second=59, microsecond=999999)
+    """Lọc dữ liệu theo khoảng thời gian.
+
+    Với df có DateIndex (xem attach_date_index) chỉ cần hai lần tìm kiếm nhị phân và trả về một lát cắt
+    dòng liên tục (view, không sao chép); các DataFrame khác vẫn lọc bằng mặt nạ như trước.
+    """
+    date_index = df.attrs.get('date_index')
+    if date_index is not None and date_index.offsets[-1] == len(df):
+        return df.iloc[date_index.row_range(start_date, end_date)]
+    start_date, end_date = date_bounds(start_date, end_date)
     return df[(df['Date'] >= start_date) & (df['Date'] <= end_date)]
 
 # Hàm chuẩn bị dữ liệu cho biểu đồ khớp
-def prepare_khop_data(filtered_df):
-    """Chuẩn bị dữ liệu cho biểu đồ giao dịch khớp lệnh."""
-    khop_data = filtered_df.groupby('Ngành').agg({
-        'Cá nhân Khớp Ròng': 'sum',
-        'Nước ngoài Khớp Ròng': 'sum',
-        'Tổ chức trong nước Khớp Ròng': 'sum',
-        'Tự doanh Khớp Ròng': 'sum'
-    }).reset_index()
+def prepare_khop_data(flow_totals):
+    """Chuẩn bị dữ liệu cho biểu đồ giao dịch khớp lệnh từ tổng theo ngành (FlowCube.range_totals)."""
+    khop_data = flow_totals[[
+        'Cá nhân Khớp Ròng',
+        'Nước ngoài Khớp Ròng',
+        'Tổ chức trong nước Khớp Ròng',
+        'Tự doanh Khớp Ròng'
+    ]].reset_index()
     khop_data['Tổng'] = khop_data['Cá nhân Khớp Ròng'] + khop_data['Nước ngoài Khớp Ròng'] + \
                         khop_data['Tổ chức trong nước Khớp Ròng'] + khop_data['Tự doanh Khớp Ròng']
     khop_data = khop_data.sort_values(by='Tổng', ascending=False)
@@ -152,14 +1734,14 @@ def prepare_khop_data(filtered_df):
     )
 
 # Hàm chuẩn bị dữ liệu cho biểu đồ thỏa thuận
-def prepare_thoathuan_data(filtered_df):
-    """Chuẩn bị dữ liệu cho biểu đồ giao dịch thỏa thuận."""
-    thoathuan_data = filtered_df.groupby('Ngành').agg({
-        'Cá nhân Thỏa thuận Ròng': 'sum',
-        'Nước ngoài Thỏa thuận Ròng': 'sum',
-        'Tổ chức trong nước Thỏa thuận Ròng': 'sum',
-        'Tự doanh Thỏa thuận Ròng': 'sum'
-    }).reset_index()
+def prepare_thoathuan_data(flow_totals):
+    """Chuẩn bị dữ liệu cho biểu đồ giao dịch thỏa thuận từ tổng theo ngành (FlowCube.range_totals)."""
+    thoathuan_data = flow_totals[[
+        'Cá nhân Thỏa thuận Ròng',
+        'Nước ngoài Thỏa thuận Ròng',
+        'Tổ chức trong nước Thỏa thuận Ròng',
+        'Tự doanh Thỏa thuận Ròng'
+    ]].reset_index()
     thoathuan_data['Tổng'] = thoathuan_data['Cá nhân Thỏa thuận Ròng'] + thoathuan_data['Nước ngoài Thỏa thuận Ròng'] + \
                              thoathuan_data['Tổ chức trong nước Thỏa thuận Ròng'] + thoathuan_data['Tự doanh Thỏa thuận Ròng']
     thoathuan_data = thoathuan_data.sort_values(by='Tổng', ascending=False)
@@ -196,25 +1778,25 @@ def create_stacked_bar_chart(data, title, height=CHART_HEIGHT):
 
 
 # Hàm chuẩn bị dữ liệu cho biểu đồ dòng tiền
-def prepare_flow_chart_data(filtered_df):
-    """Chuẩn bị dữ liệu cho biểu đồ thống kê dòng tiền."""
+def prepare_flow_chart_data(flow_totals):
+    """Chuẩn bị dữ liệu cho biểu đồ thống kê dòng tiền từ tổng theo ngành (FlowCube.range_totals)."""
     flow_data = {
-        'Cá nhân': filtered_df['Cá nhân Khớp Ròng'].sum() + filtered_df['Cá nhân Thỏa thuận Ròng'].sum(),
-        'Tổ chức': filtered_df['Tổ chức trong nước Khớp Ròng'].sum() + filtered_df['Tổ chức trong nước Thỏa thuận Ròng'].sum(),
-        'Tự doanh': filtered_df['Tự doanh Khớp Ròng'].sum() + filtered_df['Tự doanh Thỏa thuận Ròng'].sum(),
-        'Nước ngoài': filtered_df['Nước ngoài Khớp Ròng'].sum() + filtered_df['Nước ngoài Thỏa thuận Ròng'].sum()
+        'Cá nhân': flow_totals['Cá nhân Khớp Ròng'].sum() + flow_totals['Cá nhân Thỏa thuận Ròng'].sum(),
+        'Tổ chức': flow_totals['Tổ chức trong nước Khớp Ròng'].sum() + flow_totals['Tổ chức trong nước Thỏa thuận Ròng'].sum(),
+        'Tự doanh': flow_totals['Tự doanh Khớp Ròng'].sum() + flow_totals['Tự doanh Thỏa thuận Ròng'].sum(),
+        'Nước ngoài': flow_totals['Nước ngoài Khớp Ròng'].sum() + flow_totals['Nước ngoài Thỏa thuận Ròng'].sum()
     }
     khop_data = {
-        'Cá nhân': filtered_df['Cá nhân Khớp Ròng'].sum(),
-        'Tổ chức': filtered_df['Tổ chức trong nước Khớp Ròng'].sum(),
-        'Tự doanh': filtered_df['Tự doanh Khớp Ròng'].sum(),
-        'Nước ngoài': filtered_df['Nước ngoài Khớp Ròng'].sum()
+        'Cá nhân': flow_totals['Cá nhân Khớp Ròng'].sum(),
+        'Tổ chức': flow_totals['Tổ chức trong nước Khớp Ròng'].sum(),
+        'Tự doanh': flow_totals['Tự doanh Khớp Ròng'].sum(),
+        'Nước ngoài': flow_totals['Nước ngoài Khớp Ròng'].sum()
     }
     thoathuan_data = {
-        'Cá nhân': filtered_df['Cá nhân Thỏa thuận Ròng'].sum(),
-        'Tổ chức': filtered_df['Tổ chức trong nước Thỏa thuận Ròng'].sum(),
-        'Tự doanh': filtered_df['Tự doanh Thỏa thuận Ròng'].sum(),
-        'Nước ngoài': filtered_df['Nước ngoài Thỏa thuận Ròng'].sum()
+        'Cá nhân': flow_totals['Cá nhân Thỏa thuận Ròng'].sum(),
+        'Tổ chức': flow_totals['Tổ chức trong nước Thỏa thuận Ròng'].sum(),
+        'Tự doanh': flow_totals['Tự doanh Thỏa thuận Ròng'].sum(),
+        'Nước ngoài': flow_totals['Nước ngoài Thỏa thuận Ròng'].sum()
     }
     return flow_data, khop_data, thoathuan_data
 
@@ -279,44 +1861,75 @@ def create_flow_chart(flow_data, khop_data, thoathuan_data):
     return fig
 
 # Hàm hiển thị thống kê tổng quan
-def show_overview_statistics(filtered_df):
-    """Hiển thị thống kê tổng quan."""
+def show_overview_statistics(flow_totals):
+    """Hiển thị thống kê tổng quan từ tổng theo ngành (FlowCube.range_totals)."""
     st.subheader("Thống kê tổng quát")
     col1, col2, col3, col4, col5 = st.columns(5)
     with col1:
-        st.metric("Tổng số ngành", filtered_df['Ngành'].nunique())
+        st.metric("Tổng số ngành", len(flow_totals))
     with col2:
-        total_value_canhan = filtered_df['Cá nhân Khớp Ròng'].sum() + filtered_df['Cá nhân Thỏa thuận Ròng'].sum()
+        total_value_canhan = flow_totals['Cá nhân Khớp Ròng'].sum() + flow_totals['Cá nhân Thỏa thuận Ròng'].sum()
         st.metric("Tổng Cá nhân Ròng", f"{total_value_canhan:,.0f} VND")
     with col3:
-        total_value_nuocngoai = filtered_df['Nước ngoài Khớp Ròng'].sum() + filtered_df['Nước ngoài Thỏa thuận Ròng'].sum()
+        total_value_nuocngoai = flow_totals['Nước ngoài Khớp Ròng'].sum() + flow_totals['Nước ngoài Thỏa thuận Ròng'].sum()
         st.metric("Tổng Nước ngoài Ròng", f"{total_value_nuocngoai:,.0f} VND")
     with col4:
-        total_value_tochuc = filtered_df['Tổ chức trong nước Khớp Ròng'].sum() + filtered_df['Tổ chức trong nước Thỏa thuận Ròng'].sum()
+        total_value_tochuc = flow_totals['Tổ chức trong nước Khớp Ròng'].sum() + flow_totals['Tổ chức trong nước Thỏa thuận Ròng'].sum()
         st.metric("Tổng Tổ chức Ròng", f"{total_value_tochuc:,.0f} VND")
     with col5:
-        total_value_tudoanh = filtered_df['Tự doanh Khớp Ròng'].sum() + filtered_df['Tự doanh Thỏa thuận Ròng'].sum()
+        total_value_tudoanh = flow_totals['Tự doanh Khớp Ròng'].sum() + flow_totals['Tự doanh Thỏa thuận Ròng'].sum()
         st.metric("Tổng Tự doanh Ròng", f"{total_value_tudoanh:,.0f} VND")
 
+# Hàm hiển thị các ngày có dòng tiền ròng bất thường
+def show_flow_anomalies(cube, start_date, end_date):
+    """Bảng các ngày bất thường của FlowCube.anomalies trong khoảng ngày, lọc thêm theo ngưỡng |z-score|."""
+    st.subheader("Dòng tiền ròng bất thường")
+    st.caption(f"Ngày có dòng tiền ròng lệch khỏi trung bình trượt (EWM {ANOMALY_SPAN} ngày) của cùng ngành, "
+               f"nhà đầu tư và kênh từ {ANOMALY_Z:g} độ lệch chuẩn trở lên.")
+    min_z = st.slider("Ngưỡng |z-score|", ANOMALY_Z, 10., ANOMALY_Z, 0.5, key="anomaly_min_z")
+    events = cube.anomalies.table(cube, start_date, end_date, min_z)
+    if events.empty:
+        st.info("Không có ngày bất thường nào trong khoảng thời gian đã chọn.")
+        return
+    st.dataframe(
+        events,
+        hide_index=True,
+        column_config={
+            'Ngày': st.column_config.DateColumn(format="YYYY-MM-DD"),
+            'Ròng': st.column_config.NumberColumn(format="%.0f"),
+            'Trung bình': st.column_config.NumberColumn(format="%.0f"),
+            'Z-score': st.column_config.NumberColumn(format="%.2f")
+        }
+    )
+
 # Hàm chuẩn bị dữ liệu thời gian
-def prepare_time_series_data(filtered_df, column):
+def prepare_time_series_data(cube, column, start_date, end_date):
     """Chuẩn bị dữ liệu time series cho biểu đồ giao dịch theo thời gian."""
-    daily_data = filtered_df.groupby('Date')[column].sum().reset_index()
-    daily_data = daily_data.sort_values('Date')
+    daily_data = cube.daily_totals(column, start_date, end_date)
     daily_data['Tích lũy ròng'] = daily_data[column].cumsum()
-    daily_data['Ngày'] = daily_data['Date'].dt.strftime('%d/%m/%y')
     return daily_data
 
 # Hàm tạo biểu đồ thời gian
-def create_time_series_chart(daily_data, column, title):
-    """Tạo biểu đồ cột và đường kết hợp cho giao dịch theo thời gian."""
+def create_time_series_chart(daily_data, column, title, webgl=False):
+    """Tạo biểu đồ cột và đường kết hợp cho giao dịch theo thời gian.
+
+    Khoảng dài được gộp cột theo tuần/tháng (choose_resolution) và đường tích lũy được giảm điểm bằng LTTB,
+    nên số điểm gửi tới trình duyệt không vượt quá MAX_CHART_POINTS mỗi chuỗi. `webgl`: vẽ đường bằng Scattergl.
+    """
+    freq = choose_resolution({f: daily_data[f'Kỳ {f}'].to_numpy() for f in RESOLUTION_LABELS})
+    starts = period_starts(daily_data[f'Kỳ {freq}'].to_numpy())
+    bar_dates = daily_data['Date'].to_numpy()[starts]
+    bar_values = np.add.reduceat(daily_data[column].to_numpy(), starts) if len(starts) else []
+    line = daily_data.iloc[lttb_indices(daily_data['Tích lũy ròng'].to_numpy())]
+    if freq != 'D':
+        title = f"{title} (theo {RESOLUTION_LABELS[freq]})"
     fig = go.Figure()
-    fig.add_trace(go.Bar(x=daily_data['Ngày'], y=daily_data[column], name='Giao dịch ròng', marker_color='#1f77b4'))
-    fig.add_trace(go.Scatter(x=daily_data['Ngày'], y=daily_data['Tích lũy ròng'], name='Tích lũy ròng', mode='lines+markers',
+    fig.add_trace(go.Bar(x=bar_dates, y=bar_values, name='Giao dịch ròng', marker_color='#1f77b4'))
+    fig.add_trace((go.Scattergl if webgl else go.Scatter)(x=line['Date'], y=line['Tích lũy ròng'], name='Tích lũy ròng', mode='lines+markers',
                              marker=dict(color='darkblue'), line=dict(color='darkblue', width=2), yaxis='y2'))
     fig.update_layout(
         title=dict(text=title, font=dict(size=20)),
-        xaxis=dict(title=dict(text='Ngày', font=dict(size=14))),
+        xaxis=dict(title=dict(text='Ngày', font=dict(size=14)), **date_axis(freq)),
         yaxis=dict(title=dict(text='Giao dịch ròng (VND)', font=dict(color='#1f77b4', size=14)),
                    tickfont=dict(color='#1f77b4')),
         yaxis2=dict(title=dict(text='Tích lũy ròng (VND)', font=dict(color='darkblue', size=14)),
@@ -325,7 +1938,7 @@ def create_time_series_chart(daily_data, column, title):
         height=400,
         template="plotly_white"  # Sử dụng theme plotly_white
     )
-    fig.add_shape(type="line", x0=daily_data['Ngày'].iloc[0], y0=0, x1=daily_data['Ngày'].iloc[-1], y1=0,
+    fig.add_shape(type="line", x0=daily_data['Date'].iloc[0], y0=0, x1=daily_data['Date'].iloc[-1], y1=0,
                   line=dict(color="gray", width=1, dash="dash"))
     return fig
 
@@ -341,10 +1954,10 @@ def get_column_name(group_option, chart_option):
     else:  # "Tự doanh"
         return 'Tự doanh Khớp Ròng' if chart_option == "Khớp" else 'Tự doanh Thỏa thuận Ròng'
 
-# Hàm hiển thị biểu đồ chi tiết
-def display_detail_chart(filtered_df, column, group_option, chart_option):
-    """Hiển thị biểu đồ chi tiết theo nhóm và loại biểu đồ."""
-    df_grouped = filtered_df.groupby('Ngành')[column].sum().reset_index()
+# Hàm tạo biểu đồ chi tiết
+def create_detail_chart(flow_totals, column, group_option, chart_option):
+    """Tạo biểu đồ chi tiết theo nhóm và loại biểu đồ; tổng theo ngành lấy từ FlowCube.range_totals."""
+    df_grouped = flow_totals[column].reset_index()
     df_grouped = df_grouped.sort_values(by=column)
     chart_title = f'Giao dịch theo Ngành và {group_option} ({chart_option})'
     fig = px.bar(
@@ -356,6 +1969,11 @@ def display_detail_chart(filtered_df, column, group_option, chart_option):
         labels={column: f'{group_option} ({chart_option}) (VND)', 'Ngành': 'Ngành'},
         template="plotly_white"  # Sử dụng theme plotly_white
     )
+    return fig
+
+# Hàm hiển thị biểu đồ chi tiết
+def display_detail_chart(fig, flow_totals, filtered_df, column, group_option, chart_option):
+    """Hiển thị biểu đồ chi tiết, dữ liệu thô (tùy chọn) và thống kê của nhóm giao dịch."""
     st.plotly_chart(fig, use_container_width=True)
     if st.checkbox("Hiển thị dữ liệu thô"):
         st.subheader("Dữ liệu gốc")
@@ -363,70 +1981,94 @@ def display_detail_chart(filtered_df, column, group_option, chart_option):
     st.subheader("Thống kê tổng quát")
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("Tổng số ngành", filtered_df['Ngành'].nunique())
+        st.metric("Tổng số ngành", len(flow_totals))
     with col2:
         if not filtered_df.empty:
-            total_value = filtered_df[column].sum()
+            total_value = flow_totals[column].sum()
             st.metric(f"Tổng {group_option} ({chart_option}) Ròng", f"{total_value:,.0f} VND")
-    return fig
+
+# Hàm tạo các biểu đồ trang Tổng quan
+def overview_figures(flow_totals):
+    """Tạo các biểu đồ trang Tổng quan từ tổng theo ngành (FlowCube.range_totals), không cần phiên Streamlit."""
+    flow_data, khop_data, thoathuan_data = prepare_flow_chart_data(flow_totals)
+    return {
+        'chart_khop': create_stacked_bar_chart(
+            prepare_khop_data(flow_totals),
+            'Giao dịch Khớp lệnh ròng theo Ngành và Nhà đầu tư'
+        ),
+        'chart_thoathuan': create_stacked_bar_chart(
+            prepare_thoathuan_data(flow_totals),
+            'Giao dịch Thỏa thuận ròng theo Ngành và Nhà đầu tư'
+        ),
+        'chart_flow': create_flow_chart(flow_data, khop_data, thoathuan_data)
+    }
+
+# Hàm tạo các biểu đồ trang Chi tiết
+def detail_figures(cube, flow_totals, start_date, end_date, group_option, chart_option, webgl=False):
+    """Tạo biểu đồ theo ngành và biểu đồ theo thời gian của một nhóm giao dịch, không cần phiên Streamlit."""
+    column = get_column_name(group_option, chart_option)
+    daily_data = prepare_time_series_data(cube, column, start_date, end_date)
+    return {
+        'chart_detail': create_detail_chart(flow_totals, column, group_option, chart_option),
+        'chart_time_series': create_time_series_chart(
+            daily_data,
+            column,
+            f'Giao dịch {group_option} ({chart_option}) ròng theo thời gian',
+            webgl
+        )
+    }
 
 # Hàm hiển thị trang Tổng quan
-def show_overview_page(df):
+def show_overview_page(cube):
     """Hiển thị trang tổng quan."""
     st.title("TỔNG QUAN GIAO DỊCH THEO NGÀNH VÀ NHÀ ĐẦU TƯ")
 
     # Bộ chọn thời gian
     st.sidebar.header("Chọn khoảng thời gian")
-    min_date = df['Date'].min().date()
-    max_date = df['Date'].max().date()
+    min_date = pd.Timestamp(cube.dates[0]).date()
+    max_date = pd.Timestamp(cube.dates[-1]).date()
     start_date = st.sidebar.date_input("Ngày bắt đầu", min_date, min_value=min_date, max_value=max_date)
     end_date = st.sidebar.date_input("Ngày kết thúc", max_date, min_value=min_date, max_value=max_date)
 
-    # Lọc dữ liệu theo ngày giao dịch (không cache kết quả lọc)
-    filtered_df = filter_data_by_date(df, start_date, end_date)
+    # Tổng theo ngành của khoảng ngày, lấy từ cube (không quét lại dữ liệu gốc)
+    with perf_span('range_totals'):
+        flow_totals = cube.range_totals(start_date, end_date)
 
-    if filtered_df.empty:
+    if flow_totals.empty:
         st.warning("Không có dữ liệu nào trong khoảng thời gian đã chọn.")
         return
 
-    # Danh sách chứa tất cả các biểu đồ để xuất PDF
-    charts_for_pdf = {}
+    # Tất cả các biểu đồ của trang (lấy từ cache nếu đã tạo, dùng lại khi xuất PDF)
+    with perf_span('overview_figures'):
+        charts_for_pdf = cached_figures(
+            ('chart_khop', 'chart_thoathuan', 'chart_flow'),
+            (start_date, end_date, cube.version),
+            lambda missing: overview_figures(flow_totals)
+        )
 
-    # Chuẩn bị dữ liệu cho các biểu đồ
-    khop_data_melted = prepare_khop_data(filtered_df)
-    thoathuan_data_melted = prepare_thoathuan_data(filtered_df)
+    with perf_span('render'):
+        # Hiển thị biểu đồ khớp
+        st.subheader("Giao dịch Khớp Ròng theo ngành và nhà đầu tư")
+        st.plotly_chart(charts_for_pdf['chart_khop'], use_container_width=True)
 
-    # Hiển thị biểu đồ khớp
-    st.subheader("Giao dịch Khớp Ròng theo ngành và nhà đầu tư")
-    fig_khop = create_stacked_bar_chart(
-        khop_data_melted,
-        'Giao dịch Khớp lệnh ròng theo Ngành và Nhà đầu tư'
-    )
-    st.plotly_chart(fig_khop, use_container_width=True)
-    charts_for_pdf['chart_khop'] = fig_khop
-
-    # Hiển thị biểu đồ thỏa thuận
-    st.subheader("Giao dịch Thỏa thuận Ròng theo ngành và nhà đầu tư")
-    fig_thoathuan = create_stacked_bar_chart(
-        thoathuan_data_melted,
-        'Giao dịch Thỏa thuận ròng theo Ngành và Nhà đầu tư'
-    )
-    st.plotly_chart(fig_thoathuan, use_container_width=True)
-    charts_for_pdf['chart_thoathuan'] = fig_thoathuan
+        # Hiển thị biểu đồ thỏa thuận
+        st.subheader("Giao dịch Thỏa thuận Ròng theo ngành và nhà đầu tư")
+        st.plotly_chart(charts_for_pdf['chart_thoathuan'], use_container_width=True)
 
-    # Thêm biểu đồ thống kê dòng tiền
-    st.subheader("Thống kê dòng tiền theo nhà đầu tư")
-    flow_data, khop_data, thoathuan_data = prepare_flow_chart_data(filtered_df)
-    fig_flow = create_flow_chart(flow_data, khop_data, thoathuan_data)
-    st.plotly_chart(fig_flow, use_container_width=True)
-    charts_for_pdf['chart_flow'] = fig_flow
+        # Thêm biểu đồ thống kê dòng tiền
+        st.subheader("Thống kê dòng tiền theo nhà đầu tư")
+        st.plotly_chart(charts_for_pdf['chart_flow'], use_container_width=True)
 
-    # Hiển thị thống kê tổng quan
-    show_overview_statistics(filtered_df)
+        # Hiển thị thống kê tổng quan
+        show_overview_statistics(flow_totals)
+
+        # Các ngày có dòng tiền ròng bất thường (đã đánh dấu khi tải dữ liệu)
+        show_flow_anomalies(cube, start_date, end_date)
 
     # Nút xuất PDF cho trang tổng quan
     if st.sidebar.button("Export Selected Charts to PDF"):
-        pdf_output = export_charts_to_pdf(charts_for_pdf)
+        with perf_span('charts_to_pdf', charts=len(charts_for_pdf)):
+            pdf_output = charts_to_pdf(charts_for_pdf)
         st.download_button(
             label="Download PDF",
             data=pdf_output,
@@ -435,7 +2077,7 @@ def show_overview_page(df):
         )
 
 # Hàm hiển thị trang Chi tiết
-def show_detail_page(df):
+def show_detail_page(df, cube):
     """Hiển thị trang chi tiết."""
     st.title("CHI TIẾT GIAO DỊCH THEO NGÀNH VÀ NHÀ ĐẦU TƯ")
 
@@ -453,192 +2095,175 @@ def show_detail_page(df):
     # Lựa chọn nhóm giao dịch và loại biểu đồ
     group_option = st.sidebar.selectbox("Chọn nhóm giao dịch", ("Cá nhân", "Nước ngoài", "Tổ chức", "Tự doanh"))
     chart_option = st.sidebar.radio("Chọn loại biểu đồ", ("Khớp", "Thỏa thuận"))
+    webgl = st.sidebar.checkbox(WEBGL_LABEL)
 
-    # Lọc dữ liệu theo ngày giao dịch (không cache kết quả lọc)
-    filtered_df = filter_data_by_date(df, start_date, end_date)
+    # Lọc dữ liệu theo ngày giao dịch (chỉ dùng để hiển thị dữ liệu thô); các tổng lấy từ cube
+    with perf_span('filter_data_by_date'):
+        filtered_df = filter_data_by_date(df, start_date, end_date)
+    with perf_span('range_totals'):
+        flow_totals = cube.range_totals(start_date, end_date)
 
     if filtered_df.empty:
         st.warning("Không có dữ liệu nào trong khoảng thời gian đã chọn.")
         return
 
-    # Danh sách chứa tất cả các biểu đồ để xuất PDF
-    detail_charts_for_pdf = {}
-
     # Chọn cột tương ứng với nhóm giao dịch và loại biểu đồ
     column = get_column_name(group_option, chart_option)
 
-    # Xử lý và hiển thị dữ liệu chi tiết
-    fig_detail = display_detail_chart(filtered_df, column, group_option, chart_option)
-    detail_charts_for_pdf['chart_detail'] = fig_detail
-
-    # Hiển thị biểu đồ giao dịch theo thời gian
-    daily_data = prepare_time_series_data(filtered_df, column)
-    st.subheader(f"Giao dịch ròng {group_option} ({chart_option}) theo thời gian và tích lũy ròng")
-    fig_time_series = create_time_series_chart(
-        daily_data,
-        column,
-        f'Giao dịch {group_option} ({chart_option}) ròng theo thời gian'
-    )
-    st.plotly_chart(fig_time_series, use_container_width=True)
-    detail_charts_for_pdf['chart_time_series'] = fig_time_series
+    # Tất cả các biểu đồ của trang (lấy từ cache nếu đã tạo, dùng lại khi xuất PDF)
+    with perf_span('detail_figures'):
+        detail_charts_for_pdf = cached_figures(
+            ('chart_detail', 'chart_time_series'),
+            (start_date, end_date, group_option, chart_option, webgl, cube.version),
+            lambda missing: detail_figures(cube, flow_totals, start_date, end_date, group_option, chart_option, webgl)
+        )
 
-    # Nút xuất PDF cho trang chi tiết
-    if st.sidebar.button("Export Selected Charts to PDF"):
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            image_paths = []
-            for name, fig in detail_charts_for_pdf.items():
-                img_path = os.path.join(tmpdirname, f"{name}.png")
-                fig.write_image(img_path, format="png")
-                image_paths.append(img_path)
-            pdf = FPDF()
-            for img_path in image_paths:
-                pdf.add_page()
-                pdf.image(img_path, x=10, y=10, w=pdf.w - 20)
-            pdf_output = pdf.output(dest="S").encode("latin1")
-            st.download_button(
-                label="Download PDF",
-                data=pdf_output,
-                file_name="detail_charts.pdf",
-                mime="application/pdf"
-            )
-    
-# Hàm hiển thị trang Market
-def show_market_page(df_trade, df_marketcap, df_price):
-    """Hiển thị trang Market với các biểu đồ giao dịch và kỹ thuật."""
-    st.title("Thị trường Giao dịch")
+    with perf_span('render'):
+        # Xử lý và hiển thị dữ liệu chi tiết
+        display_detail_chart(detail_charts_for_pdf['chart_detail'], flow_totals, filtered_df, column, group_option, chart_option)
 
-    # Sidebar: Chọn khoảng thời gian
-    st.sidebar.header("Chọn khoảng thời gian")
-    min_date = min(df_trade['Date'].min().date(), df_marketcap['Date'].min().date(), df_price['Date'].min().date())
-    max_date = max(df_trade['Date'].max().date(), df_marketcap['Date'].max().date(), df_price['Date'].max().date())
-    start_date = st.sidebar.date_input("Ngày bắt đầu", min_date, min_value=min_date, max_value=max_date)
-    end_date = st.sidebar.date_input("Ngày kết thúc", max_date, min_value=min_date, max_value=max_date)
-    if start_date > end_date:
-        st.sidebar.error("Ngày bắt đầu không được lớn hơn ngày kết thúc!")
-        st.stop()
-
-    # Lọc dữ liệu theo ngày (không cache kết quả lọc)
-    filtered_df_trade = filter_data_by_date(df_trade, start_date, end_date)
-    filtered_df_marketcap = filter_data_by_date(df_marketcap, start_date, end_date)
-    filtered_df_price = filter_data_by_date(df_price, start_date, end_date)
+        # Hiển thị biểu đồ giao dịch theo thời gian
+        st.subheader(f"Giao dịch ròng {group_option} ({chart_option}) theo thời gian và tích lũy ròng")
+        st.plotly_chart(detail_charts_for_pdf['chart_time_series'], use_container_width=True)
 
-    if filtered_df_trade.empty or filtered_df_marketcap.empty or filtered_df_price.empty:
-        st.warning("Không có dữ liệu nào trong khoảng thời gian đã chọn.")
-        return
+    # Nút xuất PDF cho trang chi tiết
+    if st.sidebar.button("Export Selected Charts to PDF"):
+        with perf_span('charts_to_pdf', charts=len(detail_charts_for_pdf)):
+            pdf_output = charts_to_pdf(detail_charts_for_pdf)
+        st.download_button(
+            label="Download PDF",
+            data=pdf_output,
+            file_name="detail_charts.pdf",
+            mime="application/pdf"
+        )
 
-    # Sidebar: Chọn các biểu đồ muốn hiển thị
-    st.sidebar.header("Chọn biểu đồ")
-    show_chart1 = st.sidebar.checkbox("GTGD(B) & % thay đổi theo ngày", value=True)
-    show_chart2 = st.sidebar.checkbox("Top 15 cổ phiếu (ngày mới nhất)", value=True)
-    show_chart3 = st.sidebar.checkbox("Top 6 ngành (ngày mới nhất)", value=True)
-    show_chart4 = st.sidebar.checkbox("Bubble Chart theo nhóm ngành", value=True)
-    show_chart5 = st.sidebar.checkbox("Sức mạnh ngành theo thời gian", value=True)
-    show_chart6 = st.sidebar.checkbox("Top 10 cổ phiếu theo vốn hóa (ngày mới nhất)", value=True)
-    show_chart7 = st.sidebar.checkbox("Tỷ trọng vốn hóa theo ngành (ngày mới nhất)", value=True)
-    show_chart8 = st.sidebar.checkbox("Xu hướng vốn hóa thị trường theo thời gian", value=True)
-    show_chart9 = st.sidebar.checkbox("Số lượng cổ phiếu theo ngành có MACD tăng", value=True)
-    show_chart10 = st.sidebar.checkbox("Số lượng cổ phiếu theo ngành có MA200 tăng", value=True)
-    show_chart11 = st.sidebar.checkbox("Top 10 cổ phiếu có MACD tăng", value=True)
-    show_chart12 = st.sidebar.checkbox("Top 10 cổ phiếu có MA200 tăng", value=True)
-
-    # Dictionary lưu lại các biểu đồ để xuất PDF sau
+# Danh sách biểu đồ trang Market: (khóa, nhãn checkbox, tiêu đề, cảnh báo khi thiếu cột ngành)
+MARKET_CHARTS = [
+    ('chart1', "GTGD(B) & % thay đổi theo ngày", "1) Biểu đồ GTGD(B) & % thay đổi theo ngày", None),
+    ('chart2', "Top 15 cổ phiếu (ngày mới nhất)", "2) Biểu đồ Top 15 cổ phiếu (ngày mới nhất) với % thay đổi", None),
+    ('chart3', "Top 6 ngành (ngày mới nhất)", "3) Biểu đồ Top 6 ngành (ngày mới nhất) với % thay đổi",
+     "Không có cột 'Industry' để vẽ biểu đồ Top 6 ngành."),
+    ('chart4', "Bubble Chart theo nhóm ngành", "4) Bubble Chart theo nhóm ngành (Top 5 cổ phiếu/nhóm) với % thay đổi",
+     "Không có cột 'Industry' để vẽ Bubble Chart ngành."),
+    ('chart5', "Sức mạnh ngành theo thời gian", "5) Biểu đồ sức mạnh ngành theo thời gian",
+     "Không có cột 'Industry' để vẽ biểu đồ sức mạnh ngành."),
+    ('chart6', "Top 10 cổ phiếu theo vốn hóa (ngày mới nhất)", "6) Top 10 cổ phiếu theo vốn hóa (ngày mới nhất)", None),
+    ('chart7', "Tỷ trọng vốn hóa theo ngành (ngày mới nhất)", "7) Tỷ trọng vốn hóa theo ngành (ngày mới nhất)",
+     "Không có cột 'Industry' để vẽ biểu đồ tỷ trọng vốn hóa ngành."),
+    ('chart8', "Xu hướng vốn hóa thị trường theo thời gian", "8) Xu hướng vốn hóa thị trường theo thời gian", None),
+    ('chart9', "Số lượng cổ phiếu theo ngành có MACD tăng", "9) Số lượng cổ phiếu theo ngành có MACD tăng", None),
+    ('chart10', "Số lượng cổ phiếu theo ngành có MA200 tăng", "10) Số lượng cổ phiếu theo ngành có MA200 tăng", None),
+    ('chart11', "Top 10 cổ phiếu có MACD tăng", "11) Top 10 cổ phiếu có MACD tăng", None),
+    ('chart12', "Top 10 cổ phiếu có MA200 tăng", "12) Top 10 cổ phiếu có MA200 tăng", None),
+]
+
+# Hàm xếp vị trí các bong bóng của biểu đồ 4
+def bubble_layout(groups, sizes):
+    """Tọa độ (x, y) của từng điểm: nhóm thứ g chiếm cột [g, g + 0.8] × [0, 10], trong mỗi nhóm các điểm xếp theo
+    xoắn ốc hướng dương (điểm lớn nhất ở giữa), tính một lượt cho mọi điểm và luôn cho cùng kết quả."""
+    order = np.lexsort((-np.nan_to_num(sizes, nan=-np.inf), groups))
+    sorted_groups = groups[order]
+    counts = np.bincount(sorted_groups)
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+    radius = np.sqrt((ranks + 0.5) / counts[groups])
+    angle = ranks * np.pi * (3 - np.sqrt(5))  # góc vàng
+    return groups + 0.4 + 0.4 * radius * np.cos(angle), 5 + 5 * radius * np.sin(angle)
+
+# Hàm tạo các biểu đồ trang Market
+def market_figures(mm, start_date, end_date, selected=None, large_universe=False):
+    """Tạo các biểu đồ Market trong khoảng ngày, không cần phiên Streamlit.
+
+    `selected` là tập khóa biểu đồ cần tạo (mặc định: tất cả MARKET_CHARTS). `large_universe`: biểu đồ 4 vẽ mọi
+    mã của ngày mới nhất thay vì Top 5 mỗi ngành, biểu đồ 4 và 5 dùng trace WebGL. Trả về dict khóa → Figure theo
+    thứ tự MARKET_CHARTS (bỏ qua biểu đồ ngành nếu không có cột ngành), hoặc None nếu khoảng ngày không có dữ liệu.
+    """
+    if selected is None:
+        selected = {key for key, _, _, _ in MARKET_CHARTS}
+
+    # Lọc theo ngày: chỉ cắt các cột của ma trận (không sao chép dữ liệu)
+    date_range = mm.date_slice(start_date, end_date)
+    dates = mm.dates[date_range]
+    trade_value = mm.trade_value[:, date_range]
+    marketcap = mm.marketcap[:, date_range]
+    daily = mm.daily.iloc[date_range]
+    trade_days = np.flatnonzero(daily['TradeCount'].to_numpy() > 0)
+    cap_days = np.flatnonzero(daily['CapCount'].to_numpy() > 0)
+
+    if len(trade_days) == 0 or len(cap_days) == 0:
+        return None
+
+    # Các biểu đồ đã tạo, theo thứ tự MARKET_CHARTS
     charts = {}
 
-    # Hàm tính MACD và MA200
-    def calculate_technicals(df_price, code):
-        df_code = df_price[df_price['Code'] == code].sort_values('Date')
-        if len(df_code) < 200:  # Đảm bảo đủ dữ liệu cho MA200
-            return None, None
-        
-        # Tính EMA12, EMA26 và MACD
-        df_code['EMA12'] = df_code['Close'].ewm(span=12, adjust=False).mean()
-        df_code['EMA26'] = df_code['Close'].ewm(span=26, adjust=False).mean()
-        df_code['MACD'] = df_code['EMA12'] - df_code['EMA26']
-        df_code['Signal'] = df_code['MACD'].ewm(span=9, adjust=False).mean()
-        df_code['MACD_Increasing'] = (df_code['MACD'] > df_code['Signal']) & (df_code['MACD'].shift(1) <= df_code['Signal'].shift(1))
-        
-        # Tính MA200
-        df_code['MA200'] = df_code['Close'].rolling(window=200).mean()
-        df_code['MA200_Increasing'] = (df_code['Close'] > df_code['MA200']) & (df_code['Close'].shift(1) <= df_code['MA200'].shift(1))
-        
-        return df_code['MACD_Increasing'].iloc[-1], df_code['MA200_Increasing'].iloc[-1]
-
-    # Tính toán MACD và MA200 cho từng cổ phiếu
-    latest_date = filtered_df_price['Date'].max()
-    codes = filtered_df_price['Code'].unique()
-    macd_increasing = []
-    ma200_increasing = []
-    for code in codes:
-        macd_inc, ma200_inc = calculate_technicals(filtered_df_price, code)
-        if macd_inc is not None and ma200_inc is not None:
-            macd_increasing.append({'Code': code, 'MACD_Increasing': macd_inc})
-            ma200_increasing.append({'Code': code, 'MA200_Increasing': ma200_inc})
-
-    df_macd = pd.DataFrame(macd_increasing)
-    df_ma200 = pd.DataFrame(ma200_increasing)
-
-    # Kết hợp với thông tin ngành từ df_trade
-    df_macd = pd.merge(df_macd, df_trade[['Code', 'Industry']].drop_duplicates(), on='Code', how='left')
-    df_ma200 = pd.merge(df_ma200, df_trade[['Code', 'Industry']].drop_duplicates(), on='Code', how='left')
+    # Cờ MACD/MA200 cắt lên tại ngày cuối của khoảng chọn (chỉ báo đã tính sẵn cho toàn bộ lịch sử)
+    latest_date = dates[-1]
+    latest_price_col = date_range.start + len(dates) - 1
+    technicals = mm.technicals
+    df_signals = pd.DataFrame({
+        'Code': mm.codes,
+        'Industry': mm.industry_labels(),
+        'MACD_Increasing': technicals.macd_cross[:, latest_price_col],
+        'MA200_Increasing': technicals.ma200_cross[:, latest_price_col]
+    })
 
     # Tính số lượng cổ phiếu theo ngành có MACD và MA200 tăng
-    macd_by_industry = df_macd[df_macd['MACD_Increasing']].groupby('Industry').size().reset_index(name='Count')
-    ma200_by_industry = df_ma200[df_ma200['MA200_Increasing']].groupby('Industry').size().reset_index(name='Count')
+    macd_by_industry = df_signals[df_signals['MACD_Increasing']].groupby('Industry').size().reset_index(name='Count')
+    ma200_by_industry = df_signals[df_signals['MA200_Increasing']].groupby('Industry').size().reset_index(name='Count')
+
+    # Top 10 cổ phiếu có MACD và MA200 tăng (dựa trên giá trị giao dịch gần nhất), tra từ chỉ mục xếp hạng
+    macd_codes = top_signal_codes(mm, latest_price_col, technicals.macd_cross[:, latest_price_col], 10)
+    ma200_codes = top_signal_codes(mm, latest_price_col, technicals.ma200_cross[:, latest_price_col], 10)
+    macd_top = pd.DataFrame({'Code': mm.codes[macd_codes], 'TradeValue': trade_value[macd_codes, -1]})
+    ma200_top = pd.DataFrame({'Code': mm.codes[ma200_codes], 'TradeValue': trade_value[ma200_codes, -1]})
 
-    # Top 10 cổ phiếu có MACD và MA200 tăng (dựa trên giá trị giao dịch gần nhất)
-    df_latest_trade = filtered_df_trade[filtered_df_trade['Date'] == latest_date]
-    macd_top = pd.merge(df_macd[df_macd['MACD_Increasing']], df_latest_trade[['Code', 'TradeValue']], on='Code').nlargest(10, 'TradeValue')
-    ma200_top = pd.merge(df_ma200[df_ma200['MA200_Increasing']], df_latest_trade[['Code', 'TradeValue']], on='Code').nlargest(10, 'TradeValue')
+    # GTGD ngày giao dịch mới nhất và % thay đổi theo mã/ngành (cache theo khoảng ngày)
+    latest_trade_date, code_changes, industry_changes = latest_day_changes(mm, mm.version, start_date, end_date)
 
     ## Biểu đồ 1: GTGD(B) & % thay đổi theo ngày
-    if show_chart1:
-        st.markdown("### 1) Biểu đồ GTGD(B) & % thay đổi theo ngày")
-        daily_value = filtered_df_trade.groupby('Date')['TradeValue'].sum().reset_index().sort_values('Date')
+    if 'chart1' in selected:
+        # Gộp theo ngày/tuần/tháng tùy độ dài khoảng chọn (mỗi kỳ đánh dấu bằng ngày giao dịch đầu tiên)
+        trade_periods = {freq: ids[date_range][trade_days] for freq, ids in mm.periods.items()}
+        trade_freq = choose_resolution(trade_periods)
+        starts = period_starts(trade_periods[trade_freq])
+        daily_value = pd.DataFrame({
+            'Date': dates[trade_days][starts],
+            'TradeValue': np.add.reduceat(daily['TradeValue'].to_numpy()[trade_days], starts)
+        })
         daily_value['pct_change'] = daily_value['TradeValue'].pct_change() * 100
-        daily_value['pct_change'].fillna(0, inplace=True)
-        daily_value['Date_str'] = daily_value['Date'].dt.strftime('%Y-%m-%d')
+        daily_value['pct_change'] = daily_value['pct_change'].fillna(0)
         
         fig1 = make_subplots(specs=[[{"secondary_y": True}]])
-        fig1.add_trace(go.Bar(x=daily_value['Date_str'], y=daily_value['TradeValue'], name="GTGD(B)", marker_color='skyblue'), secondary_y=False)
-        fig1.add_trace(go.Scatter(x=daily_value['Date_str'], y=daily_value['pct_change'], name="% thay đổi", mode='lines+markers', marker_color='orange'), secondary_y=True)
+        fig1.add_trace(go.Bar(x=daily_value['Date'], y=daily_value['TradeValue'], name="GTGD(B)", marker_color='skyblue'), secondary_y=False)
+        fig1.add_trace(go.Scatter(x=daily_value['Date'], y=daily_value['pct_change'], name="% thay đổi", mode='lines+markers', marker_color='orange'), secondary_y=True)
         fig1.update_layout(
-            title="GTGD(B) theo ngày & % thay đổi",
+            title=f"GTGD(B) theo {RESOLUTION_LABELS[trade_freq]} & % thay đổi",
             template='plotly_white',
             hovermode="x unified",
             margin=dict(l=40, r=40, t=60, b=50)
         )
-        fig1.update_xaxes(title_text="Ngày", type='category', categoryorder='category ascending')
+        fig1.update_xaxes(title_text="Ngày", **date_axis(trade_freq))
         fig1.update_yaxes(title_text="GTGD(B) (tỷ đồng)", secondary_y=False)
         fig1.update_yaxes(title_text="% thay đổi", secondary_y=True)
-        st.plotly_chart(fig1, use_container_width=True)
         charts['chart1'] = fig1
 
     ## Biểu đồ 2: Top 15 cổ phiếu (ngày mới nhất) với % thay đổi
-    if show_chart2:
-        st.markdown("### 2) Biểu đồ Top 15 cổ phiếu (ngày mới nhất) với % thay đổi")
-        latest_date = filtered_df_trade['Date'].max()
-        df_latest = filtered_df_trade[filtered_df_trade['Date'] == latest_date]
-        code_latest = df_latest.groupby('Code', as_index=False)['TradeValue'].sum()
-        def compute_pct_change(code):
-            df_code = filtered_df_trade[filtered_df_trade['Code'] == code]
-            df_prev = df_code[df_code['Date'] < latest_date]
-            if df_prev.empty:
-                return 0
-            prev_date = df_prev['Date'].max()
-            prev_value = df_prev[df_prev['Date'] == prev_date]['TradeValue'].sum()
-            if prev_value == 0:
-                return 0
-            latest_value = code_latest.loc[code_latest['Code'] == code, 'TradeValue'].values[0]
-            return (latest_value - prev_value) / prev_value * 100
-        code_latest['pct_change'] = code_latest['Code'].apply(compute_pct_change)
-        top_15 = code_latest.nlargest(15, 'TradeValue')
+    if 'chart2' in selected:
+        # Top 15 tra từ chỉ mục xếp hạng của ngày giao dịch mới nhất, % thay đổi chỉ tính cho 15 mã này
+        latest_trade_col = trade_days[-1]
+        top = mm.rankings.top('trade', date_range.start + latest_trade_col, 15)
+        top_15 = pd.DataFrame({
+            'Code': mm.codes[top],
+            'TradeValue': trade_value[top, latest_trade_col],
+            'pct_change': pct_change_from(trade_value[top, latest_trade_col], previous_valid(trade_value[top], latest_trade_col))
+        })
         fig2 = px.bar(
             top_15,
             x='Code',
             y='TradeValue',
             color='Code',
             text=top_15['pct_change'].apply(lambda x: f"{x:.2f}%"),
-            title=f"Top 15 cổ phiếu (ngày {latest_date.date()})",
+            title=f"Top 15 cổ phiếu (ngày {latest_trade_date.date()})",
             template='plotly_dark',
             color_discrete_sequence=px.colors.qualitative.Pastel
         )
@@ -648,36 +2273,19 @@ def show_market_page(df_trade, df_marketcap, df_price):
             yaxis_title="Giá trị giao dịch (tỷ đồng)",
             margin=dict(l=80, r=50, t=70, b=50)
         )
-        st.plotly_chart(fig2, use_container_width=True)
         charts['chart2'] = fig2
 
     ## Biểu đồ 3: Top 6 ngành (ngày mới nhất) với % thay đổi
-    if show_chart3:
-        st.markdown("### 3) Biểu đồ Top 6 ngành (ngày mới nhất) với % thay đổi")
-        latest_date = filtered_df_trade['Date'].max()
-        df_latest = filtered_df_trade[filtered_df_trade['Date'] == latest_date]
-        if 'Industry' in df_latest.columns:
-            ind_latest = df_latest.groupby('Industry', as_index=False)['TradeValue'].sum()
-            def compute_pct_change_ind(ind):
-                df_ind = filtered_df_trade[filtered_df_trade['Industry'] == ind]
-                df_prev = df_ind[df_ind['Date'] < latest_date]
-                if df_prev.empty:
-                    return 0
-                prev_date = df_prev['Date'].max()
-                prev_value = df_prev[df_prev['Date'] == prev_date]['TradeValue'].sum()
-                if prev_value == 0:
-                    return 0
-                latest_value = ind_latest.loc[ind_latest['Industry'] == ind, 'TradeValue'].values[0]
-                return (latest_value - prev_value) / prev_value * 100
-            ind_latest['pct_change'] = ind_latest['Industry'].apply(compute_pct_change_ind)
-            top_6 = ind_latest.nlargest(6, 'TradeValue')
+    if 'chart3' in selected:
+        if industry_changes is not None:
+            top_6 = industry_changes.nlargest(6, 'TradeValue')
             fig3 = px.bar(
                 top_6,
                 x='Industry',
                 y='TradeValue',
                 color='Industry',
                 text=top_6['pct_change'].apply(lambda x: f"{x:.2f}%"),
-                title=f"Top 6 ngành (ngày {latest_date.date()})",
+                title=f"Top 6 ngành (ngày {latest_trade_date.date()})",
                 template='plotly_dark',
                 color_discrete_sequence=px.colors.qualitative.Set2
             )
@@ -687,42 +2295,20 @@ def show_market_page(df_trade, df_marketcap, df_price):
                 yaxis_title="Giá trị giao dịch (tỷ đồng)",
                 margin=dict(l=80, r=50, t=70, b=50)
             )
-            st.plotly_chart(fig3, use_container_width=True)
             charts['chart3'] = fig3
-        else:
-            st.warning("Không có cột 'Industry' để vẽ biểu đồ Top 6 ngành.")
 
     ## Biểu đồ 4: Bubble Chart theo nhóm ngành (chỉ Top 5 cổ phiếu/nhóm) với % thay đổi
-    if show_chart4:
-        st.markdown("### 4) Bubble Chart theo nhóm ngành (Top 5 cổ phiếu/nhóm) với % thay đổi")
-        latest_date = filtered_df_trade['Date'].max()
-        df_latest = filtered_df_trade[filtered_df_trade['Date'] == latest_date]
-        if 'Industry' in df_latest.columns:
-            df_ind_code = df_latest.groupby(['Industry', 'Code'], as_index=False)['TradeValue'].sum()
-            def top_n_by_industry(group, n=5):
-                return group.nlargest(n, 'TradeValue')
-            df_top_by_ind = df_ind_code.groupby('Industry', group_keys=True).apply(top_n_by_industry, n=5)
-            df_top_by_ind.reset_index(drop=True, inplace=True)
-            
-            def compute_pct_change(code):
-                df_code = filtered_df_trade[filtered_df_trade['Code'] == code]
-                df_prev = df_code[df_code['Date'] < latest_date]
-                if df_prev.empty:
-                    return 0
-                prev_date = df_prev['Date'].max()
-                prev_value = df_prev[df_prev['Date'] == prev_date]['TradeValue'].sum()
-                latest_value = df_code[df_code['Date'] == latest_date]['TradeValue'].sum()
-                if prev_value == 0:
-                    return 0
-                return (latest_value - prev_value) / prev_value * 100
+    if 'chart4' in selected:
+        if industry_changes is not None:
+            df_ind_code = code_changes.dropna(subset=['Industry']).sort_values(['Industry', 'Code'])
+            df_top_by_ind = df_ind_code.sort_values('TradeValue', ascending=False, kind='stable')
+            if not large_universe:
+                df_top_by_ind = df_top_by_ind.groupby('Industry').head(5)
+            df_top_by_ind = df_top_by_ind.sort_values('Industry', kind='stable').reset_index(drop=True)
             
-            df_top_by_ind['pct_change'] = df_top_by_ind['Code'].apply(compute_pct_change)
             df_top_by_ind['ChangeStatus'] = np.where(df_top_by_ind['pct_change'] >= 0, 'Tăng', 'Giảm')
-            
-            unique_inds = df_top_by_ind['Industry'].unique()
-            mapping = {ind: i for i, ind in enumerate(unique_inds)}
-            df_top_by_ind['x'] = df_top_by_ind['Industry'].map(mapping) + np.random.rand(len(df_top_by_ind)) * 0.8
-            df_top_by_ind['y'] = np.random.rand(len(df_top_by_ind)) * 10
+            df_top_by_ind['x'], df_top_by_ind['y'] = bubble_layout(
+                pd.factorize(df_top_by_ind['Industry'])[0], df_top_by_ind['TradeValue'].to_numpy())
             
             fig4 = px.scatter(
                 df_top_by_ind,
@@ -731,40 +2317,43 @@ def show_market_page(df_trade, df_marketcap, df_price):
                 color='ChangeStatus',
                 color_discrete_map={'Tăng': 'green', 'Giảm': 'red'},
                 hover_name='Code',
-                hover_data={'TradeValue': True, 'Industry': True, 'pct_change': ':.2f'},
-                size_max=60,
+                hover_data={'TradeValue': True, 'Industry': True, 'pct_change': ':.2f', 'x': False, 'y': False},
+                size_max=24 if large_universe else 60,
+                render_mode='webgl' if large_universe else 'auto',
                 template='plotly_dark',
-                title=f"Bubble Chart ngành (ngày {latest_date.date()}) - Top 5 cổ phiếu/nhóm"
+                title=f"Bubble Chart ngành (ngày {latest_trade_date.date()}) - "
+                      + ("Tất cả cổ phiếu" if large_universe else "Top 5 cổ phiếu/nhóm")
             )
             fig4.update_layout(
                 xaxis={'visible': False},
                 yaxis={'visible': False},
                 margin=dict(l=10, r=10, t=70, b=10)
             )
-            st.plotly_chart(fig4, use_container_width=True)
             charts['chart4'] = fig4
-        else:
-            st.warning("Không có cột 'Industry' để vẽ Bubble Chart ngành.")
 
     ## Biểu đồ 5: Sức mạnh ngành theo thời gian (line chart)
-    if show_chart5:
-        st.markdown("### 5) Biểu đồ sức mạnh ngành theo thời gian")
-        if 'Industry' not in filtered_df_trade.columns:
-            st.warning("Không có cột 'Industry' để vẽ biểu đồ sức mạnh ngành.")
-        else:
-            df_industry_daily = filtered_df_trade.groupby(['Date', 'Industry'], as_index=False)['TradeValue'].sum()
-            df_total_daily = filtered_df_trade.groupby('Date', as_index=False)['TradeValue'].sum()
-            df_total_daily.rename(columns={'TradeValue': 'TotalValue'}, inplace=True)
-            df_industry_daily = pd.merge(df_industry_daily, df_total_daily, on='Date', how='left')
-            df_industry_daily['Share'] = df_industry_daily['TradeValue'] / df_industry_daily['TotalValue']
-            pivot_share = df_industry_daily.pivot(index='Date', columns='Industry', values='Share').fillna(0)
-            pivot_share.index = pivot_share.index.strftime('%Y-%m-%d')
+    if 'chart5' in selected:
+        if mm.industries is not None:
+            rollup = mm.rollups[0]
+            industry_trade = pd.DataFrame(rollup.trade_value[:, date_range], index=pd.Index(rollup.labels))
+            industry_days = np.flatnonzero(industry_trade.notna().any(axis=0).to_numpy())
+            total_daily = daily['TradeValue'].to_numpy()[industry_days]
+            # Thị phần theo kỳ = tổng GTGD ngành trong kỳ / tổng GTGD thị trường trong kỳ
+            share_periods = {freq: ids[date_range][industry_days] for freq, ids in mm.periods.items()}
+            share_freq = choose_resolution(share_periods)
+            starts = period_starts(share_periods[share_freq])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                share = (np.add.reduceat(np.nan_to_num(industry_trade.to_numpy()[:, industry_days]), starts, axis=1)
+                         / np.add.reduceat(total_daily, starts))
+            pivot_share = pd.DataFrame(share.T, index=dates[industry_days][starts].rename('Date'),
+                                       columns=industry_trade.index.rename('Industry')).fillna(0)
             
             fig5 = px.line(
                 pivot_share,
                 x=pivot_share.index,
                 y=pivot_share.columns,
-                title="Sức mạnh ngành theo thời gian",
+                render_mode='webgl' if large_universe else 'auto',
+                title="Sức mạnh ngành theo thời gian" + (f" (theo {RESOLUTION_LABELS[share_freq]})" if share_freq != 'D' else ''),
                 template="plotly_dark"
             )
             fig5.update_layout(
@@ -773,22 +2362,23 @@ def show_market_page(df_trade, df_marketcap, df_price):
                 legend_title="Ngành",
                 margin=dict(l=60, r=40, t=70, b=50)
             )
-            st.plotly_chart(fig5, use_container_width=True)
             charts['chart5'] = fig5
 
+    # Ngày có dữ liệu vốn hóa mới nhất
+    latest_cap_col = cap_days[-1]
+    latest_cap_date = dates[latest_cap_col]
+
     ## Biểu đồ 6: Top 10 cổ phiếu theo vốn hóa (ngày mới nhất)
-    if show_chart6:
-        st.markdown("### 6) Top 10 cổ phiếu theo vốn hóa (ngày mới nhất)")
-        latest_date = filtered_df_marketcap['Date'].max()
-        df_latest = filtered_df_marketcap[filtered_df_marketcap['Date'] == latest_date]
-        top_10 = df_latest.groupby('Code', as_index=False)['MarketCap'].sum().nlargest(10, 'MarketCap')
+    if 'chart6' in selected:
+        top = mm.rankings.top('marketcap', date_range.start + latest_cap_col, 10)
+        top_10 = pd.DataFrame({'Code': mm.codes[top], 'MarketCap': marketcap[top, latest_cap_col]})
         fig6 = px.bar(
             top_10,
             x='Code',
             y='MarketCap',
             color='Code',
             text=top_10['MarketCap'].apply(lambda x: f"{x:.2f}"),
-            title=f"Top 10 cổ phiếu theo vốn hóa (ngày {latest_date.date()})",
+            title=f"Top 10 cổ phiếu theo vốn hóa (ngày {latest_cap_date.date()})",
             template='plotly_dark',
             color_discrete_sequence=px.colors.qualitative.Pastel
         )
@@ -798,39 +2388,37 @@ def show_market_page(df_trade, df_marketcap, df_price):
             yaxis_title="Vốn hóa thị trường (tỷ đồng)",
             margin=dict(l=80, r=50, t=70, b=50)
         )
-        st.plotly_chart(fig6, use_container_width=True)
         charts['chart6'] = fig6
 
     ## Biểu đồ 7: Tỷ trọng vốn hóa theo ngành (ngày mới nhất)
-    if show_chart7:
-        st.markdown("### 7) Tỷ trọng vốn hóa theo ngành (ngày mới nhất)")
-        latest_date = filtered_df_marketcap['Date'].max()
-        df_latest = filtered_df_marketcap[filtered_df_marketcap['Date'] == latest_date]
-        if 'Industry' in df_latest.columns:
-            industry_marketcap = df_latest.groupby('Industry', as_index=False)['MarketCap'].sum()
+    if 'chart7' in selected:
+        if mm.industries is not None:
+            rollup = mm.rollups[0]
+            industry_marketcap = pd.Series(rollup.marketcap[:, date_range.start + latest_cap_col], index=rollup.labels).dropna()
+            industry_marketcap = industry_marketcap.rename('MarketCap').rename_axis('Industry').reset_index()
             fig7 = px.pie(
                 industry_marketcap,
                 values='MarketCap',
                 names='Industry',
-                title=f"Tỷ trọng vốn hóa theo ngành (ngày {latest_date.date()})",
+                title=f"Tỷ trọng vốn hóa theo ngành (ngày {latest_cap_date.date()})",
                 template='plotly_dark',
                 color_discrete_sequence=px.colors.qualitative.Set2
             )
             fig7.update_traces(textinfo='percent+label')
             fig7.update_layout(margin=dict(l=50, r=50, t=70, b=50))
-            st.plotly_chart(fig7, use_container_width=True)
             charts['chart7'] = fig7
-        else:
-            st.warning("Không có cột 'Industry' để vẽ biểu đồ tỷ trọng vốn hóa ngành.")
 
     ## Biểu đồ 8: Xu hướng vốn hóa thị trường theo thời gian
-    if show_chart8:
-        st.markdown("### 8) Xu hướng vốn hóa thị trường theo thời gian")
-        daily_marketcap = filtered_df_marketcap.groupby('Date', as_index=False)['MarketCap'].sum()
-        daily_marketcap['Date_str'] = daily_marketcap['Date'].dt.strftime('%Y-%m-%d')
+    if 'chart8' in selected:
+        daily_marketcap = pd.DataFrame({
+            'Date': dates[cap_days],
+            'MarketCap': daily['MarketCap'].to_numpy()[cap_days]
+        })
+        # Giảm điểm bằng LTTB khi khoảng chọn có nhiều hơn MAX_CHART_POINTS ngày
+        daily_marketcap = daily_marketcap.iloc[lttb_indices(daily_marketcap['MarketCap'].to_numpy())]
         fig8 = px.line(
             daily_marketcap,
-            x='Date_str',
+            x='Date',
             y='MarketCap',
             title="Xu hướng vốn hóa thị trường theo thời gian",
             template='plotly_dark'
@@ -840,12 +2428,10 @@ def show_market_page(df_trade, df_marketcap, df_price):
             yaxis_title="Vốn hóa thị trường (tỷ đồng)",
             margin=dict(l=60, r=40, t=70, b=50)
         )
-        st.plotly_chart(fig8, use_container_width=True)
         charts['chart8'] = fig8
 
     ## Biểu đồ 9: Số lượng cổ phiếu theo ngành có MACD tăng
-    if show_chart9:
-        st.markdown("### 9) Số lượng cổ phiếu theo ngành có MACD tăng")
+    if 'chart9' in selected:
         fig9 = px.bar(
             macd_by_industry,
             x='Industry',
@@ -862,12 +2448,10 @@ def show_market_page(df_trade, df_marketcap, df_price):
             yaxis_title="Số lượng cổ phiếu",
             margin=dict(l=80, r=50, t=70, b=50)
         )
-        st.plotly_chart(fig9, use_container_width=True)
         charts['chart9'] = fig9
 
     ## Biểu đồ 10: Số lượng cổ phiếu theo ngành có MA200 tăng
-    if show_chart10:
-        st.markdown("### 10) Số lượng cổ phiếu theo ngành có MA200 tăng")
+    if 'chart10' in selected:
         fig10 = px.bar(
             ma200_by_industry,
             x='Industry',
@@ -884,12 +2468,10 @@ def show_market_page(df_trade, df_marketcap, df_price):
             yaxis_title="Số lượng cổ phiếu",
             margin=dict(l=80, r=50, t=70, b=50)
         )
-        st.plotly_chart(fig10, use_container_width=True)
         charts['chart10'] = fig10
 
     ## Biểu đồ 11: Top 10 cổ phiếu có MACD tăng
-    if show_chart11:
-        st.markdown("### 11) Top 10 cổ phiếu có MACD tăng")
+    if 'chart11' in selected:
         fig11 = px.bar(
             macd_top,
             x='Code',
@@ -906,12 +2488,10 @@ def show_market_page(df_trade, df_marketcap, df_price):
             yaxis_title="Giá trị giao dịch (tỷ đồng)",
             margin=dict(l=80, r=50, t=70, b=50)
         )
-        st.plotly_chart(fig11, use_container_width=True)
         charts['chart11'] = fig11
 
     ## Biểu đồ 12: Top 10 cổ phiếu có MA200 tăng
-    if show_chart12:
-        st.markdown("### 12) Top 10 cổ phiếu có MA200 tăng")
+    if 'chart12' in selected:
         fig12 = px.bar(
             ma200_top,
             x='Code',
@@ -928,52 +2508,737 @@ def show_market_page(df_trade, df_marketcap, df_price):
             yaxis_title="Giá trị giao dịch (tỷ đồng)",
             margin=dict(l=80, r=50, t=70, b=50)
         )
-        st.plotly_chart(fig12, use_container_width=True)
         charts['chart12'] = fig12
 
+    return charts
+
+# Hàm lấy tên đầy đủ của một nhóm trong cây ICB
+def icb_path_label(mm, path):
+    """Tên các nhóm trên đường dẫn `path` (tuple chỉ số nhóm từ cấp 1), nối bằng " / "."""
+    return " / ".join(mm.rollups[level].labels[node] for level, node in enumerate(path)) or "Toàn thị trường"
+
+# Hàm tạo các biểu đồ drill-down theo cấp ICB
+def icb_figures(mm, start_date, end_date, path):
+    """Tạo các biểu đồ của các nhóm con trực tiếp của nhóm `path` trong cây ICB, không cần phiên Streamlit.
+
+    `path` là tuple chỉ số nhóm từ cấp 1 (rỗng: các ngành cấp 1); dưới nhóm cấp cuối các phần tử là các mã của nhóm.
+    Chỉ cắt các tổng đã tính sẵn trong mm.rollups theo khoảng ngày, không gom nhóm lại dữ liệu theo mã.
+    Trả về dict khóa → Figure, hoặc None nếu khoảng ngày không có dữ liệu.
+    """
+    date_range = mm.date_slice(start_date, end_date)
+    dates = mm.dates[date_range]
+    parent = path[-1] if path else -1
+    if len(path) < len(mm.rollups):
+        rollup = mm.rollups[len(path)]
+        items = rollup.children(parent)
+        labels = rollup.labels[items]
+        trade_value = rollup.trade_value[items, date_range]
+        marketcap = rollup.marketcap[items, date_range]
+        item_name = f"ngành cấp {len(path) + 1}"
+    else:
+        rollup = None
+        items = np.flatnonzero(mm.rollups[-1].members == parent)
+        labels = mm.codes[items]
+        trade_value = mm.trade_value[items, date_range]
+        marketcap = mm.marketcap[items, date_range]
+        item_name = "mã"
+    trade_days = np.flatnonzero(~np.isnan(trade_value).all(axis=0))
+    cap_days = np.flatnonzero(~np.isnan(marketcap).all(axis=0))
+    if len(items) == 0 or len(trade_days) == 0 or len(cap_days) == 0:
+        return None
+    node_label = icb_path_label(mm, path)
+    charts = {}
+
+    # GTGD theo kỳ của các phần tử có tổng GTGD lớn nhất trong khoảng
+    trade_periods = {freq: ids[date_range][trade_days] for freq, ids in mm.periods.items()}
+    trade_freq = choose_resolution(trade_periods)
+    starts = period_starts(trade_periods[trade_freq])
+    top = np.argsort(-np.nansum(trade_value, axis=1, dtype=np.float64), kind='stable')[:ICB_TOP_ITEMS]
+    period_trade = np.add.reduceat(np.nan_to_num(trade_value[top][:, trade_days].astype(np.float64)), starts, axis=1)
+    fig_trade = go.Figure([
+        go.Scatter(x=dates[trade_days][starts], y=values, name=str(label), mode='lines')
+        for label, values in zip(labels[top], period_trade)
+    ])
+    fig_trade.update_layout(
+        title=f"GTGD theo {RESOLUTION_LABELS[trade_freq]} của các {item_name} trong {node_label}",
+        template='plotly_dark',
+        xaxis_title="Ngày",
+        yaxis_title="GTGD (tỷ đồng)",
+        legend_title=item_name.capitalize(),
+        hovermode="x unified",
+        margin=dict(l=60, r=40, t=70, b=50)
+    )
+    fig_trade.update_xaxes(**date_axis(trade_freq))
+    charts['icb_trade'] = fig_trade
+
+    # Tỷ trọng vốn hóa ngày mới nhất có dữ liệu (các phần tử nhỏ gộp vào "Khác")
+    latest_cap_col = cap_days[-1]
+    cap = pd.Series(marketcap[:, latest_cap_col], index=labels.astype(str)).dropna().sort_values(ascending=False)
+    if len(cap) > ICB_TOP_ITEMS:
+        cap = pd.concat([cap.iloc[:ICB_TOP_ITEMS], pd.Series({'Khác': cap.iloc[ICB_TOP_ITEMS:].sum()})])
+    fig_cap = px.pie(
+        values=cap.to_numpy(),
+        names=cap.index,
+        title=f"Tỷ trọng vốn hóa trong {node_label} (ngày {dates[latest_cap_col].date()})",
+        template='plotly_dark',
+        color_discrete_sequence=px.colors.qualitative.Set2
+    )
+    fig_cap.update_traces(textinfo='percent+label')
+    fig_cap.update_layout(margin=dict(l=50, r=50, t=70, b=50))
+    charts['icb_cap'] = fig_cap
+
+    # Số mã có MACD/MA200 cắt lên tại ngày cuối của khoảng chọn (chỉ khi các phần tử là nhóm ngành)
+    if rollup is not None:
+        latest_col = date_range.start + len(dates) - 1
+        fig_signals = go.Figure([
+            go.Bar(x=labels, y=rollup.macd_count[items, latest_col], name="MACD tăng", text=rollup.macd_count[items, latest_col]),
+            go.Bar(x=labels, y=rollup.ma200_count[items, latest_col], name="MA200 tăng", text=rollup.ma200_count[items, latest_col])
+        ])
+        fig_signals.update_traces(textposition='outside')
+        fig_signals.update_layout(
+            title=f"Số cổ phiếu có MACD/MA200 tăng trong {node_label} (ngày {dates[-1].date()})",
+            template='plotly_dark',
+            barmode='group',
+            xaxis_title=item_name.capitalize(),
+            yaxis_title="Số lượng cổ phiếu",
+            margin=dict(l=80, r=50, t=70, b=50)
+        )
+        charts['icb_signals'] = fig_signals
+    return charts
+
+# Hàm hiển thị phần drill-down theo cấp ICB
+def show_icb_drilldown(mm, start_date, end_date):
+    """Chọn lần lượt nhóm cấp 1 → 4 và hiển thị biểu đồ các nhóm con; trả về các biểu đồ đã hiển thị (để xuất PDF)."""
+    st.markdown("### 13) Drill-down ngành theo cấp ICB")
+    path = ()
+    for level, column in enumerate(st.columns(len(mm.rollups))):
+        rollup = mm.rollups[level]
+        with column:
+            # Khóa gồm cả nhóm cha để đổi nhóm cha thì các cấp dưới quay về "Tất cả"
+            node = st.selectbox(
+                f"Cấp {level + 1}",
+                [None] + rollup.children(path[-1] if path else -1).tolist(),
+                format_func=lambda node, rollup=rollup: "Tất cả" if node is None else rollup.labels[node],
+                key=f"icb_{level}_{path}"
+            )
+        if node is None:
+            break
+        path += (node,)
+
+    charts = cached_figures(
+        ('icb_trade', 'icb_cap', 'icb_signals'),
+        (start_date, end_date, path, mm.version),
+        lambda missing: perf_call('icb_figures', icb_figures, mm, start_date, end_date, path)
+    )
+    if charts is None:
+        st.warning(f"Không có dữ liệu của {icb_path_label(mm, path)} trong khoảng thời gian đã chọn.")
+        return {}
+    for fig in charts.values():
+        st.plotly_chart(fig, use_container_width=True)
+    return charts
+
+# Hàm lấy các ngày có dữ liệu xếp hạng
+def ranking_days(mm, metric, date_range, industry=None):
+    """Chỉ số cột (trong toàn bộ mm.dates) của các ngày trong `date_range` có ít nhất một mã được xếp hạng."""
+    ranked = getattr(mm.rankings, metric) if industry is None else getattr(mm.rankings, f"industry_{metric}")[industry]
+    return date_range.start + np.flatnonzero(ranked[date_range, 0] >= 0)
+
+# Hàm tạo biểu đồ Top-N theo ngày
+def ranking_figure(mm, metric, cols, n, industry=None):
+    """Biểu đồ cột ngang Top-N mã theo `metric` của các ngày `cols` (chỉ số cột của mm.dates), tra từ mm.rankings.
+
+    Một ngày: biểu đồ tĩnh; nhiều ngày: mỗi ngày một khung hình với nút chạy/dừng và thanh trượt. Thanh dùng vị trí
+    hạng làm trục dọc (mã hiển thị trên thanh) và trục giá trị cố định để các khung hình so sánh được với nhau.
+    """
+    label, field, axis_title = RANK_METRICS[metric]
+    values = getattr(mm, field)
+    scope = "" if industry is None else f" trong {mm.rollups[0].labels[industry]}"
+
+    def frame_data(col):
+        top = mm.rankings.top(metric, col, n, industry)
+        return go.Bar(
+            x=values[top, col], y=np.arange(1, len(top) + 1), orientation='h', text=mm.codes[top],
+            textposition='inside', insidetextanchor='start', marker_color=px.colors.qualitative.Pastel[0],
+            hovertemplate="%{text}: %{x:,.2f}<extra></extra>"
+        )
+
+    def frame_title(col):
+        return f"Top {n} cổ phiếu theo {label}{scope} (ngày {mm.dates[col].date()})"
+
+    x_max = max(np.nanmax(values[mm.rankings.top(metric, col, 1, industry), col], initial=0) for col in cols)
+    fig = go.Figure(frame_data(cols[0]))
+    fig.update_layout(
+        title=frame_title(cols[0]),
+        template='plotly_dark',
+        xaxis=dict(title=axis_title, range=[0, x_max * 1.05 or 1]),
+        yaxis=dict(title="Hạng", autorange='reversed', dtick=1 if n <= 20 else 5),
+        height=max(CHART_HEIGHT, 22 * n),
+        margin=dict(l=60, r=40, t=70, b=50)
+    )
+    if len(cols) > 1:
+        names = [str(mm.dates[col].date()) for col in cols]
+        fig.frames = [
+            go.Frame(data=[frame_data(col)], name=name, layout=go.Layout(title_text=frame_title(col)))
+            for col, name in zip(cols, names)
+        ]
+        fig.update_layout(
+            updatemenus=[dict(
+                type='buttons', direction='left', x=0, y=-0.08, xanchor='left', yanchor='top',
+                buttons=[
+                    dict(label="▶", method='animate',
+                         args=[None, dict(frame=dict(duration=300, redraw=True), transition=dict(duration=0), fromcurrent=True)]),
+                    dict(label="⏸", method='animate',
+                         args=[[None], dict(frame=dict(duration=0, redraw=False), mode='immediate')])
+                ]
+            )],
+            sliders=[dict(
+                x=0.08, y=-0.05, len=0.92, currentvalue=dict(prefix="Ngày: "),
+                steps=[dict(label=name, method='animate',
+                            args=[[name], dict(frame=dict(duration=0, redraw=True), mode='immediate')])
+                       for name in names]
+            )],
+            margin=dict(l=60, r=40, t=70, b=120)
+        )
+    return fig
+
+# Hàm hiển thị phần Top-N theo ngày trong quá khứ
+def show_ranking_history(mm, start_date, end_date):
+    """Chọn chỉ số, N, ngành và một ngày (hoặc chạy qua các ngày) trong khoảng chọn; trả về biểu đồ đã hiển thị."""
+    st.markdown("### 14) Top-N cổ phiếu theo ngày")
+    columns = st.columns(4)
+    metric = columns[0].radio("Xếp theo", list(RANK_METRICS), format_func=lambda key: RANK_METRICS[key][0].capitalize(),
+                              key="rank_metric")
+    n = columns[1].slider("Số mã", 5, RANK_TOP_K, 10, key="rank_n")
+    industry = None
+    if mm.rankings.industry_trade is not None:
+        labels = mm.rollups[0].labels
+        industry = columns[2].selectbox("Ngành", [None] + list(range(len(labels))),
+                                        format_func=lambda i: "Toàn thị trường" if i is None else labels[i],
+                                        key="rank_industry")
+    mode = columns[3].radio("Hiển thị", ("Một ngày", "Chạy theo ngày"), key="rank_mode")
+
+    days = ranking_days(mm, metric, mm.date_slice(start_date, end_date), industry)
+    if len(days) == 0:
+        st.warning("Không có dữ liệu xếp hạng trong khoảng thời gian đã chọn.")
+        return {}
+    if mode == "Một ngày":
+        # Ngày đã chọn trước đó nằm ngoài khoảng mới (sau khi thu hẹp khoảng ở sidebar) thì kéo về trong khoảng
+        if "rank_day" in st.session_state:
+            st.session_state["rank_day"] = min(max(st.session_state["rank_day"], start_date), end_date)
+        day = st.date_input("Ngày", mm.dates[days[-1]].date(), min_value=start_date, max_value=end_date, key="rank_day")
+        # Ngày không có dữ liệu thì lấy ngày giao dịch gần nhất trước đó
+        cols = days[max(np.searchsorted(mm.dates[days], pd.Timestamp(day), side='right') - 1, 0):][:1]
+    else:
+        cols = days[np.unique(np.linspace(0, len(days) - 1, min(len(days), RANK_ANIMATION_FRAMES)).round().astype(int))]
+
+    charts = cached_figures(
+        ('ranking',),
+        (tuple(cols.tolist()), metric, n, industry, mm.version),
+        lambda missing: {'ranking': ranking_figure(mm, metric, cols, n, industry)}
+    )
+    st.plotly_chart(charts['ranking'], use_container_width=True)
+    return charts
+
+# Hàm tạo các biểu đồ trang VNINDEX
+def vnindex_figures(flows, start_date, end_date):
+    """Tạo các biểu đồ dòng tiền VNINDEX theo loại nhà đầu tư trong khoảng ngày (tỷ VND), không cần phiên Streamlit."""
+    investors = list(VNINDEX_INVESTORS)
+    net = flows.range_totals([f"{inv} - Tổng GT ròng (nghìn VND)" for inv in investors], start_date, end_date) / 1e6
+    buy = flows.range_totals([f"{inv} - Tổng GT mua (nghìn VND)" for inv in investors], start_date, end_date) / 1e6
+    sell = flows.range_totals([f"{inv} - Tổng GT bán (nghìn VND)" for inv in investors], start_date, end_date) / 1e6
+    channels = {
+        channel: flows.range_totals([f"{inv} (Ròng) - GT ròng {channel} (nghìn VND)" for inv in investors], start_date, end_date) / 1e6
+        for channel in ('khớp lệnh', 'thỏa thuận')
+    }
+
+    fig_net = px.bar(
+        x=investors,
+        y=net.to_numpy(),
+        color=investors,
+        text=[f"{value:,.2f}" for value in net],
+        title="Giá trị ròng theo loại nhà đầu tư (tỷ VND)",
+        template="plotly_white"
+    )
+    fig_net.update_traces(textposition='outside')
+    fig_net.update_layout(xaxis_title="Loại nhà đầu tư", yaxis_title="Giá trị ròng (tỷ VND)", showlegend=False)
+
+    fig_buy_sell = go.Figure([
+        go.Bar(x=investors, y=buy.to_numpy(), name='Mua', marker_color='#2ca02c'),
+        go.Bar(x=investors, y=sell.to_numpy(), name='Bán', marker_color='#d62728')
+    ])
+    fig_buy_sell.update_layout(
+        title="Giá trị mua và bán theo loại nhà đầu tư (tỷ VND)",
+        barmode='group',
+        yaxis_title="Giá trị (tỷ VND)",
+        template="plotly_white"
+    )
+
+    fig_channel = go.Figure([
+        go.Bar(x=investors, y=values.to_numpy(), name=channel.capitalize())
+        for channel, values in channels.items()
+    ])
+    fig_channel.update_layout(
+        title="Giá trị ròng khớp lệnh và thỏa thuận theo loại nhà đầu tư (tỷ VND)",
+        barmode='group',
+        yaxis_title="Giá trị ròng (tỷ VND)",
+        template="plotly_white"
+    )
+
+    # Giá trị ròng tích lũy từ đầu khoảng chọn, giảm điểm bằng LTTB cho khoảng dài
+    running = flows.running_totals([f"{inv} - Tổng GT ròng (nghìn VND)" for inv in investors], start_date, end_date)
+    fig_running = go.Figure()
+    for inv in investors:
+        values = running[f"{inv} - Tổng GT ròng (nghìn VND)"].to_numpy() / 1e6
+        keep = lttb_indices(values)
+        fig_running.add_trace(go.Scatter(x=running['Date'].to_numpy()[keep], y=values[keep], name=inv, mode='lines'))
+    fig_running.update_layout(
+        title="Giá trị ròng tích lũy theo loại nhà đầu tư (tỷ VND)",
+        xaxis=dict(title="Ngày", type='date'),
+        yaxis_title="Giá trị ròng tích lũy (tỷ VND)",
+        hovermode="x unified",
+        template="plotly_white"
+    )
+    return {
+        'vnindex_net': fig_net,
+        'vnindex_buy_sell': fig_buy_sell,
+        'vnindex_channel': fig_channel,
+        'vnindex_running': fig_running
+    }
+
+# Hàm hiển thị trang VNINDEX
+def show_vnindex_page(flows):
+    """Hiển thị trang dòng tiền VNINDEX theo loại nhà đầu tư."""
+    st.title("DÒNG TIỀN VNINDEX THEO LOẠI NHÀ ĐẦU TƯ")
+
+    # Bộ chọn thời gian
+    st.sidebar.header("Chọn khoảng thời gian")
+    min_date = pd.Timestamp(flows.dates[0]).date()
+    max_date = pd.Timestamp(flows.dates[-1]).date()
+    start_date = st.sidebar.date_input("Ngày bắt đầu", min_date, min_value=min_date, max_value=max_date)
+    end_date = st.sidebar.date_input("Ngày kết thúc", max_date, min_value=min_date, max_value=max_date)
+
+    first, last = flows.date_rows(start_date, end_date)
+    if first >= last:
+        st.warning("Không có dữ liệu nào trong khoảng thời gian đã chọn.")
+        return
+
+    # Tất cả các biểu đồ của trang (lấy từ cache nếu đã tạo, dùng lại khi xuất PDF)
+    charts_for_pdf = cached_figures(
+        ('vnindex_net', 'vnindex_buy_sell', 'vnindex_channel', 'vnindex_running'),
+        (start_date, end_date, flows.version),
+        lambda missing: perf_call('vnindex_figures', vnindex_figures, flows, start_date, end_date)
+    )
+
+    # Thống kê tổng quát
+    st.subheader("Thống kê tổng quát")
+    net = flows.range_totals([f"{inv} - Tổng GT ròng (nghìn VND)" for inv in VNINDEX_INVESTORS], start_date, end_date)
+    for col, inv in zip(st.columns(len(VNINDEX_INVESTORS)), VNINDEX_INVESTORS):
+        with col:
+            st.metric(f"{inv} ròng", f"{net[f'{inv} - Tổng GT ròng (nghìn VND)'] * 1000:,.0f} VND")
+
+    st.subheader("Giá trị ròng theo loại nhà đầu tư")
+    st.plotly_chart(charts_for_pdf['vnindex_net'], use_container_width=True)
+    st.subheader("Giá trị mua và bán")
+    st.plotly_chart(charts_for_pdf['vnindex_buy_sell'], use_container_width=True)
+    st.subheader("Khớp lệnh và thỏa thuận")
+    st.plotly_chart(charts_for_pdf['vnindex_channel'], use_container_width=True)
+    st.subheader("Giá trị ròng tích lũy theo thời gian")
+    st.plotly_chart(charts_for_pdf['vnindex_running'], use_container_width=True)
+
+    # Nút xuất PDF cho trang VNINDEX
+    if st.sidebar.button("Export Selected Charts to PDF"):
+        st.download_button(
+            label="Download PDF",
+            data=charts_to_pdf(charts_for_pdf),
+            file_name="vnindex_charts.pdf",
+            mime="application/pdf"
+        )
+
+# Hàm hiển thị trang Market
+def show_market_page(mm):
+    """Hiển thị trang Market với các biểu đồ giao dịch và kỹ thuật."""
+    st.title("Thị trường Giao dịch")
+
+    # Sidebar: Chọn khoảng thời gian
+    st.sidebar.header("Chọn khoảng thời gian")
+    min_date = mm.dates.min().date()
+    max_date = mm.dates.max().date()
+    start_date = st.sidebar.date_input("Ngày bắt đầu", min_date, min_value=min_date, max_value=max_date)
+    end_date = st.sidebar.date_input("Ngày kết thúc", max_date, min_value=min_date, max_value=max_date)
+    if start_date > end_date:
+        st.sidebar.error("Ngày bắt đầu không được lớn hơn ngày kết thúc!")
+        st.stop()
+
+    # Sidebar: Chọn các biểu đồ muốn hiển thị
+    st.sidebar.header("Chọn biểu đồ")
+    selected = {key for key, label, _, _ in MARKET_CHARTS if st.sidebar.checkbox(label, value=True)}
+    show_icb = bool(mm.rollups) and st.sidebar.checkbox("Drill-down ngành theo cấp ICB", value=True)
+    show_ranking = st.sidebar.checkbox("Top-N theo ngày (lịch sử)", value=True)
+    large_universe = st.sidebar.checkbox(WEBGL_LABEL, help="Bubble chart vẽ mọi mã của ngày mới nhất")
+
+    # Chỉ tạo các biểu đồ được chọn mà chưa có trong cache
+    with perf_span('market_figures'):
+        charts = cached_figures(
+            [key for key, _, _, _ in MARKET_CHARTS if key in selected],
+            (start_date, end_date, large_universe, mm.version),
+            lambda missing: market_figures(mm, start_date, end_date, set(missing), large_universe)
+        )
+    if charts is None:
+        st.warning("Không có dữ liệu nào trong khoảng thời gian đã chọn.")
+        return
+
+    with perf_span('render'):
+        for key, _, heading, industry_warning in MARKET_CHARTS:
+            if key not in selected:
+                continue
+            st.markdown(f"### {heading}")
+            if key in charts:
+                st.plotly_chart(charts[key], use_container_width=True)
+            else:
+                st.warning(industry_warning)
+
+    if show_icb:
+        with perf_span('icb_drilldown'):
+            charts = dict(charts, **show_icb_drilldown(mm, start_date, end_date))
+    if show_ranking:
+        with perf_span('ranking_history'):
+            charts = dict(charts, **show_ranking_history(mm, start_date, end_date))
 
     # Nút xuất PDF cho trang Market
     if st.sidebar.button("Export Selected Charts to PDF"):
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            image_paths = []
-            for name, fig in charts.items():
-                img_path = os.path.join(tmpdirname, f"{name}.png")
-                fig.write_image(img_path, format="png")
-                image_paths.append(img_path)
-            pdf = FPDF()
-            for img_path in image_paths:
-                pdf.add_page()
-                pdf.image(img_path, x=10, y=10, w=pdf.w - 20)
-            pdf_output = pdf.output(dest="S").encode("latin1")
-            st.download_button(
-                label="Download PDF",
-                data=pdf_output,
-                file_name="market_charts.pdf",
-                mime="application/pdf"
-            )
+        with perf_span('charts_to_pdf', charts=len(charts)):
+            pdf_output = charts_to_pdf(charts)
+        st.download_button(
+            label="Download PDF",
+            data=pdf_output,
+            file_name="market_charts.pdf",
+            mime="application/pdf"
+        )
 
-def main():
-    """Hàm chính của ứng dụng."""
-    st.sidebar.title("Điều hướng")
-    page = st.sidebar.radio("Chọn trang:", ("Tổng quan", "Chi tiết", "Market"))
+# Điều kiện của bộ lọc cổ phiếu
+@dataclass(frozen=True)
+class ScreenCriteria:
+    """Các điều kiện kết hợp (AND) của bộ lọc; giá trị None/rỗng nghĩa là không dùng điều kiện đó.
+
+    Các tham số cửa sổ (ma_window, return_days, cross_days) luôn được dùng để tính cột hiển thị tương ứng.
+    """
+    ma_window: int = 50
+    price_vs_ma: str = None  # 'trên' hoặc 'dưới' MA-N
+    return_days: int = 20
+    return_min: float = None  # % lợi nhuận N phiên
+    return_max: float = None
+    cross_days: int = 5
+    macd_cross: bool = False  # MACD cắt lên Signal trong cross_days phiên gần nhất
+    ma200_cross: bool = False  # giá cắt lên MA200 trong cross_days phiên gần nhất
+    trade_percentile: float = None  # phân vị GTGD tối thiểu trong ngày (0–100)
+    cap_rank: int = None  # chỉ giữ các mã có hạng vốn hóa ≤ cap_rank
+    industry_level: int = 0
+    industries: tuple = ()
+
+# Hàm lấy cột giá trị tại một ngày, trễ `lag` phiên
+def lagged_column(values, col, lag):
+    """Cột `col - lag` của ma trận dạng float64, hoặc NaN nếu trước ngày đầu tiên."""
+    if col - lag < 0:
+        return np.full(len(values), np.nan)
+    return values[:, col - lag].astype(np.float64)
+
+# Hàm lọc cổ phiếu theo điều kiện
+def screen_stocks(mm, as_of_col, criteria):
+    """Đánh giá các điều kiện cho mọi mã tại cột ngày `as_of_col` bằng phép toán trên ma trận (không lặp theo mã).
+
+    Mỗi điều kiện là một mặt nạ bool theo mã lấy từ vài cột quanh ngày đang xét của các ma trận mã × ngày;
+    trả về bảng các mã thỏa mọi điều kiện cùng các chỉ số dùng để xếp hạng.
+    """
+    close = lagged_column(mm.close, as_of_col, 0)
+    window = mm.close[:, max(as_of_col - criteria.ma_window + 1, 0):as_of_col + 1].astype(np.float64)
+    ma = window.mean(axis=1) if window.shape[1] == criteria.ma_window else np.full(len(close), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = (close / lagged_column(mm.close, as_of_col, criteria.return_days) - 1) * 100
+    trade_value = lagged_column(mm.trade_value, as_of_col, 0)
+    marketcap = lagged_column(mm.marketcap, as_of_col, 0)
+    recent = slice(max(as_of_col - criteria.cross_days + 1, 0), as_of_col + 1)
+    table = pd.DataFrame({
+        'Mã': mm.codes,
+        'Tên công ty': mm.names,
+        'Ngành': None,
+        'Giá': close,
+        f'MA{criteria.ma_window}': ma,
+        f'% {criteria.return_days} phiên': returns,
+        'GTGD (tỷ)': trade_value,
+        'Phân vị GTGD': pd.Series(trade_value).rank(pct=True).to_numpy() * 100,
+        'Vốn hóa': marketcap,
+        'Hạng vốn hóa': pd.Series(marketcap).rank(ascending=False, method='min').to_numpy(),
+        'MACD cắt lên': mm.technicals.macd_cross[:, recent].any(axis=1),
+        'MA200 cắt lên': mm.technicals.ma200_cross[:, recent].any(axis=1)
+    })
+
+    mask = ~np.isnan(close)
+    with np.errstate(invalid='ignore'):
+        if criteria.price_vs_ma == 'trên':
+            mask &= close > ma
+        elif criteria.price_vs_ma == 'dưới':
+            mask &= close < ma
+        if criteria.return_min is not None:
+            mask &= returns >= criteria.return_min
+        if criteria.return_max is not None:
+            mask &= returns <= criteria.return_max
+        if criteria.trade_percentile is not None:
+            mask &= table['Phân vị GTGD'].to_numpy() >= criteria.trade_percentile
+        if criteria.cap_rank is not None:
+            mask &= table['Hạng vốn hóa'].to_numpy() <= criteria.cap_rank
+    if criteria.macd_cross:
+        mask &= table['MACD cắt lên'].to_numpy()
+    if criteria.ma200_cross:
+        mask &= table['MA200 cắt lên'].to_numpy()
+    if mm.icb:
+        table['Ngành'] = np.asarray(mm.icb[criteria.industry_level], dtype=object)
+        if criteria.industries:
+            mask &= table['Ngành'].isin(criteria.industries).to_numpy()
+    return table[mask].reset_index(drop=True)
+
+# Hàm hiển thị trang bộ lọc cổ phiếu
+def show_screener_page(mm):
+    """Hiển thị trang lọc cổ phiếu toàn thị trường theo các điều kiện kết hợp, kết quả xếp hạng và phân trang."""
+    st.title("BỘ LỌC CỔ PHIẾU")
+
+    # Sidebar: ngày xét và các điều kiện
+    st.sidebar.header("Ngày xét")
+    min_date = mm.dates.min().date()
+    max_date = mm.dates.max().date()
+    as_of = st.sidebar.date_input("Ngày", max_date, min_value=min_date, max_value=max_date)
+    as_of_col = int(mm.dates.searchsorted(pd.Timestamp(as_of), 'right')) - 1
+
+    st.sidebar.header("Điều kiện lọc")
+    ma_window = st.sidebar.number_input("Số phiên MA", min_value=2, max_value=400, value=50)
+    price_vs_ma = st.sidebar.selectbox("Giá so với MA", (None, 'trên', 'dưới'),
+                                       format_func=lambda option: "Không lọc" if option is None else option)
+    return_days = st.sidebar.number_input("Số phiên tính lợi nhuận", min_value=1, max_value=500, value=20)
+    return_min = return_max = None
+    if st.sidebar.checkbox("Lọc theo lợi nhuận"):
+        return_min, return_max = st.sidebar.slider("Lợi nhuận (%)", -100.0, 300.0, (0.0, 300.0), step=1.0)
+    cross_days = st.sidebar.number_input("Tín hiệu cắt lên trong số phiên gần nhất", min_value=1, max_value=60, value=5)
+    macd_cross = st.sidebar.checkbox("MACD cắt lên")
+    ma200_cross = st.sidebar.checkbox("Giá cắt lên MA200")
+    trade_percentile = None
+    if st.sidebar.checkbox("Lọc theo phân vị GTGD"):
+        trade_percentile = st.sidebar.slider("Phân vị GTGD tối thiểu", 0, 100, 80)
+    cap_rank = None
+    if st.sidebar.checkbox("Lọc theo hạng vốn hóa"):
+        cap_rank = st.sidebar.number_input("Top vốn hóa", min_value=1, max_value=len(mm.codes), value=min(100, len(mm.codes)))
+    industry_level, industries = 0, ()
+    if mm.icb:
+        industry_level = st.sidebar.selectbox("Cấp ngành ICB", range(len(mm.icb)), format_func=lambda level: f"Cấp {level + 1}")
+        options = sorted(pd.Series(np.asarray(mm.icb[industry_level], dtype=object)).dropna().unique())
+        industries = tuple(st.sidebar.multiselect("Ngành", options))
+
+    criteria = ScreenCriteria(
+        ma_window=int(ma_window), price_vs_ma=price_vs_ma, return_days=int(return_days),
+        return_min=return_min, return_max=return_max, cross_days=int(cross_days),
+        macd_cross=macd_cross, ma200_cross=ma200_cross, trade_percentile=trade_percentile,
+        cap_rank=cap_rank, industry_level=industry_level, industries=industries
+    )
+    with perf_span('screen_stocks'):
+        results = screen_stocks(mm, as_of_col, criteria)
+    st.caption(f"Ngày xét: {mm.dates[as_of_col].date()} — {len(results):,} / {len(mm.codes):,} mã thỏa điều kiện")
+    if results.empty:
+        st.warning("Không có mã nào thỏa các điều kiện đã chọn.")
+        return
+
+    # Xếp hạng và phân trang
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        numeric_columns = [column for column in results.columns if results[column].dtype.kind in 'fi']
+        sort_column = st.selectbox("Xếp theo", numeric_columns, index=numeric_columns.index('GTGD (tỷ)'))
+    with col2:
+        ascending = st.radio("Thứ tự", ("Giảm dần", "Tăng dần"), horizontal=True) == "Tăng dần"
+    with col3:
+        page_size = st.selectbox("Số dòng mỗi trang", SCREENER_PAGE_SIZES)
+    n_pages = -(-len(results) // page_size)
+    page_number = st.number_input(f"Trang (1–{n_pages})", min_value=1, max_value=n_pages, value=1, key=f"screener_page_{n_pages}")
+    ranked = results.sort_values(sort_column, ascending=ascending, na_position='last', kind='stable').reset_index(drop=True)
+    ranked.index = ranked.index + 1
+    st.dataframe(
+        ranked.iloc[(page_number - 1) * page_size:page_number * page_size],
+        column_config={
+            'Giá': st.column_config.NumberColumn(format="%.2f"),
+            f'MA{criteria.ma_window}': st.column_config.NumberColumn(format="%.2f"),
+            f'% {criteria.return_days} phiên': st.column_config.NumberColumn(format="%.2f"),
+            'GTGD (tỷ)': st.column_config.NumberColumn(format="%.2f"),
+            'Phân vị GTGD': st.column_config.NumberColumn(format="%.1f"),
+            'Vốn hóa': st.column_config.NumberColumn(format="%.2f"),
+            'Hạng vốn hóa': st.column_config.NumberColumn(format="%d")
+        }
+    )
+
+# Hàm chạy backtest trên lưới tham số
+@st.cache_data(max_entries=8)
+def backtest_results(_mm, data_version, level, grid, holdings, exit_on_cross):
+    """Kết quả run_backtest_grid theo nhóm ngành cấp `level`; `grid` là tuple các bộ tham số dạng tuple (key, value)."""
+    if _mm.rollups:
+        members, labels = _mm.rollups[level].members, _mm.rollups[level].labels
+    else:
+        members, labels = np.full(len(_mm.codes), -1), np.array([], dtype=object)
+    return run_backtest_grid(_mm.close, members, labels, [dict(params) for params in grid], holdings, exit_on_cross)
+
+# Hàm đặt tên một bộ tham số backtest
+def backtest_label(params):
+    rule = f"MACD {params['fast']}/{params['slow']}/{params['signal']}" if params['rule'] == 'MACD' else f"Giá cắt MA{params['ma_window']}"
+    return f"{rule} – nắm giữ {params['holding']} phiên"
+
+# Hàm tạo biểu đồ đường vốn của một kết quả backtest
+def backtest_equity_figure(mm, result):
+    """Đường vốn theo ngành của `result` (giảm điểm bằng LTTB), không cần phiên Streamlit."""
+    fig = go.Figure()
+    dates = mm.dates.to_numpy()
+    for label, values in zip(result.equity_labels, result.equity):
+        keep = lttb_indices(values)
+        fig.add_trace(go.Scatter(x=dates[keep], y=values[keep], name=label, mode='lines',
+                                 line=dict(width=3 if label == MARKET_LABEL else 1.5)))
+    fig.update_layout(
+        title=f"Đường vốn theo ngành – {backtest_label(result.params)}",
+        xaxis=dict(title="Ngày", type='date'),
+        yaxis=dict(title="Vốn (lần vốn ban đầu)", type='log'),
+        hovermode="x unified",
+        height=CHART_HEIGHT,
+        template="plotly_white"
+    )
+    return fig
+
+# Hàm hiển thị trang backtest tín hiệu
+def show_backtest_page(mm):
+    """Backtest tín hiệu cắt lên MACD/MA trên toàn bộ mã với lưới tham số, thống kê và đường vốn theo ngành."""
+    st.title("BACKTEST TÍN HIỆU")
+
+    # Sidebar: lưới tham số (chỉ chạy lại khi bấm nút)
+    with st.sidebar.form("backtest_params"):
+        st.header("Lưới tham số")
+        rule = st.radio("Tín hiệu mua", ('MACD', 'MA'),
+                        format_func=lambda option: "MACD cắt lên Signal" if option == 'MACD' else "Giá cắt lên MA")
+        fast_spans = st.multiselect("EMA nhanh", BACKTEST_EMA_SPANS, default=[EMA_FAST])
+        slow_spans = st.multiselect("EMA chậm", BACKTEST_EMA_SPANS, default=[EMA_SLOW])
+        signal_spans = st.multiselect("EMA Signal", BACKTEST_SIGNAL_SPANS, default=[EMA_SIGNAL])
+        ma_windows = st.multiselect("Số phiên MA", BACKTEST_MA_WINDOWS, default=[MA_WINDOW])
+        holdings = st.multiselect("Số phiên nắm giữ", BACKTEST_HOLDINGS, default=[5, 20])
+        exit_on_cross = st.checkbox("Bán sớm khi có tín hiệu cắt xuống")
+        level = 0
+        if mm.rollups:
+            level = st.selectbox("Cấp ngành ICB", range(len(mm.rollups)), format_func=lambda level: f"Cấp {level + 1}")
+        if st.form_submit_button("Chạy backtest"):
+            grid = parameter_grid(rule, sorted(fast_spans), sorted(slow_spans), sorted(signal_spans), sorted(ma_windows))
+            st.session_state['backtest_run'] = (level, tuple(tuple(params.items()) for params in grid),
+                                                tuple(sorted(holdings)), exit_on_cross)
+
+    run = st.session_state.get('backtest_run')
+    if run is None:
+        st.info("Chọn lưới tham số ở thanh bên rồi bấm \"Chạy backtest\".")
+        return
+    level, grid, holdings, exit_on_cross = run
+    if not grid or not holdings:
+        st.warning("Lưới tham số rỗng (cần ít nhất một thời gian nắm giữ, và EMA nhanh nhỏ hơn EMA chậm với MACD).")
+        return
+    with st.spinner(f"Đang backtest {len(grid) * len(holdings)} bộ tham số..."), perf_span('backtest_results', runs=len(grid) * len(holdings)):
+        results = backtest_results(mm, mm.version, level, grid, holdings, exit_on_cross)
+
+    # So sánh các bộ tham số trên toàn thị trường
+    st.markdown("### So sánh các bộ tham số (toàn thị trường)")
+    overview = pd.DataFrame([
+        dict(**{'Bộ tham số': backtest_label(result.params)}, **result.summary.loc[MARKET_LABEL].to_dict(),
+             **{'Vốn cuối (lần)': result.equity[-1, -1]})
+        for result in results if MARKET_LABEL in result.summary.index
+    ])
+    if overview.empty:
+        st.warning("Không có lệnh nào đã đóng với các bộ tham số đã chọn.")
+        return
+    overview['Số lệnh'] = overview['Số lệnh'].astype(int)
+    st.dataframe(overview.round(2), hide_index=True)
+
+    # Chi tiết theo ngành của một bộ tham số
+    selected = st.selectbox("Xem chi tiết bộ tham số", range(len(results)), format_func=lambda i: backtest_label(results[i].params))
+    result = results[selected]
+    st.markdown(f"### Thống kê theo ngành cấp {level + 1}")
+    st.dataframe(result.summary.round(2))
+    with perf_span('backtest_equity_figure'):
+        fig = backtest_equity_figure(mm, result)
+    st.plotly_chart(fig, use_container_width=True)
 
 def main():
     """Hàm chính của ứng dụng."""
+    # Thiết lập trang (trong main để import c1 từ batch_report.py không cần phiên Streamlit)
+    st.set_page_config(page_title="Dashboard Giao dịch và Thị trường", layout="wide")
+    # Copy-on-Write: các DataFrame dùng chung giữa các phiên (st.cache_resource) không bao giờ bị sửa qua lát cắt
+    # hay phép gán của một phiên; lát cắt theo ngày vẫn là view, chỉ sao chép khi bị ghi. Chỉ bật trong ứng dụng
+    # Streamlit để import c1 (batch_report.py, benchmark.py) không đổi hành vi pandas của chương trình gọi.
+    pd.set_option('mode.copy_on_write', True)
     st.sidebar.title("Điều hướng")
-    page = st.sidebar.radio("Chọn trang:", ("Tổng quan", "Chi tiết", "Market"))
-
-    # Tải dữ liệu
-    df = load_data()
-    df_trade, df_marketcap, df_price = load_and_prepare_data(VOLUME_PATH, PRICE_PATH, SECTOR_PATH, MARKETCAP_PATH)
-     # Thêm dòng này để tải df_price
+    page = st.sidebar.radio("Chọn trang:", ("Tổng quan", "Chi tiết", "Market", "Bộ lọc cổ phiếu", "Backtest tín hiệu", "VNINDEX"))
+
+    # Đo hiệu năng từng bước (tắt mặc định; khi tắt perf_span không làm gì)
+    perf_panel = st.sidebar.expander("Hiệu năng")
+    with perf_panel:
+        profiling = st.checkbox("Đo thời gian từng bước", key="perf_enabled")
+        profile_memory = st.checkbox("Đo cả bộ nhớ (tracemalloc, chậm hơn)", key="perf_memory", disabled=not profiling)
+
+    with perf_trace(profiling, profile_memory) as trace:
+        with perf_span('main', page=page):
+            show_page(page)
+        if trace is not None:
+            with perf_panel:
+                show_perf_panel(trace)
+
+# Hàm tải dữ liệu và hiển thị một trang
+def show_page(page):
+    """Tải bộ dữ liệu trang `page` cần, hiển thị trang rồi tải trước dữ liệu các trang khác."""
+    # Chỉ tải dữ liệu trang đang xem cần; nếu luồng nền đang tải dữ liệu đó thì chờ nó xong
+    dataset = {"Market": 'market', "Bộ lọc cổ phiếu": 'market', "Backtest tín hiệu": 'market', "VNINDEX": 'vnindex'}.get(page, 'overview')
+    warmup = data_warmup()
+    if warmup.pending(dataset):
+        with st.spinner("Đang tải trước dữ liệu cho trang này..."), perf_span('warmup.wait', dataset=dataset):
+            error = warmup.wait(dataset)
+        if error is not None:
+            st.warning(f"Tải trước dữ liệu cho trang này thất bại ({error}); đang tải lại.")
 
     # Hiển thị trang tương ứng
     if page == "Tổng quan":
-        show_overview_page(df)
+        with perf_span('load_flow_cube'):
+            cube = load_flow_cube(source_signature(DATA_PATH))
+        with perf_span('show_overview_page'):
+            show_overview_page(cube)
+        datasets = {'Tổng quan': load_data(source_signature(DATA_PATH))}
     elif page == "Chi tiết":
-        show_detail_page(df)
-    else:  # page == "Market"
-        show_market_page(df_trade, df_marketcap, df_price)  # Truyền thêm df_price
+        with perf_span('load_data'):
+            df = load_data(source_signature(DATA_PATH))
+            cube = load_flow_cube(source_signature(DATA_PATH))
+        with perf_span('show_detail_page'):
+            show_detail_page(df, cube)
+        datasets = {'Tổng quan': df}
+    elif page in ("Market", "Bộ lọc cổ phiếu", "Backtest tín hiệu"):
+        with perf_span('load_and_prepare_data'):
+            mm = load_and_prepare_data(VOLUME_PATH, PRICE_PATH, SECTOR_PATH, MARKETCAP_PATH,
+                                       source_signature(VOLUME_PATH, PRICE_PATH, SECTOR_PATH, MARKETCAP_PATH))
+        if page == "Market":
+            with perf_span('show_market_page'):
+                show_market_page(mm)
+        elif page == "Bộ lọc cổ phiếu":
+            with perf_span('show_screener_page'):
+                show_screener_page(mm)
+        else:
+            with perf_span('show_backtest_page'):
+                show_backtest_page(mm)
+        datasets = {'Market': mm}
+    else:  # page == "VNINDEX"
+        with perf_span('load_investor_flows'):
+            flows = load_investor_flows(VNINDEX_PATH, source_signature(VNINDEX_PATH))
+        with perf_span('show_vnindex_page'):
+            show_vnindex_page(flows)
+        datasets = {'VNINDEX': flows}
+
+    # Sau khi trang đầu tiên hiển thị xong mới tải trước dữ liệu của các trang còn lại
+    warmup.start({name: loader for name, loader in dataset_loaders().items() if name != dataset})
+
+    # Bộ nhớ dữ liệu và cache biểu đồ (sau khi hiển thị trang để số liệu cache đã cập nhật)
+    with st.sidebar.expander("Bộ nhớ dữ liệu"), perf_span('memory_report'):
+        st.dataframe(memory_report(datasets).round(2), hide_index=True)
+        st.caption("Cache biểu đồ: {Trúng} trúng, {Trượt} trượt, {Số mục} mục, {MB:.1f} MB".format(**figure_cache().stats()))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
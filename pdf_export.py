@@ -0,0 +1,54 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import plotly.graph_objects as go
+import plotly.io as pio
+from fpdf import FPDF
+
+# Xuất biểu đồ Plotly ra PDF, dùng chung cho dashboard (c1.py) và báo cáo chạy nền (batch_report.py).
+
+# Kích thước ảnh PNG của mỗi biểu đồ
+IMAGE_WIDTH = 1100
+IMAGE_HEIGHT = 600
+IMAGE_SCALE = 2
+
+# Hàm render một biểu đồ ra ảnh PNG (chạy trong tiến trình con)
+def render_chart(fig_json, img_path):
+    """Render biểu đồ dạng JSON ra file PNG bằng kaleido, trả về đường dẫn ảnh."""
+    pio.from_json(fig_json).write_image(img_path, format="png", width=IMAGE_WIDTH, height=IMAGE_HEIGHT, scale=IMAGE_SCALE)
+    return img_path
+
+# Hàm render nhiều biểu đồ song song
+def render_charts(charts, tmpdirname, workers=None):
+    """Render các biểu đồ ra PNG trong `tmpdirname`, mỗi biểu đồ một tác vụ của process pool.
+
+    Biểu đồ được sao chép và đổi sang theme in ấn trước khi render nên đối tượng gốc không bị sửa.
+    `workers=1` (hoặc chỉ có một biểu đồ) thì render tuần tự trong tiến trình hiện tại.
+    """
+    jobs = []
+    for name, fig in charts.items():
+        fig = go.Figure(fig)
+        fig.update_layout(template="plotly_white", font=dict(size=12, color="black"))
+        jobs.append((fig.to_json(), os.path.join(tmpdirname, f"{name}.png")))
+    if workers == 1 or len(jobs) <= 1:
+        return [render_chart(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(jobs))) as pool:
+        return list(pool.map(render_chart, *zip(*jobs)))
+
+# Hàm tạo PDF từ biểu đồ
+def charts_to_pdf(charts, workers=None):
+    """Ghép các biểu đồ (theo thứ tự của dict) thành một PDF khổ A4 ngang, mỗi biểu đồ một trang; trả về bytes."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        image_paths = render_charts(charts, tmpdirname, workers)
+
+        pdf = FPDF(orientation="L", unit="mm", format="A4")
+        for img_path in image_paths:
+            pdf.add_page()
+            img_width = 277
+            img_height = img_width * (IMAGE_HEIGHT / IMAGE_WIDTH)
+            if img_height > 190:
+                img_height = 190
+                img_width = img_height * (IMAGE_WIDTH / IMAGE_HEIGHT)
+            pdf.image(img_path, x=(297 - img_width) / 2, y=(210 - img_height) / 2, w=img_width, h=img_height)
+
+        return pdf.output(dest="S").encode("latin1")
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+import backtest
+
+# Hai mã kiểm tra tay: A có một phiên giá 0 (không giao dịch), B có tín hiệu cắt xuống ở phiên 3
+CLOSE = np.array([[10., 11., 12., 0., 15., 16.],
+                  [20., 18., 18., 21., 24., 20.]])
+GROUPS = np.array([0, 1])
+LABELS = ['A', 'B']
+
+def signals(up_cells, down_cells=()):
+    up, down = np.zeros(CLOSE.shape, dtype=bool), np.zeros(CLOSE.shape, dtype=bool)
+    up[tuple(zip(*up_cells))] = True
+    if down_cells:
+        down[tuple(zip(*down_cells))] = True
+    return up, down
+
+def test_backtest_hand_checked_trades():
+    up, down = signals([(0, 0), (1, 1)], [(1, 3)])
+    (holding, summary, equity), = backtest.backtest_signals(CLOSE, GROUPS, LABELS, up, down, [2])
+    # A mua 10 bán 12 (+20%), B mua 18 bán 21 (+16.67%)
+    assert holding == 2
+    assert list(summary.index) == ['A', 'B', backtest.MARKET_LABEL]
+    np.testing.assert_allclose(summary['LN TB (%)'], [20, 100 / 6, (20 + 100 / 6) / 2])
+    assert list(summary['Số lệnh']) == [1, 1, 2]
+    assert list(summary['Tỷ lệ thắng (%)']) == [100, 100, 100]
+    np.testing.assert_allclose(equity[0], [1, 1.1, 1.2, 1.2, 1.2, 1.2])
+    np.testing.assert_allclose(equity[1], [1, 1, 1, 7 / 6, 7 / 6, 7 / 6])
+    # Toàn thị trường: phiên 0→1 chỉ A mở (+10%), 1→2 trung bình A +1/11 và B 0%, 2→3 chỉ còn B (+1/6)
+    market = np.cumprod([1, 1.1, 1 + (1 / 11) / 2, 7 / 6, 1, 1])
+    np.testing.assert_allclose(equity[2], market)
+
+def test_backtest_exit_on_cross_and_open_trades():
+    up, down = signals([(0, 0), (1, 1), (1, 4)], [(1, 3)])
+    (_, summary, equity), = backtest.backtest_signals(CLOSE, GROUPS, LABELS, up, down, [4], exit_on_cross=True)
+    # A: 10 → 15 sau 4 phiên (+50%); B: bán sớm ở phiên cắt xuống 3 (18 → 21); lệnh B mua phiên 4 chưa đóng
+    np.testing.assert_allclose(summary.loc[['A', 'B'], 'LN TB (%)'], [50, 100 / 6])
+    assert summary.loc[backtest.MARKET_LABEL, 'Số lệnh'] == 2
+    # Phiên giá 0 của A giữ nguyên giá 12 (lợi nhuận 0), phiên sau tính từ 12 lên 15
+    np.testing.assert_allclose(equity[0], [1, 1.1, 1.2, 1.2, 1.5, 1.5])
+
+def test_crossover_signals_ma_rule():
+    close = np.array([[3., 2., 1., 2., 3., 4.]])
+    up, down = backtest.crossover_signals(close, 'MA', ma_window=3)
+    # MA3: NaN, NaN, 2, 5/3, 2, 3 → giá cắt lên ở phiên 3
+    assert np.array_equal(up[0], [False, False, False, True, False, False])
+    assert not down.any()
+
+def test_crossover_signals_macd_matches_pandas():
+    close = np.round(10 + np.cumsum(np.random.default_rng(0).normal(size=(5, 120)), axis=1), 2)
+    up, down = backtest.crossover_signals(close, 'MACD', fast=5, slow=13, signal=4)
+    for row, series in enumerate(close):
+        series = pd.Series(series)
+        macd = series.ewm(span=5, adjust=False).mean() - series.ewm(span=13, adjust=False).mean()
+        signal = macd.ewm(span=4, adjust=False).mean()
+        assert np.array_equal(up[row], ((macd > signal) & (macd.shift(1) <= signal.shift(1))).to_numpy())
+        assert np.array_equal(down[row], ((macd < signal) & (macd.shift(1) >= signal.shift(1))).to_numpy())
+        assert up[row].any() and down[row].any()
+
+def test_parameter_grid_skips_fast_not_below_slow():
+    grid = backtest.parameter_grid('MACD', fast_spans=(5, 12, 26), slow_spans=(12, 26))
+    assert [(params['fast'], params['slow']) for params in grid] == [(5, 12), (5, 26), (12, 26)]
+    assert backtest.parameter_grid('MA', ma_windows=(50, 200)) == [dict(rule='MA', ma_window=50), dict(rule='MA', ma_window=200)]
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_backtest_grid_matches_direct_call(workers):
+    close = np.round(10 + np.cumsum(np.random.default_rng(1).normal(size=(8, 150)), axis=1), 2)
+    groups = np.array([0, 0, 1, 1, 2, 2, -1, 0])
+    labels = ['X', 'Y', 'Z']
+    grid = backtest.parameter_grid('MACD', fast_spans=(5, 8), slow_spans=(13,), signal_spans=(4,))
+    results = backtest.run_backtest_grid(close, groups, labels, grid, [3, 10], workers=workers)
+    assert [(result.params['fast'], result.params['holding']) for result in results] == [(5, 3), (5, 10), (8, 3), (8, 10)]
+    up, down = backtest.crossover_signals(close, 'MACD', fast=8, slow=13, signal=4)
+    (_, summary, equity), = backtest.backtest_signals(close, groups, labels, up, down, [10])
+    pd.testing.assert_frame_equal(results[3].summary, summary)
+    assert np.array_equal(results[3].equity, equity)
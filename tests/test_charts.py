@@ -0,0 +1,28 @@
+import numpy as np
+import c1
+
+def test_lttb_keeps_endpoints_and_extremes():
+    rng = np.random.default_rng(0)
+    values = np.cumsum(rng.normal(size=5000))
+    values[1234] = values.max() + 100
+    values[3210] = values.min() - 100
+    indices = c1.lttb_indices(values, 300)
+    assert len(indices) == 300
+    assert indices[0] == 0 and indices[-1] == len(values) - 1
+    assert (np.diff(indices) > 0).all()
+    assert {1234, 3210} <= set(indices)
+    assert np.array_equal(c1.lttb_indices(values[:200], 300), np.arange(200))
+
+def test_bubble_layout_is_deterministic_spiral():
+    rng = np.random.default_rng(0)
+    groups = rng.integers(0, 4, 200)
+    sizes = rng.lognormal(size=200)
+    sizes[:5] = np.nan
+    x, y = c1.bubble_layout(groups, sizes)
+    x2, y2 = c1.bubble_layout(groups, sizes)
+    assert np.array_equal(x, x2) and np.array_equal(y, y2)
+    assert ((x >= groups) & (x <= groups + 0.8) & (y >= 0) & (y <= 10)).all()
+    for group in range(4):
+        members = np.flatnonzero(groups == group)
+        distance = np.hypot(x[members] - group - 0.4, (y[members] - 5) / 12.5)
+        assert distance.argmin() == np.nanargmax(sizes[members])
@@ -0,0 +1,99 @@
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import pytest
+import c1
+
+# Bảng dòng tiền dạng combined_data: ngành × ngày, khoảng 10% ô ngành × ngày không có dòng nào
+def synthetic_overview(n_dates=90, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2024-01-02', periods=n_dates)
+    rows = [(industry, date) for date in dates for industry in ('Bán lẻ', 'Ngân hàng', 'Y tế', 'Xây dựng')
+            if rng.random() > 0.1]
+    df = pd.DataFrame(rows, columns=['Ngành', 'Date'])
+    # Giá trị nguyên (đồng) để tổng tích lũy và groupby cho cùng kết quả bất kể thứ tự cộng
+    for column in c1.FLOW_COLUMNS:
+        df[column] = rng.integers(-10**6, 10**6, len(df)) * 1000.
+    df.loc[len(df) - 40, c1.FLOW_COLUMNS[0]] = 5e12  # một ngày dòng tiền đột biến
+    return df
+
+# Hàm đọc lại bảng qua CSV như dữ liệu thật
+def overview_from_csv(df):
+    return c1.attach_date_index(c1.read_overview_csv(BytesIO(df.to_csv(index=False).encode())))
+
+def assert_same_cube(result, expected):
+    assert np.array_equal(result.industries, expected.industries)
+    assert np.array_equal(result.dates, expected.dates)
+    assert np.array_equal(result.cumsum, expected.cumsum)
+    assert np.array_equal(result.row_counts, expected.row_counts)
+    for name in ('count', 'event_day', 'event_cell', 'event_value'):
+        assert np.array_equal(getattr(result.anomalies, name), getattr(expected.anomalies, name)), name
+    for name in ('mean', 'var', 'event_mean', 'event_std'):
+        np.testing.assert_allclose(getattr(result.anomalies, name), getattr(expected.anomalies, name), rtol=1e-12)
+
+@pytest.mark.parametrize('start, end', [('2024-01-02', '2024-05-06'), ('2024-02-10', '2024-03-01'),
+                                        ('2024-03-05', '2024-03-05'), ('2023-01-01', '2023-12-31')])
+def test_range_totals_matches_groupby(start, end):
+    df = overview_from_csv(synthetic_overview())
+    cube = c1.build_flow_cube(df)
+    mask = (df['Date'] >= start) & (df['Date'] <= end)
+    expected = df[mask].groupby('Ngành', observed=True)[c1.FLOW_COLUMNS].sum()
+    result = cube.range_totals(start, end)
+    assert list(result.index) == list(expected.index)
+    assert np.array_equal(result.to_numpy(), expected.to_numpy())
+
+def test_daily_totals_matches_groupby():
+    df = overview_from_csv(synthetic_overview())
+    cube = c1.build_flow_cube(df)
+    column = c1.FLOW_COLUMNS[5]
+    result = cube.daily_totals(column, '2024-02-01', '2024-04-01')
+    window = df[(df['Date'] >= '2024-02-01') & (df['Date'] <= '2024-04-01')]
+    expected = window.groupby('Date')[column].sum()
+    assert np.array_equal(result['Date'].to_numpy(), expected.index.to_numpy())
+    assert np.array_equal(result[column].to_numpy(), expected.to_numpy())
+    assert np.array_equal(result['Kỳ M'].to_numpy(), expected.index.to_period('M').asi8)
+
+def test_filter_by_date_index_matches_mask():
+    df = overview_from_csv(synthetic_overview())
+    for start, end in [('2024-01-01', '2024-01-31'), ('2024-02-03', '2024-02-04'), ('2024-03-15', '2025-01-01')]:
+        expected = df[(df['Date'] >= start) & (df['Date'] <= end)]
+        assert c1.filter_data_by_date(df, start, end).equals(expected)
+
+# Phần nối thêm bắt đầu từ ngày `cut_date`; split_day: dòng đầu của ngày đó đã có trong file cũ (dòng mới rơi vào ngày đã có)
+@pytest.mark.parametrize('cut_date, split_day', [('2024-04-20', False), ('2024-05-03', False), ('2024-03-12', True)])
+def test_append_overview_rows_matches_full_rebuild(cut_date, split_day):
+    raw = synthetic_overview()
+    cut_row = np.flatnonzero(raw['Date'] >= cut_date)[0] + split_day
+    old, new = raw[:cut_row], raw[cut_row:]
+    df = overview_from_csv(old)
+    df, cube = c1.append_overview_rows(df, c1.build_flow_cube(df), new.to_csv(index=False).encode())
+    expected_df = overview_from_csv(raw)
+    assert df.equals(expected_df)
+    assert_same_cube(cube, c1.build_flow_cube(expected_df))
+
+def test_flow_anomalies_match_pandas_ewm():
+    df = overview_from_csv(synthetic_overview())
+    cube = c1.build_flow_cube(df)
+    anomalies = cube.anomalies
+    daily = np.diff(cube.cumsum, axis=0)
+    present = np.diff(cube.row_counts, axis=0) > 0
+    alpha = c1.ewm_alpha(c1.ANOMALY_SPAN)
+    n_events = 0
+    for cell in range(anomalies.mean.size):
+        industry, investor, channel = np.unravel_index(cell, anomalies.mean.shape)
+        days = np.flatnonzero(present[:, industry])
+        values = pd.Series(daily[days, industry, investor, channel])
+        mean = values.ewm(alpha=alpha, adjust=False).mean()
+        var = values.ewm(alpha=alpha, adjust=False).var(bias=True)
+        np.testing.assert_allclose(anomalies.mean.flat[cell], mean.iloc[-1], rtol=1e-9)
+        np.testing.assert_allclose(anomalies.var.flat[cell], var.iloc[-1], rtol=1e-9)
+        std = np.sqrt(var.shift(1))
+        flagged = ((np.arange(len(values)) >= c1.ANOMALY_MIN_DAYS) & (std > 0)
+                   & ((values - mean.shift(1)).abs() >= c1.ANOMALY_Z * std))
+        assert np.array_equal(np.sort(anomalies.event_day[anomalies.event_cell == cell]), days[flagged.to_numpy()])
+        n_events += flagged.sum()
+    assert n_events == len(anomalies.event_day)
+
+    spike_date = df.loc[df[c1.FLOW_COLUMNS[0]] == 5e12, 'Date'].iloc[0]
+    table = anomalies.table(cube, spike_date, spike_date)
+    assert (table['Ròng'] >= 5e12).any()
@@ -0,0 +1,179 @@
+import dataclasses
+import numpy as np
+import pandas as pd
+import pytest
+import c1
+
+# Các file Market dạng wide (Name, Code, cột ngày dd-mm-YYYY) và file ngành hai cấp ICB
+def synthetic_wide(n_codes=30, n_dates=240, seed=0):
+    rng = np.random.default_rng(seed)
+    close = np.round(np.abs(20 + np.cumsum(rng.normal(0, 0.4, (n_codes, n_dates)), axis=1)) + 1, 2)
+    close[rng.random(close.shape) < 0.03] = np.nan
+    close[:3, :20] = np.nan
+    volume = np.round(rng.lognormal(10, 1, (n_codes, n_dates)))
+    volume[:, 5] = 1e6  # một ngày nhiều mã cùng GTGD
+    marketcap = np.round(close * rng.uniform(1e3, 1e5, (n_codes, 1)), 2)
+    codes = [f"M{i:03d}" for i in range(n_codes)]
+    dates = pd.bdate_range('2023-01-02', periods=n_dates).strftime('%d-%m-%Y')
+    level1 = np.array(['Tài chính', 'Công nghiệp', 'Tiêu dùng'])[rng.integers(0, 3, n_codes)]
+    sector = pd.DataFrame({'STT': range(n_codes), 'Mã': codes, 'Tên công ty': codes, 'Sàn': 'HOSE',
+                           'Ngành ICB - cấp 1': level1,
+                           'Ngành ICB - cấp 2': [f"{label} {i % 2}" for i, label in enumerate(level1)]})
+    sector.loc[n_codes - 1, ['Ngành ICB - cấp 1', 'Ngành ICB - cấp 2']] = np.nan
+    wide = {key: pd.DataFrame(values, columns=dates).assign(Name=[f"{code} {key}" for code in codes], Code=codes)
+            for key, values in (('price', close), ('volume', volume), ('marketcap', marketcap))}
+    return {key: df[['Name', 'Code'] + list(dates)] for key, df in wide.items()}, sector
+
+# Hàm ghi các file nguồn và đọc qua load_and_prepare_data với thư mục cache riêng
+def load_market(monkeypatch, folder, wide, sector, n_dates):
+    """`n_dates`: số cột ngày đầu ghi vào mọi file, hoặc dict file → vị trí các cột ngày ghi vào file đó."""
+    folder.mkdir(exist_ok=True)
+    paths = {key: str(folder / f"{key}.csv") for key in ('volume', 'price', 'sector', 'marketcap')}
+    sector.to_csv(paths['sector'], index=False)
+    for key, df in wide.items():
+        positions = n_dates[key] if isinstance(n_dates, dict) else range(n_dates)
+        df.iloc[:, [0, 1] + [2 + i for i in positions]].to_csv(paths[key], index=False)
+    monkeypatch.setattr(c1, 'CACHE_DIR', str(folder / 'cache'))
+    return c1.load_and_prepare_data.__wrapped__(paths['volume'], paths['price'], paths['sector'], paths['marketcap'])
+
+@pytest.fixture
+def market(monkeypatch, tmp_path):
+    monkeypatch.setattr(c1, 'LOAD_WORKERS', 1)
+    wide, sector = synthetic_wide()
+    return load_market(monkeypatch, tmp_path, wide, sector, 240)
+
+def assert_same_market(result, expected):
+    assert result.dates.equals(expected.dates)
+    assert np.array_equal(result.codes, expected.codes)
+    for name in ('close', 'volume', 'marketcap', 'trade_value'):
+        assert np.array_equal(getattr(result, name), getattr(expected, name), equal_nan=True), name
+    for name in c1.TECHNICALS_ARRAYS:
+        assert np.array_equal(getattr(result.technicals, name), getattr(expected.technicals, name), equal_nan=True), name
+    for old, new in zip(result.rollups, expected.rollups):
+        for field in dataclasses.fields(c1.IndustryRollup):
+            values = getattr(old, field.name)
+            assert np.array_equal(values, getattr(new, field.name), equal_nan=values.dtype.kind == 'f'), field.name
+    assert result.daily.equals(expected.daily)
+    for field in dataclasses.fields(c1.RankingIndex):
+        assert np.array_equal(getattr(result.rankings, field.name), getattr(expected.rankings, field.name)), field.name
+
+# Hàm nạp lần lượt các phiên bản file nguồn vào cùng một cache rồi so với dựng lại từ đầu trên phiên bản cuối
+def append_and_rebuild(monkeypatch, tmp_path, versions):
+    monkeypatch.setattr(c1, 'LOAD_WORKERS', 1)
+    wide, sector = synthetic_wide()
+    n_done = len(load_market(monkeypatch, tmp_path / 'inc', wide, sector, versions[0]).dates)
+    calls, widths, daily_done = [], [], []
+    monkeypatch.setattr(c1, 'build_market_matrices', lambda *args: calls.append(args))
+    industry_totals = c1.industry_totals
+    monkeypatch.setattr(c1, 'industry_totals', lambda values, groups: widths.append(values.shape[1]) or industry_totals(values, groups))
+    build_daily_totals = c1.build_daily_totals
+    monkeypatch.setattr(c1, 'build_daily_totals', lambda mm, previous=None: daily_done.append(
+        0 if previous is None else len(previous)) or build_daily_totals(mm, previous))
+    for n_dates in versions[1:]:
+        widths.clear()
+        daily_done.clear()
+        result = load_market(monkeypatch, tmp_path / 'inc', wide, sector, n_dates)
+        # Tổng theo ngành và theo ngày chỉ cộng các ngày mới
+        assert set(widths) == {len(result.dates) - n_done} and daily_done == [n_done]
+        n_done = len(result.dates)
+    monkeypatch.undo()
+    monkeypatch.setattr(c1, 'LOAD_WORKERS', 1)
+    expected = load_market(monkeypatch, tmp_path / 'full', wide, sector, versions[-1])
+    assert not calls  # mỗi lần chỉ đọc các cột mới
+    return result, expected
+
+@pytest.mark.parametrize('n_new', [1, 7])
+def test_appended_dates_match_full_rebuild(monkeypatch, tmp_path, n_new):
+    assert_same_market(*append_and_rebuild(monkeypatch, tmp_path, [240 - n_new, 240]))
+
+def test_partial_append_keeps_column_counts(monkeypatch, tmp_path):
+    # Lần 1 chỉ giá và khối lượng có thêm ngày (file vốn hóa không đổi); lần 2 cả ba file, vốn hóa bỏ trống các ngày của lần 1
+    partial = {'price': range(235), 'volume': range(235), 'marketcap': range(230)}
+    full = {'price': range(240), 'volume': range(240), 'marketcap': [*range(230), *range(235, 240)]}
+    result, expected = append_and_rebuild(monkeypatch, tmp_path, [230, partial, full])
+    assert_same_market(result, expected)
+
+def test_daily_totals_match_nansum(market):
+    for matrix, total, count in ((market.trade_value, 'TradeValue', 'TradeCount'), (market.marketcap, 'MarketCap', 'CapCount')):
+        values = pd.DataFrame(matrix.T.astype(np.float64), index=market.dates)
+        np.testing.assert_allclose(market.daily[total], values.sum(axis=1), rtol=1e-12)
+        assert np.array_equal(market.daily[count], values.count(axis=1))
+
+def test_icb_rollups_match_groupby(market):
+    trade_value = pd.DataFrame(market.trade_value.astype(np.float64))
+    macd_cross = pd.DataFrame(market.technicals.macd_cross)
+    paths = []
+    for level, rollup in enumerate(market.rollups):
+        # Nhóm là đường dẫn ngành từ cấp 1 đến cấp này; mã thiếu ngành ở một cấp bất kỳ không thuộc nhóm nào
+        paths = [(paths[parent] if level else ()) + (label,) for label, parent in zip(rollup.labels, rollup.parents)]
+        code_paths = list(zip(*market.icb[:level + 1]))
+        members = np.array([-1 if pd.isna(list(path)).any() else paths.index(path) for path in code_paths])
+        assert np.array_equal(rollup.members, members)
+        assert len(set(paths)) == len(paths)
+        in_group = members >= 0
+        np.testing.assert_allclose(rollup.trade_value, trade_value[in_group].groupby(members[in_group]).sum(min_count=1),
+                                   rtol=1e-12)
+        assert np.array_equal(rollup.macd_count, macd_cross[in_group].groupby(members[in_group]).sum())
+
+@pytest.mark.parametrize('k', [5, 50])
+def test_top_k_codes_matches_stable_sort(market, k):
+    groups = np.asarray(pd.Categorical(market.industries).codes)
+    values = market.trade_value
+    top, group_top = c1.top_k_codes(values, k, groups, groups.max() + 1)
+    for col in (0, 5, 100, values.shape[1] - 1):
+        # Giảm dần, cùng giá trị thì mã đứng trước xếp trước
+        column = pd.Series(values[:, col]).dropna().sort_values(ascending=False, kind='stable')
+        assert list(top[col][top[col] >= 0]) == list(column.index[:k])
+        for group in range(groups.max() + 1):
+            ranked = group_top[group, col]
+            assert list(ranked[ranked >= 0]) == list(column[groups[column.index] == group].index[:k])
+
+def test_ranking_index_extend_matches_full_build(market):
+    split = 150
+    head = c1.build_ranking_index(market.trade_value[:, :split], market.marketcap[:, :split], market.industries)
+    tail = c1.build_ranking_index(market.trade_value[:, split:], market.marketcap[:, split:], market.industries)
+    extended = head.extend(tail)
+    for field in dataclasses.fields(c1.RankingIndex):
+        assert np.array_equal(getattr(extended, field.name), getattr(market.rankings, field.name)), field.name
+
+def test_screen_stocks_matches_pandas(market):
+    col = 200
+    criteria = c1.ScreenCriteria(ma_window=20, price_vs_ma='trên', return_days=10, return_min=-5.,
+                                 trade_percentile=30., cap_rank=25, industries=('Tài chính', 'Tiêu dùng'))
+    result = c1.screen_stocks(market, col, criteria)
+    close = pd.DataFrame(market.close.T.astype(np.float64))
+    ma = close.rolling(20).mean().iloc[col]
+    returns = (close.iloc[col] / close.iloc[col - 10] - 1) * 100
+    trade_value = pd.Series(market.trade_value[:, col].astype(np.float64))
+    cap_rank = pd.Series(market.marketcap[:, col].astype(np.float64)).rank(ascending=False, method='min')
+    mask = ((close.iloc[col] > ma) & (returns >= -5) & (trade_value.rank(pct=True) * 100 >= 30) & (cap_rank <= 25)
+            & pd.Series(market.icb[0]).isin(criteria.industries))
+    assert list(result['Mã']) == list(market.codes[mask.to_numpy()])
+    np.testing.assert_allclose(result['MA20'], ma[mask], rtol=1e-12)
+    np.testing.assert_allclose(result['% 10 phiên'], returns[mask], rtol=1e-12)
+
+def test_appended_columns_and_rows(tmp_path):
+    path = tmp_path / 'price.csv'
+    path.write_bytes(b'Name,Code,02-01-2024,03-01-2024\r\nA co,AAA,1.5,2\r\nB co,BBB,,3\r\n')
+    previous = dict(c1.file_fingerprint(path), fields=c1.csv_header_fields(path))
+    path.write_bytes(b'Name,Code,02-01-2024,03-01-2024,04-01-2024,05-01-2024\r\nA co,AAA,1.5,2,2.5,\r\nB co,BBB,,3,4,5\r\n')
+    columns, values = c1.appended_columns(path, previous)
+    assert columns == ['04-01-2024', '05-01-2024']
+    np.testing.assert_array_equal(values, [[2.5, np.nan], [4, 5]])
+    path.write_bytes(b'Name,Code,02-01-2024,03-01-2024,04-01-2024\r\nA co,AAA,1.5,9,2.5\r\nB co,BBB,,3,4\r\n')
+    assert c1.appended_columns(path, previous) is None  # cột cũ bị sửa
+
+    path = tmp_path / 'combined.csv'
+    path.write_bytes(b'Date,Value\n2024-01-02,1\n')
+    previous = c1.file_fingerprint(path)
+    path.write_bytes(b'Date,Value\n2024-01-02,1\n2024-01-03,2\n')
+    assert c1.appended_rows(path, previous) == b'Date,Value\n2024-01-03,2\n'
+    path.write_bytes(b'Date,Value\n2024-01-02,5\n2024-01-03,2\n')
+    assert c1.appended_rows(path, previous) is None
+
+def test_memory_report_on_frozen_market(market):
+    # Ma trận trả về là chỉ đọc (kể cả mảng object codes/names); đo bộ nhớ không được cần bộ đệm ghi được
+    assert not market.codes.flags.writeable and not pd.get_option('mode.copy_on_write')
+    report = c1.memory_report({'Market': market}).set_index('Dữ liệu')
+    assert report.loc['Market', 'Sau (MB)'] <= report.loc['Market', 'Trước (MB)']
+    assert report.loc['Market', 'Sau (MB)'] * 2**20 > market.close.nbytes
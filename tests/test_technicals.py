@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+import c1
+
+# Ma trận giá mã × ngày: bước ngẫu nhiên có NaN ở đầu/giữa chuỗi và một mã giá không đổi (cửa sổ MA200 hằng)
+def synthetic_close(n_codes=12, n_dates=260, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.2, (n_codes, n_dates)), axis=1)
+    close = np.round(np.abs(close) + 1, 2)
+    close[1, :30] = np.nan
+    close[2, 100:103] = np.nan
+    close[3, -4:] = np.nan
+    close[4] = 25.5
+    close[5, 150:] = close[5, 150]
+    return close.astype(np.float32)
+
+def test_rolling_mean_matches_pandas():
+    close = synthetic_close().astype(np.float64)
+    expected = pd.DataFrame(close.T).rolling(c1.MA_WINDOW).mean().to_numpy().T
+    result = c1.rolling_mean(close, c1.MA_WINDOW)
+    np.testing.assert_allclose(result, expected, rtol=1e-12)
+    assert np.array_equal(result[4, c1.MA_WINDOW - 1:], close[4, c1.MA_WINDOW - 1:])
+
+@pytest.mark.parametrize('n_new', [1, 5, 70])
+def test_incremental_update_matches_full_rebuild(n_new):
+    close = synthetic_close()
+    full = c1.compute_technicals(close)
+    old = close[:, :-n_new]
+    state = c1.IndicatorState.from_technicals(old, c1.compute_technicals(old))
+    new_columns = [state.update(close[:, j]) for j in range(old.shape[1], close.shape[1])]
+    for name, values in zip(c1.TECHNICALS_ARRAYS, zip(*new_columns)):
+        expected = getattr(full, name)[:, -n_new:]
+        assert np.array_equal(np.column_stack(values), expected, equal_nan=True), name
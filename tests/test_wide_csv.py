@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import wide_csv
+
+# File wide có mã trùng, ô trống, cột không phải ngày và các cột ngày không theo thứ tự
+def write_wide_csv(path, n_codes=200, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = list(pd.bdate_range('2024-01-01', periods=30).strftime('%d-%m-%Y'))
+    columns = dates[10:] + ['Ghi chú'] + dates[:10]
+    values = np.round(rng.uniform(1, 100, (n_codes, len(columns))), 2)
+    values[rng.random(values.shape) < 0.1] = np.nan
+    codes = [f"M{i % (n_codes - 20):03d}" for i in range(n_codes)]  # 20 dòng cuối trùng mã
+    df = pd.DataFrame(values, columns=columns)
+    df.insert(0, 'Code', codes)
+    df.insert(0, 'Name', [f"Công ty, {code}" for code in codes])
+    df.to_csv(path, index=False)
+
+def test_read_wide_matrix_matches_pandas(tmp_path):
+    path = tmp_path / 'price.csv'
+    write_wide_csv(path)
+    names, codes, dates, values, file_codes = wide_csv.read_wide_matrix(path)
+    df = pd.read_csv(path, dtype={'Name': str, 'Code': str})
+    assert list(file_codes) == list(df['Code'])
+    df = df.drop_duplicates('Code')
+    long = df.drop(columns=['Name', 'Ghi chú']).melt(id_vars='Code', var_name='Date')
+    long['Date'] = pd.to_datetime(long['Date'], format='%d-%m-%Y')
+    expected = long.pivot(index='Code', columns='Date', values='value').reindex(df['Code'])
+    assert list(codes) == list(df['Code']) and list(names) == list(df['Name'])
+    assert dates.equals(expected.columns)
+    assert np.array_equal(values, expected.to_numpy(), equal_nan=True)
+
+def test_read_wide_matrix_chunks_match_serial(tmp_path, monkeypatch):
+    path = tmp_path / 'price.csv'
+    write_wide_csv(path)
+    serial = wide_csv.read_wide_matrix(path)
+    monkeypatch.setattr(wide_csv, 'CHUNK_BYTES', 2000)
+    with ThreadPoolExecutor(4) as pool:  # cùng giao diện map với process pool
+        chunked = wide_csv.read_wide_matrix(path, pool, workers=4)
+    for old, new in zip(serial[:3] + serial[4:], chunked[:3] + chunked[4:]):
+        assert np.array_equal(np.asarray(old), np.asarray(new))
+    assert np.array_equal(serial[3], chunked[3], equal_nan=True)
@@ -0,0 +1,62 @@
+import os
+from io import BytesIO
+import numpy as np
+import pandas as pd
+
+# Đọc CSV dạng wide (Name, Code, các cột ngày dd-mm-YYYY) thành ma trận, dùng cho dữ liệu Market của c1.py.
+# Phần dữ liệu được chia thành các khối dòng để nhiều tiến trình con cùng parse.
+
+# Kích thước tối thiểu (bytes) của một khối dòng gửi cho tiến trình con
+CHUNK_BYTES = 4 * 2**20
+# Cột nhãn luôn đọc dạng chuỗi để mọi khối dòng cho cùng kiểu dữ liệu
+LABEL_DTYPES = {'Name': str, 'Code': str}
+
+# Hàm chia file thành các khối dòng
+def row_chunks(file_path, n_chunks):
+    """(header, các khoảng byte (start, end) của phần dữ liệu), mỗi khoảng bắt đầu ở đầu một dòng."""
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        bounds = [f.tell()]
+        for i in range(1, n_chunks):
+            f.seek(max(bounds[-1], bounds[0] + (size - bounds[0]) * i // n_chunks))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return header, [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+# Hàm parse một khối dòng (chạy trong tiến trình con)
+def read_rows(file_path, header=None, start=0, end=None):
+    """(names, codes, values, date_cols) của các dòng trong khoảng byte [start, end) (header None: cả file);
+    values theo thứ tự cột ngày `date_cols` trong file."""
+    if header is None:
+        df = pd.read_csv(file_path, dtype=LABEL_DTYPES)
+    else:
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            df = pd.read_csv(BytesIO(header + f.read(end - start)), dtype=LABEL_DTYPES)
+    date_cols = [col for col in df.columns if col not in ('Name', 'Code')]
+    return df['Name'].to_numpy(), df['Code'].to_numpy(), df[date_cols].to_numpy(dtype=np.float64), date_cols
+
+# Hàm đọc CSV dạng wide thành ma trận
+def read_wide_matrix(file_path, pool=None, workers=1):
+    """Đọc CSV wide thành (names, codes, dates, values, file_codes) không cần melt.
+
+    Dòng trùng mã chỉ giữ dòng đầu; `file_codes` là mã của mọi dòng theo thứ tự trong file (kể cả dòng trùng).
+    Với `pool` (ProcessPoolExecutor) file được chia thành tối đa `workers` khối dòng (mỗi khối ít nhất
+    CHUNK_BYTES) parse song song rồi ghép theo thứ tự; kết quả giống hệt khi đọc tuần tự.
+    """
+    n_chunks = min(workers, os.path.getsize(file_path) // CHUNK_BYTES) if pool is not None else 1
+    header, ranges = row_chunks(file_path, max(n_chunks, 1))
+    if len(ranges) > 1:
+        parts = list(pool.map(read_rows, *zip(*[(file_path, header, start, end) for start, end in ranges])))
+        names, file_codes, values = (np.concatenate(arrays) for arrays in list(zip(*parts))[:3])
+        date_cols = parts[0][3]
+    else:
+        names, file_codes, values, date_cols = read_rows(file_path)
+
+    first = np.flatnonzero(~pd.Index(file_codes).duplicated())
+    dates = pd.to_datetime(pd.Index(date_cols), format='%d-%m-%Y', errors='coerce')
+    valid = np.flatnonzero(~dates.isna())
+    order = valid[np.argsort(dates[valid], kind='stable')]
+    return names[first], file_codes[first], dates[order], values[np.ix_(first, order)], file_codes